@@ -0,0 +1,94 @@
+"""
+Benchmark: report-by-exception telemetry in the DataBase agent.
+
+Runs the virtual inverter's plant model in simulated time under a steady
+setpoint (constant discharge and reactive power), samples it every 4 s like the
+DataBase agent's poll, decodes the registers with the agent's register map and
+feeds the samples through its ChangeDetector with the deadbands from the shared
+config. Compares what downstream consumers receive with and without change
+detection: messages, stored rows, fields, and the bytes of the pubsub messages
+and log lines.
+
+    python3 bench_change_detection.py
+    python3 bench_change_detection.py --hours 24 --noise 0.001 --heartbeat 60
+"""
+
+import argparse
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Virtual_Inverter'))
+
+from DBAgent.change_detection import ChangeDetector
+from DBAgent.register_map import INVERTER_REGISTER_MAP
+from VirtualInverter import plant as inverter_plant
+
+
+def steady_plant(noise, seed):
+    plant = inverter_plant.InverterPlant(noise=noise, seed=seed, battery_capacity_wh=50000)
+    # Discharge at 5 A all day in reactive power mode at 20 % of rated S
+    plant.write_holding_registers(inverter_plant.WORKING_MODE, [inverter_plant.REACTIVE_POWER_MODE, 2000])
+    plant.write_holding_registers(inverter_plant.DISCHARGE_CURRENT, [50])
+    plant.write_holding_registers(inverter_plant.DISCHARGE_WINDOW, [0, 0, 23, 59])
+    return plant
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type=float, default=6.0, help='simulated operating time')
+    parser.add_argument('--period', type=float, default=4.0, help='sample period in s')
+    parser.add_argument('--noise', type=float, default=0.0005, help='relative measurement noise of the plant')
+    parser.add_argument('--heartbeat', type=float, default=None, help='snapshot interval in s (default: config)')
+    parser.add_argument('--config', default=os.path.join(HERE, '..', 'config'))
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = json.load(file)
+    deadbands = config.get('telemetry_deadbands', {})
+    heartbeat = args.heartbeat if args.heartbeat is not None else float(config.get('telemetry_heartbeat_interval', 60))
+
+    clock = [0.0]
+    detector = ChangeDetector(deadbands=deadbands, heartbeat_interval=heartbeat, clock=lambda: clock[0])
+    plant = steady_plant(args.noise, seed=1)
+    addresses = INVERTER_REGISTER_MAP.addresses
+
+    totals = {'full': {'messages': 0, 'fields': 0, 'bytes': 0, 'log_bytes': 0},
+              'changes': {'messages': 0, 'fields': 0, 'bytes': 0, 'log_bytes': 0}}
+    samples = int(args.hours * 3600 / args.period)
+    for index in range(samples):
+        clock[0] = index * args.period
+        plant.step(now=plant.last_step + args.period)
+        words = [plant.inputs[address] for address in addresses]
+        decoded = INVERTER_REGISTER_MAP.decode_one(words)
+        timestamp = f"sample {index:08d}"
+
+        full = dict(decoded, device_id='inverter1', timestamp=timestamp)
+        totals['full']['messages'] += 1
+        totals['full']['fields'] += len(decoded)
+        totals['full']['bytes'] += len(json.dumps(full))
+        totals['full']['log_bytes'] += len(f"Successfully read inverter regs of inverter1: {decoded}")
+
+        changes, snapshot = detector.update('inverter1', decoded)
+        if changes:
+            message = dict(changes, device_id='inverter1', timestamp=timestamp, snapshot=snapshot)
+            totals['changes']['messages'] += 1
+            totals['changes']['fields'] += len(changes)
+            totals['changes']['bytes'] += len(json.dumps(message))
+            totals['changes']['log_bytes'] += len(f"Telemetry {'snapshot' if snapshot else 'change'} of inverter1: "
+                                                  f"{changes}")
+
+    print(f"{samples} samples over {args.hours:g} h, noise {args.noise * 100:g} %, heartbeat {heartbeat:g} s")
+    print(f"deadbands: {deadbands}")
+    print(f"{'':<26}{'every sample':>14}{'changes only':>14}{'reduction':>11}")
+    for key, label in (('messages', 'messages / stored rows'), ('fields', 'fields'),
+                       ('bytes', 'pubsub message bytes'), ('log_bytes', 'log line bytes')):
+        full, changed = totals['full'][key], totals['changes'][key]
+        print(f"{label:<26}{full:>14}{changed:>14}{100.0 * (1 - changed / full):>10.1f}%")
+    print(f"detector: {detector.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark: the DataBase agent's SQLite write path under concurrent readers.
+
+A writer thread inserts inverter_registers rows as fast as it can while reader
+threads, standing in for the other agents, poll the latest row of
+inverter_registers and safety_data (ORDER BY seq DESC LIMIT 1) on their own
+connections. The tables and indexes are DBAgent's (schema.py). Two set-ups:
+
+  - before: default rollback journal, synchronous=FULL, one commit per row
+    (what DBAgent did)
+  - after: WAL, synchronous=NORMAL, rows committed in groups by DBAgent's
+    GroupCommitWriter
+
+Reports inserts per second, commit latency and the readers' query latency and
+"database is locked" errors. The readers use a short busy timeout so that
+contention shows up as errors instead of as multi-second stalls. Run it on the
+Pi's SD card (--dir) for representative fsync costs.
+
+    python3 bench_db_write_path.py
+    python3 bench_db_write_path.py --dir ~/Log_Files --seconds 10 --readers 6
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.db_writer import GroupCommitWriter, open_database
+from DBAgent.schema import INDEXES, create_table_sql, now_ms
+
+TABLES = ('inverter_registers', 'safety_data')
+
+INSERT = '''INSERT INTO inverter_registers (ts_ms, device_id, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC,
+            a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# The latest-row queries the control agents and SafetyAgent run
+READS = [
+    '''SELECT a_phase_voltage, active_power, reactive_power, apparent_power FROM inverter_registers
+       WHERE device_id = 'inverter1' ORDER BY seq DESC LIMIT 1''',
+    "SELECT modbus_comm, master_switch FROM safety_data ORDER BY seq DESC LIMIT 1",
+]
+
+
+def create_schema(conn):
+    """The tables and indexes DBAgent.init_database creates for TABLES."""
+    for table in TABLES:
+        conn.execute(create_table_sql(table))
+    for name, table, columns in INDEXES:
+        if table in TABLES:
+            conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+
+def row(index):
+    return (now_ms(), 'inverter1', 400.0, 200.0, 60, 240.0 + index % 10 * 0.1, 8.3, 2000, 1000, 2236, 2)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Reader(threading.Thread):
+    def __init__(self, path, timeout, stop):
+        super().__init__(daemon=True)
+        self.path = path
+        self.timeout = timeout
+        self.stop = stop
+        self.latencies = []
+        self.locked = 0
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        index = 0
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            try:
+                conn.execute(READS[index % len(READS)]).fetchall()
+                self.latencies.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                self.locked += 1
+            index += 1
+            time.sleep(0.005)
+        conn.close()
+
+
+def run(label, path, seconds, readers, reader_timeout, grouped, batch, delay):
+    if grouped:
+        conn = open_database(path, journal_mode='WAL', synchronous='NORMAL')
+    else:
+        conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.execute("INSERT INTO safety_data (ts_ms, remote_comm, modbus_comm, master_switch) VALUES (?, 1, 1, 1)",
+                 (now_ms(),))
+    conn.commit()
+    writer = GroupCommitWriter(conn, max_batch=batch, max_delay=delay) if grouped else None
+
+    stop = threading.Event()
+    threads = [Reader(path, reader_timeout, stop) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    commit_latencies = []
+    inserted = 0
+    locked_writes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        try:
+            if grouped:
+                writer.insert(INSERT, row(inserted))
+            else:
+                conn.execute(INSERT, row(inserted))
+                commit_start = time.perf_counter()
+                conn.commit()
+                commit_latencies.append(time.perf_counter() - commit_start)
+            inserted += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked_writes += 1
+            conn.rollback()
+    if grouped:
+        writer.flush()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    conn.close()
+
+    read_latencies = [latency for thread in threads for latency in thread.latencies]
+    print(f"{label}")
+    print(f"  inserts/s            {inserted / elapsed:10.0f}   ({inserted} rows, {locked_writes} locked writes)")
+    if grouped:
+        stats = writer.stats()
+        print(f"  commits              {stats['commits']:10d}   ({stats['rows_per_commit']:.0f} rows each, "
+              f"mean {stats['commit_ms_mean']:.2f} ms, max {stats['commit_ms_max']:.2f} ms)")
+    else:
+        print(f"  commits              {len(commit_latencies):10d}   (1 row each, "
+              f"mean {statistics.mean(commit_latencies) * 1000:.2f} ms, "
+              f"max {max(commit_latencies) * 1000:.2f} ms)")
+    print(f"  reader queries       {len(read_latencies):10d}   (p50 {percentile(read_latencies, 0.5) * 1000:.3f} ms, "
+          f"p99 {percentile(read_latencies, 0.99) * 1000:.3f} ms)")
+    print(f"  'database is locked' {sum(thread.locked for thread in threads):10d}")
+    return inserted / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=None, help='directory for the test databases (default: a temp dir)')
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration of each run')
+    parser.add_argument('--readers', type=int, default=6, help='concurrent reader connections')
+    parser.add_argument('--reader-timeout', type=float, default=0.01, help='reader busy timeout in s')
+    parser.add_argument('--batch', type=int, default=50, help='db_commit_batch_size')
+    parser.add_argument('--delay', type=float, default=2.0, help='db_commit_interval in s')
+    args = parser.parse_args()
+
+    directory = os.path.expanduser(args.dir) if args.dir else tempfile.mkdtemp(prefix='bench_db_')
+    before_path = os.path.join(directory, 'bench_before.db')
+    after_path = os.path.join(directory, 'bench_after.db')
+    for path in (before_path, after_path):
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f"{args.readers} readers, {args.seconds:g} s per run, databases in {directory}")
+    before = run("before: rollback journal, synchronous=FULL, commit per row", before_path, args.seconds,
+                 args.readers, args.reader_timeout, grouped=False, batch=1, delay=0)
+    after = run(f"after: WAL, synchronous=NORMAL, group commit of {args.batch} rows / {args.delay:g} s", after_path,
+                args.seconds, args.readers, args.reader_timeout, grouped=True, batch=args.batch, delay=args.delay)
+    print(f"insert throughput: {after / before:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: reacting to RemoteInputs.txt changes, polling against inotify, and
+torn reads of files rewritten in place.
+
+Latency: a writer thread changes QVVMax in a copy of RemoteInputs.txt --writes
+times, one to two poll intervals apart (DBAgent.input_files.update_input_file),
+while the reader waits for the new version with DBAgent.dso_inputs.DSOInputService:
+
+  - polling: the file is stat'ed every --poll-interval seconds, as
+    Interupt_Detection.py read it every 2 s
+  - inotify: the service wakes up when the file is renamed into place
+
+Torn reads: for --seconds a writer rewrites the file as fast as it can and a
+reader reads and parses it as fast as it can, counting the reads that do not
+parse (an empty or half-written file):
+
+  - in place: open(path, 'w') and write, what SafetyAgent did
+  - rename: write_input_file, a temporary file renamed over the file
+
+    python3 bench_dso_inputs.py
+    python3 bench_dso_inputs.py --writes 20 --poll-interval 0.5 --dir ~/Log_Files
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.dso_inputs import DSOInputService
+from DBAgent.input_files import format_input_lines, parse_input_lines, read_input_file, update_input_file, \
+    write_input_file
+
+FILE_NAME = 'RemoteInputs.txt'
+
+VALUES = {'fix_power_mode': 1, 'voltage_regulation_mode': 0, 'ESC_volt_reg_mode': 0, 'fix_real_power': -300,
+          'fix_reactive_power': -300, 'QVVMax': 1000, 'VVVMax_Per': 5.0, 'Low_Volt_Lmt': 0.97,
+          'High_Volt_Lmt': 1.03, 'ESC_VA': 900, 'ESC_VA_steps': 200, 'ESC_Repeat_Time': 10}
+
+
+def latencies(directory, writes, use_inotify, poll_interval):
+    """Seconds from each write to the service handing on its version."""
+    path = os.path.join(directory, FILE_NAME)
+    write_input_file(path, VALUES)
+    written = {}
+    seen = {}
+
+    def on_version(version):
+        seen[version['values']['QVVMax']] = time.perf_counter()
+
+    service = DSOInputService(directory, on_version, files={FILE_NAME: 'remote'}, heartbeat_interval=None,
+                              poll_interval=poll_interval, use_inotify=use_inotify)
+    service.start()
+
+    def writer():
+        for index in range(writes):
+            time.sleep(random.uniform(1, 2) * poll_interval)
+            written[2000 + index] = time.perf_counter()
+            update_input_file(path, QVVMax=2000 + index)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    deadline = None
+    while len(seen) <= writes:
+        # A poll every poll_interval; with inotify the wait ends at the next write
+        service.run_once(poll_interval)
+        if not thread.is_alive():
+            deadline = deadline or time.perf_counter() + 2 * poll_interval
+            if time.perf_counter() > deadline:
+                break
+    thread.join()
+    stats = service.stats()
+    service.stop()
+    return [seen[key] - written[key] for key in written if key in seen], stats
+
+
+def torn_reads(directory, seconds, atomic):
+    """(reads, reads that did not parse, writes) with a writer and a reader racing for seconds."""
+    path = os.path.join(directory, FILE_NAME)
+    write_input_file(path, VALUES)
+    stop = threading.Event()
+    counts = {'writes': 0}
+
+    def writer():
+        values = dict(VALUES)
+        while not stop.is_set():
+            values['QVVMax'] = 1000 + counts['writes'] % 100
+            if atomic:
+                write_input_file(path, values)
+            else:
+                with open(path, 'w') as file:
+                    file.write(format_input_lines(values))
+            counts['writes'] += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    reads = failed = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        try:
+            with open(path) as file:
+                parse_input_lines(file.read())
+        except ValueError:
+            failed += 1
+        reads += 1
+    stop.set()
+    thread.join()
+    read_input_file(path)
+    return reads, failed, counts['writes']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writes', type=int, default=8, help='changes written for the latency')
+    parser.add_argument('--poll-interval', type=float, default=2, help='seconds between polls')
+    parser.add_argument('--seconds', type=float, default=3, help='seconds of racing writer and reader')
+    parser.add_argument('--dir', default=None, help='directory for the test files (default: a temp dir)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_dso_', dir=os.path.expanduser(args.dir) if args.dir else None)
+    print(f"latency from write to version, {args.writes} writes")
+    for label, use_inotify in (('polling', False), ('inotify', True)):
+        samples, stats = latencies(directory, args.writes, use_inotify, args.poll_interval)
+        samples_ms = [sample * 1000 for sample in samples]
+        print(f"  {label:8s} ({stats['mode']}) median {statistics.median(samples_ms):8.2f} ms  "
+              f"max {max(samples_ms):8.2f} ms  ({len(samples)} of {args.writes} seen)")
+
+    print(f"reads of a file rewritten continuously for {args.seconds:g} s")
+    for label, atomic in (('in place', False), ('rename', True)):
+        reads, failed, writes = torn_reads(directory, args.seconds, atomic)
+        print(f"  {label:8s} {writes:7d} writes  {reads:7d} reads  {failed:6d} torn ({failed / reads:.2%})")
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: analysing telemetry history row by row from SQLite against a
+columnar export.
+
+Builds an inverter_registers table of --rows rows (several inverters, one row
+per inverter every few seconds) and computes the mean a_phase_voltage and
+active_power of every device three ways:
+
+  - rows: SELECT over the range and a Python loop over the row tuples, what
+    the analysis scripts do today
+  - export: DBAgent.export.export_npy, chunked, once
+  - mmap: load_npy and the same means with NumPy on the memory-mapped columns
+
+Also reports the peak Python memory of each step (tracemalloc, in a second
+run), which stays bounded for the export however long the range is. With
+pyarrow installed the Parquet export is timed as well.
+
+    python3 bench_export.py
+    python3 bench_export.py --rows 5000000 --dir ~/Log_Files
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent import export
+from DBAgent.db_writer import open_database
+from DBAgent.schema import INDEXES, TABLES, create_table_sql
+
+START_MS = 1700000000000
+
+GENERATE = '''
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+    INSERT INTO inverter_registers (ts_ms, device_id, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC,
+        a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status)
+    SELECT ? + (i / ?) * ?, 'inverter' || (i % ? + 1), 400.0, 200.0, 60 + (i / 1000) % 30,
+           240.0 + (i % 17) * 0.1, 8.3, 2000 + (i % 60) * 10, 1000, 2236, 2
+    FROM n
+'''
+
+ROWS_QUERY = '''
+    SELECT device_id, a_phase_voltage, active_power FROM inverter_registers
+    WHERE ts_ms >= ? AND ts_ms < ? ORDER BY ts_ms, seq
+'''
+
+
+def measured(function, *args, **kwargs):
+    """
+    (result, seconds, peak traced MB) of function(*args, **kwargs). Run twice:
+    timed, then under tracemalloc, which slows allocations down.
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def means_from_rows(conn, start_ms, end_ms):
+    sums = {}
+    for device_id, voltage, power in conn.execute(ROWS_QUERY, (start_ms, end_ms)).fetchall():
+        total = sums.setdefault(device_id, [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += voltage
+        total[2] += power
+    return {device_id: (voltage / count, power / count) for device_id, (count, voltage, power) in sums.items()}
+
+
+def means_from_npy(out_dir):
+    meta, arrays = export.load_npy(out_dir)
+    codes = arrays['device_id']
+    counts = np.bincount(codes)
+    voltage = np.bincount(codes, weights=arrays['a_phase_voltage']) / counts
+    power = np.bincount(codes, weights=arrays['active_power']) / counts
+    return {device_id: (voltage[code], power[code]) for code, device_id in enumerate(meta['devices'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000000, help='rows of inverter_registers')
+    parser.add_argument('--devices', type=int, default=3, help='inverters')
+    parser.add_argument('--interval', type=int, default=4, help='seconds between samples of an inverter')
+    parser.add_argument('--chunk-rows', type=int, default=20000, help='rows per export chunk')
+    parser.add_argument('--dir', default=None, help='directory for the test files (default: a temp dir)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_export_', dir=os.path.expanduser(args.dir) if args.dir else None)
+    conn = open_database(os.path.join(directory, 'bench_export.db'))
+    for table in TABLES:
+        conn.execute(create_table_sql(table))
+    for name, table, columns in INDEXES:
+        conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    conn.execute(GENERATE, (args.rows, START_MS, args.devices, args.interval * 1000, args.devices))
+    conn.commit()
+    end_ms = START_MS + (args.rows // args.devices + 1) * args.interval * 1000
+    days = (end_ms - START_MS) / 86400000
+    print(f"{args.rows} rows, {args.devices} inverters every {args.interval} s ({days:.0f} days), in {directory}")
+
+    expected, rows_s, rows_mb = measured(means_from_rows, conn, START_MS, end_ms)
+    print(f"rows:   {rows_s:8.2f} s  peak {rows_mb:8.1f} MB  (SELECT + Python loop)")
+
+    out_dir = os.path.join(directory, 'export')
+    exported, export_s, export_mb = measured(export.export_npy, conn, None, out_dir, START_MS, end_ms,
+                                             chunk_rows=args.chunk_rows)
+    on_disk = sum(os.path.getsize(os.path.join(out_dir, name)) for name in os.listdir(out_dir)) / 1e6
+    print(f"export: {export_s:8.2f} s  peak {export_mb:8.1f} MB  ({exported} rows, {on_disk:.0f} MB of .npy, "
+          f"chunks of {args.chunk_rows})")
+
+    means, mmap_s, mmap_mb = measured(means_from_npy, out_dir)
+    print(f"mmap:   {mmap_s:8.2f} s  peak {mmap_mb:8.1f} MB  (load_npy + np.bincount)  "
+          f"{rows_s / mmap_s:.0f}x faster than rows")
+    error = max(abs(means[device][i] - expected[device][i]) for device in expected for i in (0, 1))
+    print(f"max difference of the means: {error:.2e}")
+
+    if export.pyarrow is not None:
+        path = os.path.join(directory, 'export.parquet')
+        _, parquet_s, parquet_mb = measured(export.export_parquet, conn, None, path, START_MS, end_ms)
+        print(f"parquet export: {parquet_s:.2f} s  peak {parquet_mb:.1f} MB  "
+              f"({os.path.getsize(path) / 1e6:.0f} MB)")
+    else:
+        print("pyarrow not installed, Parquet export not timed")
+
+    conn.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark: a day of LocalInputs/RemoteInputs ingestion, every poll against change-only.
+
+Simulates --polls polls of an input file (a day at DBAgent's 4 s cycle) on an
+injected clock. The file is rewritten with new values --changes times and,
+as the DSO side does, rewritten with the same values every --rewrite polls.
+Two ways of storing it into a local_inputs table:
+
+  - every poll: read, parse and insert a row every time (what DBAgent did)
+  - change-only: DBAgent.input_files.InputFileTracker, a row when the values
+    change plus a heartbeat row every --heartbeat seconds
+
+Reports rows and database bytes per day, the average cost of a poll and how
+the tracker's polls were resolved (stat, hash or parsed values). File mtimes
+are set in the past, as for a file written long before it is polled.
+
+    python3 bench_input_ingestion.py
+    python3 bench_input_ingestion.py --changes 200 --rewrite 5 --dir ~/Log_Files
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.input_files import InputFileTracker, parse_input_lines
+from DBAgent.schema import INPUT_COLUMNS, create_table_sql
+
+POLL_SECONDS = 4
+
+INSERT = (f"INSERT INTO local_inputs ({', '.join(column for column, _ in INPUT_COLUMNS)}) "
+          f"VALUES ({', '.join('?' * len(INPUT_COLUMNS))})")
+
+
+def content(version):
+    values = [version % 2, 0, 0, 5 + version, 5, 1000, 5.0, 0.95, 1.05, 1200, 200, 60]
+    return ''.join(f"{column} = {value}\n" for (column, _), value in zip(INPUT_COLUMNS, values))
+
+
+def write(path, text, mtime):
+    with open(path, 'w') as file:
+        file.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def run(label, path, db_path, polls, changes, rewrite, heartbeat, change_only):
+    conn = sqlite3.connect(db_path)
+    conn.execute(create_table_sql('local_inputs'))
+    conn.commit()
+
+    clock = [0.0]
+    tracker = InputFileTracker(path, heartbeat_interval=heartbeat, clock=lambda: clock[0])
+    change_every = max(polls // max(changes, 1), 1)
+    version = 0
+    past = time.time() - 10 * 86400
+    write(path, content(version), past)
+
+    rows = 0
+    poll_seconds = 0.0
+    for poll in range(polls):
+        clock[0] = poll * POLL_SECONDS
+        if changes and poll and poll % change_every == 0:
+            version += 1
+            write(path, content(version), past + clock[0])
+        elif rewrite and poll and poll % rewrite == 0:
+            write(path, content(version), past + clock[0])
+
+        start = time.perf_counter()
+        if change_only:
+            values, _ = tracker.poll()
+        else:
+            with open(path) as file:
+                values = parse_input_lines(file.read())
+        poll_seconds += time.perf_counter() - start
+        if values is not None:
+            conn.execute(INSERT, list(values.values()))
+            conn.commit()
+            rows += 1
+
+    size = os.path.getsize(db_path)
+    conn.close()
+    print(f"{label}")
+    print(f"  rows per day   {rows:10d}")
+    print(f"  database       {size / 1e3:10.0f} kB")
+    print(f"  poll cost      {poll_seconds / polls * 1e6:10.1f} us")
+    if change_only:
+        stats = tracker.stats()
+        print(f"  resolved by    stat {stats['stat_skips']}, hash {stats['hash_skips']}, "
+              f"values {stats['value_skips']}, changed {stats['changes']}, heartbeats {stats['heartbeats']}")
+    return rows, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--polls', type=int, default=86400 // POLL_SECONDS, help='polls simulated')
+    parser.add_argument('--changes', type=int, default=24, help='value changes in the run')
+    parser.add_argument('--rewrite', type=int, default=15, help='polls between same-value rewrites, 0 for none')
+    parser.add_argument('--heartbeat', type=float, default=900, help='input_heartbeat_interval in s')
+    parser.add_argument('--dir', default=None, help='directory for the test files (default: a temp dir)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_inputs_', dir=os.path.expanduser(args.dir) if args.dir else None)
+    path = os.path.join(directory, 'LocalInputs.txt')
+    print(f"{args.polls} polls every {POLL_SECONDS} s, {args.changes} changes, "
+          f"same-value rewrite every {args.rewrite} polls")
+    before = run("every poll", path, os.path.join(directory, 'before.db'), args.polls, args.changes, args.rewrite,
+                 args.heartbeat, change_only=False)
+    after = run(f"change-only, heartbeat every {args.heartbeat:g} s", path, os.path.join(directory, 'after.db'),
+                args.polls, args.changes, args.rewrite, args.heartbeat, change_only=True)
+    print(f"rows: {before[0] / after[0]:.0f}x fewer, database: {before[1] / after[1]:.0f}x smaller")
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
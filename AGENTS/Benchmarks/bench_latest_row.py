@@ -0,0 +1,112 @@
+"""
+Benchmark: "latest row" lookups on inverter_registers as the table grows.
+
+Grows an inverter_registers table (three inverters, one row per inverter per
+second) to 10M rows, and at each size times the query the control agents run:
+
+    SELECT ... FROM inverter_registers WHERE device_id = ? ORDER BY seq DESC LIMIT 1
+
+against a copy without indexes and a copy with the (device_id, seq) index
+DBAgent.init_database creates. Without the index the query walks seq backwards
+until it meets the device, which is quick while every device reports and slow
+for a device that stopped long ago. Rows are generated inside SQLite, so
+building 10M rows takes tens of seconds, not hours.
+
+    python3 bench_latest_row.py
+    python3 bench_latest_row.py --sizes 10000 100000 1000000 --dir ~/Log_Files
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+SCHEMA = '''
+    CREATE TABLE inverter_registers (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, ts_ms INTEGER NOT NULL, device_id TEXT, dc_bus_voltage REAL,
+        dc_bus_half_voltage REAL, Battery_SOC REAL, a_phase_voltage REAL, a_phase_current REAL, active_power REAL, reactive_power REAL, apparent_power REAL,
+        inverter_status INTEGER)
+'''
+
+# Same index as in DBAgent/schema.py
+INDEX = 'CREATE INDEX idx_inverter_registers_device_seq ON inverter_registers (device_id, seq)'
+
+DEVICES = 3
+
+# Rows first..last-1: row n is device n % DEVICES at second n // DEVICES after the epoch below
+GENERATE = f'''
+    WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+    INSERT INTO inverter_registers (ts_ms, device_id, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC,
+        a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status)
+    SELECT (1700000000 + i / {DEVICES}) * 1000, 'inverter' || (i % {DEVICES} + 1),
+           400.0, 200.0, 60, 240.0 + (i % 17) * 0.1, 8.3, 2000, 1000, 2236, 2
+    FROM n
+'''
+
+LATEST = '''
+    SELECT a_phase_voltage, active_power, reactive_power, apparent_power
+    FROM inverter_registers
+    WHERE device_id = ?
+    ORDER BY seq DESC
+    LIMIT 1
+'''
+
+
+def timed_query(conn, repeat):
+    samples = []
+    for index in range(repeat):
+        start = time.perf_counter()
+        conn.execute(LATEST, (f'inverter{index % DEVICES + 1}',)).fetchone()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def query_plan(conn):
+    return '; '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + LATEST, ('inverter1',)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000, 10000000])
+    parser.add_argument('--dir', default=None, help='directory for the test databases (default: a temp dir)')
+    parser.add_argument('--repeat', type=int, default=1000, help='indexed lookups timed per size')
+    parser.add_argument('--scan-repeat', type=int, default=3, help='unindexed lookups timed per size')
+    args = parser.parse_args()
+
+    directory = os.path.expanduser(args.dir) if args.dir else tempfile.mkdtemp(prefix='bench_latest_')
+    connections = {}
+    for name, indexed in (('plain', False), ('indexed', True)):
+        path = os.path.join(directory, f'bench_latest_{name}.db')
+        if os.path.exists(path):
+            os.remove(path)
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(SCHEMA)
+        if indexed:
+            conn.execute(INDEX)
+        connections[name] = conn
+
+    print(f"databases in {directory}")
+    print(f"plan without index: {query_plan(connections['plain'])}")
+    print(f"plan with index:    {query_plan(connections['indexed'])}")
+    print(f"{'rows':>12}{'no index (ms)':>16}{'indexed (ms)':>16}{'speedup':>10}")
+    rows = 0
+    for size in sorted(args.sizes):
+        for conn in connections.values():
+            conn.execute(GENERATE, (rows, size))
+            conn.commit()
+        rows = size
+        plain = timed_query(connections['plain'], args.scan_repeat)
+        indexed = timed_query(connections['indexed'], args.repeat)
+        print(f"{rows:>12}{plain:>16.3f}{indexed:>16.4f}{plain / indexed:>9.0f}x")
+
+    for name, conn in connections.items():
+        conn.close()
+        os.remove(os.path.join(directory, f'bench_latest_{name}.db'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: per-call Instrument setup (old Mod_Comm behaviour) vs. the persistent ModbusSession.
+
+Without arguments the benchmark runs on a pseudo-terminal and measures only the setup
+overhead that every old _Read_Inverter/_Write_Inverter call paid before touching the wire.
+With --port pointing at a live inverter (or the virtual inverter) it also measures full
+read round trips both ways, so the saved latency per call can be read off directly.
+
+    python3 bench_modbus_session.py
+    python3 bench_modbus_session.py --port /dev/Modbus_Converter --register 33071 --calls 50
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Modbus_Comm_Agent'))
+
+import minimalmodbus
+from Mod_Comm.session import ModbusSession
+
+
+def old_style_instrument(port, slave_id):
+    """Exactly what the old RPC handlers did before every transaction."""
+    instrument = minimalmodbus.Instrument(port, slave_id)
+    instrument.serial.baudrate = 9600
+    instrument.serial.bytesize = 8
+    instrument.serial.parity = minimalmodbus.serial.PARITY_NONE
+    instrument.serial.stopbits = 1
+    instrument.serial.timeout = 1
+    return instrument
+
+
+def summarize(name, samples):
+    samples_ms = [s * 1000 for s in samples]
+    print(f"{name:<32} n={len(samples_ms):<5} mean={statistics.mean(samples_ms):8.3f} ms  "
+          f"median={statistics.median(samples_ms):8.3f} ms  max={max(samples_ms):8.3f} ms")
+    return statistics.mean(samples_ms)
+
+
+def bench_setup(port, slave_id, calls):
+    setup_times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        old_style_instrument(port, slave_id)
+        setup_times.append(time.perf_counter() - start)
+
+    session = ModbusSession(port, slave_id)
+    session.open()
+    reuse_times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        session.is_open()  # the only per-call work left before the transaction
+        reuse_times.append(time.perf_counter() - start)
+    session.close()
+
+    old = summarize("per-call Instrument setup", setup_times)
+    new = summarize("persistent session", reuse_times)
+    print(f"setup overhead saved per call: {old - new:.3f} ms")
+
+
+def bench_round_trip(port, slave_id, register, calls):
+    old_times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        old_style_instrument(port, slave_id).read_registers(register, 1, functioncode=4)
+        old_times.append(time.perf_counter() - start)
+
+    session = ModbusSession(port, slave_id)
+    session.open()
+    new_times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        session.read_registers(register, 1, 4)
+        new_times.append(time.perf_counter() - start)
+    session.close()
+
+    old = summarize("old read (setup + wire)", old_times)
+    new = summarize("session read (wire only)", new_times)
+    print(f"latency saved per read: {old - new:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', help='serial port of a live or virtual inverter')
+    parser.add_argument('--slave', type=int, default=1)
+    parser.add_argument('--register', type=int, default=33071)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.port:
+        bench_setup(args.port, args.slave, args.calls)
+        bench_round_trip(args.port, args.slave, args.register, args.calls)
+    else:
+        master_fd, slave_fd = os.openpty()
+        try:
+            bench_setup(os.ttyname(slave_fd), args.slave, args.calls)
+        finally:
+            os.close(slave_fd)
+            os.close(master_fd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: polling a fleet of inverters on separate RS-485 ports.
+
+Starts one virtual inverter per port on its own pty and reads the DataBase
+agent's telemetry block from every one of them through Mod_Comm's ModbusPort /
+ModbusDevice objects, the way the agent does:
+
+  - sequential: one port after the other (the single-device agent's behaviour)
+  - parallel: one greenlet per device; each port's scheduler runs its
+    transactions on its own I/O thread, so the lines are busy at the same time
+
+    python3 bench_multi_device.py
+    python3 bench_multi_device.py --ports 4 --latency 20 --polls 10
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import gevent
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'Modbus_Comm_Agent'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Virtual_Inverter'))
+
+from Mod_Comm.block_planner import plan_block_reads
+from Mod_Comm.devices import ModbusDevice, ModbusPort
+from VirtualInverter import VirtualInverter
+
+# Registers read by DBAgent.read_inverter_registers_and_updata_DB
+TELEMETRY_REGISTERS = [33071, 33072, 33073, 33076, 33079, 33080, 33081, 33082, 33083, 33084, 33095, 33139]
+
+
+def poll(device, blocks):
+    for start, count in blocks:
+        device.scheduler.run('telemetry', device.read_registers, start, count, 4)
+
+
+def timed(polls, func):
+    samples = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.mean(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ports', type=int, default=3, help='number of inverters, one per port')
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--latency', type=float, default=5.0, help='simulator response latency in ms')
+    parser.add_argument('--polls', type=int, default=5)
+    args = parser.parse_args()
+
+    inverters = []
+    devices = []
+    for index in range(args.ports):
+        inverter = VirtualInverter(unit_id=index + 1, baudrate=args.baudrate, latency=args.latency / 1000.0,
+                                   seed=index)
+        inverter.start()
+        inverters.append(inverter)
+        port = ModbusPort(inverter.port, slave_id=index + 1, baudrate=args.baudrate)
+        port.start()
+        devices.append(ModbusDevice(f"inverter{index + 1}", port, slave_id=index + 1))
+
+    blocks = plan_block_reads(TELEMETRY_REGISTERS)
+    print(f"{args.ports} inverters, {len(blocks)} block reads each {blocks}")
+    try:
+        sequential = timed(args.polls, lambda: [poll(device, blocks) for device in devices])
+        parallel = timed(args.polls, lambda: gevent.joinall(
+            [gevent.spawn(poll, device, blocks) for device in devices], raise_error=True))
+        print(f"sequential fleet poll   {sequential:8.2f} ms")
+        print(f"parallel fleet poll     {parallel:8.2f} ms   ({sequential / parallel:.2f}x)")
+        for device in devices:
+            snapshot = device.metrics.snapshot()
+            print(f"{device.device_id} on {device.port.port}: {snapshot['transactions']} transactions, "
+                  f"busy {snapshot['busy_percent']:.1f}%")
+    finally:
+        for device in devices:
+            device.port.stop()
+            device.session.close()
+        for inverter in inverters:
+            inverter.stop()
+
+
+if __name__ == '__main__':
+    main()
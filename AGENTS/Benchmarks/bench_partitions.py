@@ -0,0 +1,160 @@
+"""
+Benchmark: one growing database file against the hot file plus day partitions.
+
+Simulates days of inverter telemetry (several inverters, one row per inverter
+every few seconds) into two copies of the DataBase agent's schema on an
+injected clock:
+
+  - single: every row stays in the one file
+  - partitioned: after every simulated day DBAgent's retention pass runs
+    (PartitionManager.rotate/compress_closed and RetentionJob.run) until it
+    has caught up, moving the closed day into its own file and pruning it
+    from the hot file
+
+Prints per day the size of both database files, the partition files on disk,
+the median time of the agents' latest-row query on each, and the slowest single
+retention pass. Finally reads one device's day from an uncompressed and from a
+compressed partition through query_telemetry() and from the single file.
+
+    python3 bench_partitions.py
+    python3 bench_partitions.py --days 10 --devices 3 --interval 4 --dir ~/Log_Files
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.db_writer import open_database
+from DBAgent.partitions import PartitionManager, query_telemetry
+from DBAgent.retention import DAY_MS, RetentionJob
+from DBAgent.schema import INDEXES, TABLES, create_table_sql
+
+# Epoch ms of the first simulated sample, midnight UTC
+START_MS = 1700000000000 - 1700000000000 % DAY_MS
+
+# Samples ts_ms first..last-1 (step interval) for every device, generated inside SQLite
+GENERATE = '''
+    WITH RECURSIVE n(t) AS (SELECT ? UNION ALL SELECT t + ? FROM n WHERE t + ? < ?),
+                   d(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM d WHERE i < ?)
+    INSERT INTO inverter_registers (ts_ms, device_id, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC,
+        a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status)
+    SELECT t, 'inverter' || i, 400.0, 200.0, 60 + (t / 600000) % 30, 240.0 + (t / 4000 % 17) * 0.1, 8.3,
+           2000 + (t / 60000 % 60) * 10, 1000, 2236, 2
+    FROM n, d ORDER BY t, i
+'''
+
+LATEST = "SELECT * FROM inverter_registers WHERE device_id = 'inverter1' ORDER BY seq DESC LIMIT 1"
+
+
+def create(path):
+    conn = open_database(path)
+    for table in TABLES:
+        conn.execute(create_table_sql(table))
+    for name, table, columns in INDEXES:
+        conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    conn.commit()
+    return conn
+
+
+def size_mb(conn):
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    return pages * conn.execute('PRAGMA page_size').fetchone()[0] / 1e6
+
+
+def latest_ms(conn, repeat=200):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(LATEST).fetchone()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def retention_pass(partitions, retention):
+    """What DBAgent.run_retention does; returns its duration in ms."""
+    start = time.perf_counter()
+    partitions.rotate()
+    partitions.compress_closed()
+    retention.run()
+    return (time.perf_counter() - start) * 1000
+
+
+def catch_up(partitions, retention):
+    slowest = 0.0
+    while True:
+        before = (partitions.watermark(), partitions.compressed, dict(retention.pruned), retention.stats()['watermarks'])
+        slowest = max(slowest, retention_pass(partitions, retention))
+        if (partitions.watermark(), partitions.compressed, dict(retention.pruned),
+                retention.stats()['watermarks']) == before:
+            return slowest
+
+
+def timed_query(conn, directory, start_ms, end_ms):
+    start = time.perf_counter()
+    _, rows = query_telemetry(conn, directory, start_ms, end_ms, device_id='inverter1')
+    return (time.perf_counter() - start) * 1000, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=7, help='simulated days')
+    parser.add_argument('--devices', type=int, default=3, help='inverters')
+    parser.add_argument('--interval', type=int, default=4, help='seconds between samples of an inverter')
+    parser.add_argument('--compress-after-days', type=float, default=2, help='db_partition_compress_after_days')
+    parser.add_argument('--dir', default=None, help='directory for the test databases (default: a temp dir)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_partitions_', dir=os.path.expanduser(args.dir) if args.dir else None)
+    partition_dir = os.path.join(directory, 'partitions')
+    single = create(os.path.join(directory, 'single.db'))
+    hot = create(os.path.join(directory, 'hot.db'))
+
+    now = [START_MS]
+    partitions = PartitionManager(hot, partition_dir, partition_hours=24,
+                                  compress_after_days=args.compress_after_days, batch_pause=0,
+                                  clock=lambda: now[0])
+    retention = RetentionJob(hot, raw_days=0, batch_pause=0, clock=lambda: now[0], partitions=partitions)
+
+    step = args.interval * 1000
+    print(f"{args.devices} inverters every {args.interval} s, day partitions, databases in {directory}")
+    print(f"{'day':>4}{'single (MB)':>13}{'hot (MB)':>10}{'partitions (MB)':>17}"
+          f"{'latest single (ms)':>20}{'latest hot (ms)':>17}{'slowest pass (ms)':>19}")
+    for day in range(args.days):
+        first = START_MS + day * DAY_MS
+        for conn in (single, hot):
+            conn.execute(GENERATE, (first, step, step, first + DAY_MS, args.devices))
+            conn.commit()
+        # Just past midnight, when the day has closed
+        now[0] = first + DAY_MS + 5 * 60 * 1000
+        slowest = catch_up(partitions, retention)
+        on_disk = sum(os.path.getsize(path) for _, _, path in partitions.partitions())
+        print(f"{day + 1:>4}{size_mb(single):>13.1f}{size_mb(hot):>10.1f}{on_disk / 1e6:>17.1f}"
+              f"{latest_ms(single):>20.4f}{latest_ms(hot):>17.4f}{slowest:>19.0f}")
+
+    stats = partitions.stats()
+    print(f"{stats['partitions']} partitions, {stats['compressed_partitions']} compressed "
+          f"(ratio {stats['compression_ratio'] or 0:.1f}x), {stats['rows_copied']} rows moved")
+
+    # One device's day: the last closed day (uncompressed) and the first one (compressed by now)
+    for label, day in (('uncompressed partition', args.days - 1), ('compressed partition', 0)):
+        window = (START_MS + day * DAY_MS, START_MS + (day + 1) * DAY_MS)
+        single_ms, single_rows = timed_query(single, None, *window)
+        partition_ms, partition_rows = timed_query(hot, partition_dir, *window)
+        print(f"day {day + 1} of inverter1 from {label}: {partition_ms:.0f} ms for {partition_rows} rows, "
+              f"single file {single_ms:.0f} ms for {single_rows} rows")
+
+    single.close()
+    hot.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: hand-written per-sample register decode (old DBAgent code) vs. the
+declarative RegisterMap decoder, for growing batch sizes and register maps.
+
+    python3 bench_register_decode.py
+    python3 bench_register_decode.py --samples 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DataBase_Agent'))
+
+from DBAgent.register_map import INVERTER_REGISTER_MAP, RegisterField, RegisterMap
+
+
+def old_decode(registers):
+    """The inline decode read_inverter_registers_and_updata_DB used to do for every sample."""
+    def combine(high, low):
+        value = (high << 16) | low
+        return value - 0x100000000 if value >= 0x80000000 else value
+
+    return {
+        'dc_bus_voltage': registers[33071] * 0.1,
+        'dc_bus_half_voltage': registers[33072] * 0.1,
+        'Battery_SOC': registers[33139],
+        'a_phase_voltage': registers[33073] * 0.1,
+        'a_phase_current': registers[33076] * 0.1,
+        'active_power': combine(registers[33079], registers[33080]),
+        'reactive_power': combine(registers[33081], registers[33082]),
+        'apparent_power': combine(registers[33083], registers[33084]),
+        'inverter_status': int(registers[33095]),
+    }
+
+
+def wide_map(extra_fields):
+    """The inverter map plus extra_fields synthetic 32 bit fields, to see how cost grows with fields."""
+    fields = list(INVERTER_REGISTER_MAP.fields)
+    for n in range(extra_fields):
+        fields.append(RegisterField(f'extra_{n}', 34000 + 2 * n, 2, True, 0.01, None))
+    return RegisterMap(fields)
+
+
+def bench(samples):
+    rng = np.random.default_rng(1)
+    words = rng.integers(0, 0x10000, size=(samples, len(INVERTER_REGISTER_MAP.addresses)))
+
+    rows = [dict(zip(INVERTER_REGISTER_MAP.addresses, row)) for row in words.tolist()]
+    start = time.perf_counter()
+    for row in rows:
+        old_decode(row)
+    old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    INVERTER_REGISTER_MAP.decode(words)
+    new = time.perf_counter() - start
+    print(f"{samples:>9} samples: per-sample decode {old * 1e6 / samples:8.3f} us/sample, "
+          f"RegisterMap {new * 1e6 / samples:8.3f} us/sample ({old / new:6.1f}x)")
+
+
+def bench_fields(samples):
+    for extra in (0, 16, 64, 256):
+        register_map = wide_map(extra)
+        words = np.random.default_rng(1).integers(0, 0x10000, size=(samples, len(register_map.addresses)))
+        start = time.perf_counter()
+        register_map.decode(words)
+        elapsed = time.perf_counter() - start
+        print(f"{len(register_map.fields):>4} fields: {elapsed * 1e6 / samples:8.3f} us/sample, "
+              f"{elapsed * 1e9 / samples / len(register_map.fields):8.2f} ns/field")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=100000)
+    args = parser.parse_args()
+
+    for samples in (1, 100, 10000, args.samples):
+        bench(samples)
+    print()
+    bench_fields(min(args.samples, 100000))
+
+
+if __name__ == '__main__':
+    main()
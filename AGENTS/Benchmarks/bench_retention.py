@@ -0,0 +1,162 @@
+"""
+Benchmark: database growth with and without DBAgent's retention job.
+
+Simulates weeks of inverter telemetry day by day (several inverters, one row
+per inverter every few seconds) into two databases with the DataBase agent's
+schema, on an injected clock. After every simulated day the retention copy runs
+RetentionJob (DBAgent/retention.py) until it has caught up, the way the agent's
+periodic pass would over that day. Prints per day:
+
+  - the file size of both databases: the retained one levels off once rows
+    start to age out after --raw-days, because freed pages are reused
+  - the raw, 1m and 15m row counts
+  - the slowest single retention pass, which stays bounded however much
+    history there is (the work per pass is capped)
+
+and finally times a daily-mean trend query on the 1m rollup against the same
+query on the raw rows of the unpruned database.
+
+    python3 bench_retention.py
+    python3 bench_retention.py --days 30 --raw-days 7 --devices 3 --interval 4 --dir ~/Log_Files
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.db_writer import open_database
+from DBAgent.retention import DAY_MS, ROLLUPS, RetentionJob
+from DBAgent.schema import INDEXES, TABLES, create_table_sql
+
+# Epoch ms of the first simulated sample
+START_MS = 1700000000000 - 1700000000000 % DAY_MS
+
+# Samples ts_ms first..last-1 (step interval) for every device, generated inside SQLite
+GENERATE = '''
+    WITH RECURSIVE n(t) AS (SELECT ? UNION ALL SELECT t + ? FROM n WHERE t + ? < ?),
+                   d(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM d WHERE i < ?)
+    INSERT INTO inverter_registers (ts_ms, device_id, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC,
+        a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status)
+    SELECT t, 'inverter' || i, 400.0, 200.0, 60 + (t / 600000) % 30, 240.0 + (t / 4000 % 17) * 0.1, 8.3,
+           2000 + (t / 60000 % 60) * 10, 1000, 2236, 2
+    FROM n, d ORDER BY t, i
+'''
+
+TREND_RAW = '''
+    SELECT ts_ms / 86400000 AS day, device_id, AVG(active_power)
+    FROM inverter_registers WHERE ts_ms >= ? AND ts_ms < ? GROUP BY day, device_id
+'''
+
+TREND_ROLLUP = '''
+    SELECT bucket_ms / 86400000 AS day, device_id, SUM(active_power_mean * samples) / SUM(samples)
+    FROM inverter_registers_1m WHERE bucket_ms >= ? AND bucket_ms < ? GROUP BY day, device_id
+'''
+
+
+def create(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = open_database(path)
+    for table in TABLES:
+        conn.execute(create_table_sql(table))
+    for name, table, columns in INDEXES:
+        conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    conn.commit()
+    return conn
+
+
+def size_mb(conn):
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return pages * page_size / 1e6
+
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def catch_up(job):
+    """Run retention passes until one makes no progress; returns (passes, slowest pass in ms)."""
+    passes = 0
+    slowest = 0.0
+    while True:
+        before = (job.stats()['watermarks'], dict(job.pruned))
+        job.run()
+        passes += 1
+        slowest = max(slowest, job.last_run_seconds * 1000)
+        if (job.stats()['watermarks'], dict(job.pruned)) == before:
+            return passes, slowest
+
+
+def timed(conn, query, params, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(query, params).fetchall()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, {(day, device): value for day, device, value in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=21, help='simulated days')
+    parser.add_argument('--raw-days', type=float, default=7, help='retention_raw_days')
+    parser.add_argument('--devices', type=int, default=2, help='inverters')
+    parser.add_argument('--interval', type=int, default=5, help='seconds between samples of an inverter')
+    parser.add_argument('--batch', type=int, default=500, help='retention_batch_size')
+    parser.add_argument('--dir', default=None, help='directory for the test databases (default: a temp dir)')
+    args = parser.parse_args()
+
+    directory = os.path.expanduser(args.dir) if args.dir else tempfile.mkdtemp(prefix='bench_retention_')
+    plain_path = os.path.join(directory, 'bench_no_retention.db')
+    retained_path = os.path.join(directory, 'bench_retention.db')
+    plain = create(plain_path)
+    retained = create(retained_path)
+
+    now = [START_MS]
+    job = RetentionJob(retained, raw_days=args.raw_days, rollup_days={}, batch_size=args.batch, batch_pause=0,
+                       clock=lambda: now[0])
+
+    step = args.interval * 1000
+    print(f"{args.devices} inverters every {args.interval} s, raw rows kept {args.raw_days:g} days, "
+          f"databases in {directory}")
+    print(f"{'day':>4}{'no retention (MB)':>19}{'retention (MB)':>16}{'raw rows':>10}"
+          f"{'1m rows':>9}{'15m rows':>10}{'passes':>8}{'slowest pass (ms)':>19}")
+    for day in range(args.days):
+        first = START_MS + day * DAY_MS
+        for conn in (plain, retained):
+            conn.execute(GENERATE, (first, step, step, first + DAY_MS, args.devices))
+            conn.commit()
+        now[0] = first + DAY_MS
+        passes, slowest = catch_up(job)
+        print(f"{day + 1:>4}{size_mb(plain):>19.1f}{size_mb(retained):>16.1f}"
+              f"{count(retained, 'inverter_registers'):>10}{count(retained, ROLLUPS[0][0]):>9}"
+              f"{count(retained, ROLLUPS[1][0]):>10}{passes:>8}{slowest:>19.1f}")
+
+    # Daily means over the whole history: raw rows of the unpruned database against the 1m rollup
+    window = (START_MS, START_MS + (args.days - 1) * DAY_MS)
+    raw_ms, raw = timed(plain, TREND_RAW, window)
+    rollup_ms, rollup = timed(retained, TREND_ROLLUP, window)
+    error = max(abs(raw[key] - rollup[key]) for key in raw)
+    missing = len(set(raw) - set(rollup))
+    print(f"daily mean active_power over {args.days - 1} days: raw {raw_ms:.1f} ms, 1m rollup {rollup_ms:.1f} ms "
+          f"({raw_ms / rollup_ms:.0f}x), max difference {error:.6f} W, {missing} days missing")
+
+    for conn in (plain, retained):
+        conn.close()
+    for path in (plain_path, retained_path):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark: sampling cadence of a fixed sleep after each poll against
+DBAgent.sampling.PeriodicSampler.
+
+A stand-in for the inverter read takes a random --work-min..--work-max fraction
+of the period, with every --slow-every'th read taking --slow times the period
+(a Modbus timeout). --samples reads are run at a --period s rate both ways:
+
+  - sleep: read, then sleep one period, what DBAgent's on_start loop did
+  - deadline: PeriodicSampler, reads due at absolute deadlines, deadlines a slow
+    read ran over skipped
+
+Reports the mean and spread of the intervals between read starts, how late the
+last read started against an exact period (counting skipped deadlines), how far
+any read started off the period grid, and the sampler's own overrun and jitter
+counters.
+
+    python3 bench_sampling.py
+    python3 bench_sampling.py --period 0.5 --samples 60 --work-max 0.8
+"""
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.sampling import PeriodicSampler
+
+
+def work_times(args):
+    random.seed(1)
+    times = []
+    for index in range(args.samples):
+        if args.slow_every and index % args.slow_every == args.slow_every // 2:
+            times.append(args.slow * args.period)
+        else:
+            times.append(random.uniform(args.work_min, args.work_max) * args.period)
+    return times
+
+
+def report(label, starts, period, skipped=0, extra=''):
+    intervals = [b - a for a, b in zip(starts, starts[1:])]
+    # Read i is planned at starts[0] + i * period, counting the deadlines skipped before it
+    lag = starts[-1] - starts[0] - (len(intervals) + skipped) * period
+    off_grid = max(abs((start - starts[0]) / period - round((start - starts[0]) / period)) * period
+                   for start in starts)
+    print(f"  {label:8s} mean interval {1000 * statistics.mean(intervals):6.1f} ms  "
+          f"stdev {1000 * statistics.stdev(intervals):5.1f} ms  last read late by {1000 * lag:7.1f} ms  "
+          f"max off the period grid {1000 * off_grid:5.1f} ms{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--period', type=float, default=0.05, help='sample period in s')
+    parser.add_argument('--samples', type=int, default=200, help='reads per run')
+    parser.add_argument('--work-min', type=float, default=0.2, help='shortest read, fraction of the period')
+    parser.add_argument('--work-max', type=float, default=0.6, help='longest read, fraction of the period')
+    parser.add_argument('--slow-every', type=int, default=50, help='every n-th read is slow, 0 for none')
+    parser.add_argument('--slow', type=float, default=2.5, help='slow read, in periods')
+    args = parser.parse_args()
+
+    times = work_times(args)
+    # The sampler logs every overrun
+    logging.getLogger('DataBaseAgent').setLevel(logging.ERROR)
+    print(f"{args.samples} reads every {1000 * args.period:g} ms, reads of "
+          f"{args.work_min:g}-{args.work_max:g} periods, every {args.slow_every}th {args.slow:g} periods")
+
+    starts = []
+    for work in times:
+        starts.append(time.monotonic())
+        time.sleep(work)
+        time.sleep(args.period)
+    report('sleep', starts, args.period)
+
+    starts = []
+    pending = iter(times)
+
+    def read():
+        starts.append(time.monotonic())
+        time.sleep(next(pending))
+
+    sampler = PeriodicSampler()
+    sampler.add('inverter_registers', read, args.period)
+    for _ in times:
+        sampler.run_once()
+    stats = sampler.stats()['inverter_registers']
+    report('deadline', starts, args.period, skipped=stats['skipped'],
+           extra=f"\n           overruns {stats['overruns']}, skipped {stats['skipped']} deadlines, "
+           f"jitter mean {stats['jitter_ms_mean']:.2f} ms p99 {stats['jitter_ms_p99']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: Mod_Comm's Modbus TCP transport against the virtual inverter.
+
+Serves the virtual inverter over Modbus TCP on localhost and runs a burst of
+concurrent requests (as several agents polling and writing at once would)
+through a ModbusPort, the way Mod_Comm does:
+
+  - one connection, one request at a time (what a serial-style client does over TCP)
+  - the configured pool, with requests pipelined by transaction id
+
+It then writes distinct values to every setpoint register concurrently and
+reads them back concurrently, to check that answers arriving out of order are
+still matched to the right request.
+
+    python3 bench_tcp_transport.py
+    python3 bench_tcp_transport.py --latency 20 --jitter 10 --pool-size 2 --max-in-flight 8
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import gevent
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'Modbus_Comm_Agent'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Virtual_Inverter'))
+
+from Mod_Comm.devices import ModbusDevice, ModbusPort
+from VirtualInverter import VirtualInverter
+
+# Blocks read by the DataBase agent's telemetry poll
+TELEMETRY_BLOCKS = [(33071, 25), (33139, 1)]
+
+# Setpoint registers written by Execute_Powers
+SETPOINT_REGISTERS = [43050, 43051, 43141, 43142, 43143, 43144, 43145, 43146, 43147, 43148, 43149, 43150]
+
+
+def burst(device, requests):
+    """requests telemetry block reads issued at once; returns the time until the last answer."""
+    start = time.perf_counter()
+    jobs = [gevent.spawn(device.scheduler.run, 'telemetry', device.read_registers, *TELEMETRY_BLOCKS[i % 2], 4)
+            for i in range(requests)]
+    gevent.joinall(jobs, raise_error=True)
+    return time.perf_counter() - start
+
+
+def check_matching(device):
+    """Concurrent writes then concurrent read-backs of distinct values; returns the mismatches."""
+    expected = {register: 1000 + index for index, register in enumerate(SETPOINT_REGISTERS)}
+    gevent.joinall([gevent.spawn(device.scheduler.run, 'control', device.write_register, register, value, 16)
+                    for register, value in expected.items()], raise_error=True)
+    reads = {register: gevent.spawn(device.scheduler.run, 'telemetry', device.read_registers, register, 1, 3)
+             for register in expected}
+    gevent.joinall(list(reads.values()), raise_error=True)
+    return {register: job.value[0] for register, job in reads.items() if job.value[0] != expected[register]}
+
+
+def run(address, label, pool_size, max_in_flight, requests, rounds):
+    port = ModbusPort(address, slave_id=1, transport='tcp', timeout=2, pool_size=pool_size,
+                      max_in_flight=max_in_flight)
+    device = ModbusDevice('inverter1', port, slave_id=1)
+    port.start()
+    try:
+        port.scheduler.run('safety', port.session.open)
+        samples = [burst(device, requests) for _ in range(rounds)]
+        mismatches = check_matching(device)
+        mean = statistics.mean(samples) * 1000
+        print(f"{label:<34} {mean:8.2f} ms per burst  {requests / mean * 1000:8.1f} req/s  "
+              f"mismatched read-backs: {len(mismatches)}")
+        connections = port.session.status()['connections']
+        print(f"{'':<34} in flight per connection (max): {[c['max_in_flight'] for c in connections]}")
+        return mean
+    finally:
+        port.scheduler.run('safety', port.session.close)
+        port.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=10.0, help='simulator response latency in ms')
+    parser.add_argument('--jitter', type=float, default=5.0, help='+/- latency jitter in ms')
+    parser.add_argument('--requests', type=int, default=32, help='concurrent requests per burst')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    args = parser.parse_args()
+
+    inverter = VirtualInverter(baudrate=0, latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                               seed=1, tcp_port=0)
+    inverter.start()
+    print(f"virtual inverter on tcp://{inverter.tcp_address}, {args.requests} concurrent requests per burst")
+    try:
+        serial = run(inverter.tcp_address, "1 connection, 1 in flight", 1, 1, args.requests, args.rounds)
+        pooled = run(inverter.tcp_address, f"{args.pool_size} connections, {args.max_in_flight} in flight",
+                     args.pool_size, args.max_in_flight, args.requests, args.rounds)
+        print(f"speedup: {serial / pooled:.2f}x")
+        print(f"simulator: {inverter.tcp_server.stats()}")
+    finally:
+        inverter.stop()
+
+
+if __name__ == '__main__':
+    main()
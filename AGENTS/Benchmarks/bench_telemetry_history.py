@@ -0,0 +1,131 @@
+"""
+Benchmark: "last N seconds of telemetry" from SQLite against DBAgent's ring buffer.
+
+Fills an inverter_registers table (with DBAgent's indexes) and a
+TelemetryRingBuffer with the same samples of one inverter polled every
+--interval seconds, then times the read a control agent makes before filtering
+or an ESC sweep, the a_phase_voltage and active_power of the last --seconds
+seconds as column lists:
+
+  - sqlite: SELECT on (device_id, ts_ms) and the rows turned into columns
+  - ring: TelemetryRingBuffer.window and to_columns, what get_telemetry_history
+    returns
+
+Also reports the cost of an append and the memory per sample of the ring
+buffer against keeping the decoded dicts in a deque.
+
+    python3 bench_telemetry_history.py
+    python3 bench_telemetry_history.py --seconds 300 --capacity 7200 --interval 1
+"""
+
+import argparse
+import collections
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'DataBase_Agent'))
+
+from DBAgent.register_map import INVERTER_REGISTER_MAP
+from DBAgent.schema import INDEXES, create_table_sql
+from DBAgent.telemetry_buffer import TelemetryRingBuffer, to_columns
+
+START_MS = 1700000000000
+
+FIELDS = ['a_phase_voltage', 'active_power']
+
+QUERY = f'''
+    SELECT ts_ms, {', '.join(FIELDS)} FROM inverter_registers
+    WHERE device_id = 'inverter1' AND ts_ms >= ? ORDER BY ts_ms
+'''
+
+
+def sample(index):
+    return {'dc_bus_voltage': 400.0, 'dc_bus_half_voltage': 200.0, 'Battery_SOC': 60,
+            'a_phase_voltage': 240.0 + index % 17 * 0.1, 'a_phase_current': 8.3, 'active_power': 2000 + index % 60,
+            'reactive_power': 1000, 'apparent_power': 2236, 'inverter_status': 2}
+
+
+def median_ms(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def traced_mb(build):
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=60, help='window read')
+    parser.add_argument('--capacity', type=int, default=3600, help='telemetry_history_size')
+    parser.add_argument('--interval', type=float, default=2, help='seconds between polls')
+    parser.add_argument('--db-days', type=float, default=7, help='days of rows in inverter_registers')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    step = int(args.interval * 1000)
+    rows = int(args.db_days * 86400000 / step)
+    now_ms = START_MS + rows * step
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute(create_table_sql('inverter_registers'))
+    for name, table, columns in INDEXES:
+        if table == 'inverter_registers':
+            conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+    names = list(INVERTER_REGISTER_MAP.record_dtype.names)
+    conn.executemany(f"INSERT INTO inverter_registers (ts_ms, device_id, {', '.join(names)}) "
+                     f"VALUES (?, 'inverter1', {', '.join('?' * len(names))})",
+                     ((START_MS + index * step, *sample(index).values()) for index in range(rows)))
+    conn.commit()
+
+    ring = TelemetryRingBuffer(INVERTER_REGISTER_MAP.record_dtype, capacity=args.capacity)
+    decoded = [sample(rows - args.capacity + index) for index in range(args.capacity)]
+    start = time.perf_counter()
+    for index, fields in enumerate(decoded):
+        ring.append(now_ms - (args.capacity - index) * step, fields)
+    append_us = (time.perf_counter() - start) / args.capacity * 1e6
+
+    since = now_ms - int(args.seconds * 1000)
+
+    def from_sqlite():
+        result = conn.execute(QUERY, (since,)).fetchall()
+        return {name: list(values) for name, values in zip(['ts_ms'] + FIELDS, zip(*result))}
+
+    def from_ring():
+        return to_columns(ring.window(since), FIELDS)
+
+    expected = from_sqlite()
+    got = from_ring()
+    same = all(got[name] == expected[name] for name in FIELDS)
+
+    sqlite_ms = median_ms(from_sqlite, args.repeat)
+    ring_ms = median_ms(from_ring, args.repeat)
+    print(f"last {args.seconds:g} s ({len(got['ts_ms'])} samples) of {', '.join(FIELDS)}, "
+          f"{rows} rows in inverter_registers, ring of {args.capacity}")
+    print(f"  sqlite  {sqlite_ms:8.4f} ms")
+    print(f"  ring    {ring_ms:8.4f} ms   ({sqlite_ms / ring_ms:.1f}x, same values: {same})")
+    print(f"append: {append_us:.2f} us per sample")
+
+    ring_bytes = traced_mb(lambda: TelemetryRingBuffer(INVERTER_REGISTER_MAP.record_dtype, capacity=args.capacity))
+    deque_bytes = traced_mb(lambda: collections.deque(((index, sample(index)) for index in range(args.capacity)),
+                                                      maxlen=args.capacity))
+    print(f"memory per sample: ring {ring_bytes / args.capacity:.0f} B, deque of dicts "
+          f"{deque_bytes / args.capacity:.0f} B")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark: Mod_Comm's bus access patterns against the virtual inverter.
+
+Starts the virtual inverter in-process on a pty (or uses --port for one started
+separately or a live inverter) and measures, through the same ModbusSession that
+Mod_Comm uses:
+
+  - the DataBase agent telemetry poll, register by register vs. planned block reads
+  - a full Execute_Powers setpoint program, one FC16 per register vs. batched frames
+
+    python3 bench_virtual_inverter.py
+    python3 bench_virtual_inverter.py --latency 20 --baudrate 19200 --calls 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'Modbus_Comm_Agent'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Virtual_Inverter'))
+
+from Mod_Comm.block_planner import plan_block_reads, plan_block_writes
+from Mod_Comm.session import ModbusSession
+from VirtualInverter import VirtualInverter
+
+# Registers read by DBAgent.read_inverter_registers_and_updata_DB
+TELEMETRY_REGISTERS = [33071, 33072, 33073, 33076, 33139, 33079, 33080, 33081, 33082, 33083, 33084, 33095]
+
+# Setpoints written by Execute_Powers when discharging
+SETPOINTS = {43050: 4, 43051: 2000, 43147: 0, 43148: 1, 43149: 23, 43150: 58,
+             43143: 23, 43144: 59, 43145: 0, 43146: 0, 43142: 100, 43141: 0}
+
+
+def summarize(name, samples):
+    samples_ms = [s * 1000 for s in samples]
+    print(f"{name:<36} n={len(samples_ms):<4} mean={statistics.mean(samples_ms):8.2f} ms  "
+          f"median={statistics.median(samples_ms):8.2f} ms  max={max(samples_ms):8.2f} ms")
+    return statistics.mean(samples_ms)
+
+
+def timed(calls, func):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_telemetry(session, calls):
+    def per_register():
+        for register in TELEMETRY_REGISTERS:
+            session.read_registers(register, 1, 4)
+
+    blocks = plan_block_reads(TELEMETRY_REGISTERS)
+
+    def block_reads():
+        for start, count in blocks:
+            session.read_registers(start, count, 4)
+
+    print(f"telemetry poll: {len(TELEMETRY_REGISTERS)} registers, {len(blocks)} block reads {blocks}")
+    old = summarize("per-register reads", timed(calls, per_register))
+    new = summarize("planned block reads", timed(calls, block_reads))
+    print(f"poll throughput: {1000 / old:.2f} -> {1000 / new:.2f} polls/s")
+
+
+def bench_setpoints(session, calls):
+    def per_register():
+        for register, value in sorted(SETPOINTS.items()):
+            session.write_register(register, value, 16)
+
+    blocks = plan_block_writes(SETPOINTS)
+
+    def batched():
+        for start, values in blocks:
+            if len(values) == 1:
+                session.write_register(start, values[0], 16)
+            else:
+                session.write_registers(start, values)
+
+    print(f"setpoint program: {len(SETPOINTS)} registers, {len(blocks)} frames")
+    summarize("one FC16 per register", timed(calls, per_register))
+    summarize("batched FC16 frames", timed(calls, batched))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', help='use an already running virtual or live inverter instead')
+    parser.add_argument('--slave', type=int, default=1)
+    parser.add_argument('--baudrate', type=int, default=9600, help='line speed emulated by the simulator')
+    parser.add_argument('--latency', type=float, default=5.0, help='simulator response latency in ms')
+    parser.add_argument('--calls', type=int, default=10)
+    args = parser.parse_args()
+
+    inverter = None
+    port = args.port
+    if port is None:
+        inverter = VirtualInverter(unit_id=args.slave, baudrate=args.baudrate, latency=args.latency / 1000.0, seed=1)
+        inverter.start()
+        port = inverter.port
+
+    session = ModbusSession(port, args.slave, baudrate=args.baudrate or 9600)
+    session.open()
+    try:
+        bench_telemetry(session, args.calls)
+        bench_setpoints(session, args.calls)
+    finally:
+        session.close()
+        if inverter is not None:
+            print(f"simulator: {inverter.stats()['servers'][0]}")
+            inverter.stop()
+
+
+if __name__ == '__main__':
+    main()
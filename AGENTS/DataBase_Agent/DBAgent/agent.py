@@ -7,7 +7,21 @@ from datetime import timedelta
 from volttron.platform.vip.agent import Agent, Core, RPC
 from volttron.platform.agent import utils
 import os
-import sqlite3
+
+import gevent
+import gevent.select
+
+from .change_detection import ChangeDetector
+from .db_writer import GroupCommitWriter, open_database
+from .dso_inputs import DSOInputService
+from .input_files import update_input_file
+from .partitions import PartitionManager, query_telemetry
+from .register_map import REGISTER_MAPS
+from .retention import RetentionJob
+from .sampling import PeriodicSampler
+from .telemetry_buffer import TelemetryRingBuffer, to_columns
+from .schema import (INDEXES, ROW_COLUMNS, TABLES, create_table_sql, create_view_sql, migrate_text_timestamps,
+                     now_ms)
 
 
 # Setup agent-specific logging
@@ -23,6 +37,15 @@ agent_logger.addHandler(file_handler)
 utils.setup_logging()
 __version__ = '0.1'
 
+# Tables whose inserts are committed immediately instead of in the next group commit
+URGENT_TABLES = ('safety_data', 'operational_data')
+
+# Seconds between checks for buffered rows older than db_commit_interval
+DB_FLUSH_CHECK_INTERVAL = 0.5
+
+# Default period in seconds of each sampling task, overridden by sample_periods
+SAMPLE_PERIODS = {'inverter_registers': 4}
+
 
 
 def DBA_factory(config_path, **kwargs):
@@ -49,6 +72,27 @@ def DBA_factory(config_path, **kwargs):
     ESC_Step_Time = int(config.get('ESC_Step_Time', 2))
     SOC_UP_VltReg_Limit = int(config.get('SOC_UP_VltReg_Limit', 25))
     SOC_DN_VltReg_Limit = int(config.get('SOC_DN_VltReg_Limit', 95))
+    modbus_peer = config.get('modbus_peer', 'Mod_Commagent-0.1_1')
+    modbus_devices = config.get('modbus_devices', None)
+    telemetry_deadbands = config.get('telemetry_deadbands', {})
+    telemetry_heartbeat_interval = float(config.get('telemetry_heartbeat_interval', 60))
+    telemetry_history_size = int(config.get('telemetry_history_size', 3600))
+    input_heartbeat_interval = float(config.get('input_heartbeat_interval', 900))
+    dso_poll_interval = float(config.get('dso_poll_interval', 2))
+    dso_input_seq_file = config.get('dso_input_seq_file', '~/Log_Files/dso_input_seq.txt')
+    sample_periods = config.get('sample_periods', {})
+    db_journal_mode = config.get('db_journal_mode', 'WAL')
+    db_synchronous = config.get('db_synchronous', 'NORMAL')
+    db_commit_batch_size = int(config.get('db_commit_batch_size', 50))
+    db_commit_interval = float(config.get('db_commit_interval', 2))
+    retention_interval = float(config.get('retention_interval', 60))
+    retention_raw_days = float(config.get('retention_raw_days', 7))
+    retention_1m_days = float(config.get('retention_1m_days', 90))
+    retention_15m_days = float(config.get('retention_15m_days', 0))
+    retention_batch_size = int(config.get('retention_batch_size', 500))
+    db_partition_hours = float(config.get('db_partition_hours', 24))
+    db_partition_dir = config.get('db_partition_dir', '~/Log_Files/partitions')
+    db_partition_compress_after_days = config.get('db_partition_compress_after_days', 2)
 
     # Log the values read from the configuration
     agent_logger.info("Configuration values loaded:")
@@ -64,6 +108,27 @@ def DBA_factory(config_path, **kwargs):
     agent_logger.info(f"ESC Step Time: {ESC_Step_Time}")
     agent_logger.info(f"SOC Upper Voltage Limit: {SOC_UP_VltReg_Limit}")
     agent_logger.info(f"SOC Lower Voltage Limit: {SOC_DN_VltReg_Limit}")
+    agent_logger.info(f"Modbus Peer: {modbus_peer}")
+    agent_logger.info(f"Modbus Devices: {modbus_devices}")
+    agent_logger.info(f"Telemetry Deadbands: {telemetry_deadbands}")
+    agent_logger.info(f"Telemetry Heartbeat Interval: {telemetry_heartbeat_interval}")
+    agent_logger.info(f"Telemetry History Size: {telemetry_history_size}")
+    agent_logger.info(f"Input Heartbeat Interval: {input_heartbeat_interval}")
+    agent_logger.info(f"DSO Poll Interval: {dso_poll_interval}")
+    agent_logger.info(f"DSO Input Seq File: {dso_input_seq_file}")
+    agent_logger.info(f"Sample Periods: {sample_periods}")
+    agent_logger.info(f"DB Journal Mode: {db_journal_mode}")
+    agent_logger.info(f"DB Synchronous: {db_synchronous}")
+    agent_logger.info(f"DB Commit Batch Size: {db_commit_batch_size}")
+    agent_logger.info(f"DB Commit Interval: {db_commit_interval}")
+    agent_logger.info(f"Retention Interval: {retention_interval}")
+    agent_logger.info(f"Retention Raw Days: {retention_raw_days}")
+    agent_logger.info(f"Retention 1m Rollup Days: {retention_1m_days}")
+    agent_logger.info(f"Retention 15m Rollup Days: {retention_15m_days}")
+    agent_logger.info(f"Retention Batch Size: {retention_batch_size}")
+    agent_logger.info(f"DB Partition Hours: {db_partition_hours}")
+    agent_logger.info(f"DB Partition Dir: {db_partition_dir}")
+    agent_logger.info(f"DB Partition Compress After Days: {db_partition_compress_after_days}")
 
     # Pass the loaded configuration values to the ESC agent
     return DBAgent(
@@ -79,6 +144,27 @@ def DBA_factory(config_path, **kwargs):
         ESC_Step_Time=ESC_Step_Time,
         SOC_UP_VltReg_Limit=SOC_UP_VltReg_Limit,
         SOC_DN_VltReg_Limit=SOC_DN_VltReg_Limit,
+        modbus_peer=modbus_peer,
+        modbus_devices=modbus_devices,
+        telemetry_deadbands=telemetry_deadbands,
+        telemetry_heartbeat_interval=telemetry_heartbeat_interval,
+        telemetry_history_size=telemetry_history_size,
+        input_heartbeat_interval=input_heartbeat_interval,
+        dso_poll_interval=dso_poll_interval,
+        dso_input_seq_file=dso_input_seq_file,
+        sample_periods=sample_periods,
+        db_journal_mode=db_journal_mode,
+        db_synchronous=db_synchronous,
+        db_commit_batch_size=db_commit_batch_size,
+        db_commit_interval=db_commit_interval,
+        retention_interval=retention_interval,
+        retention_raw_days=retention_raw_days,
+        retention_1m_days=retention_1m_days,
+        retention_15m_days=retention_15m_days,
+        retention_batch_size=retention_batch_size,
+        db_partition_hours=db_partition_hours,
+        db_partition_dir=db_partition_dir,
+        db_partition_compress_after_days=db_partition_compress_after_days,
         **kwargs
     )
 
@@ -141,8 +227,10 @@ class SafetyData:
 
 
 class InverterData:
-    def __init__(self, timestamp, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status):
+    def __init__(self, timestamp, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status, device_id=None, ts_ms=None):
         self.timestamp = timestamp
+        self.ts_ms = ts_ms
+        self.device_id = device_id
         self.dc_bus_voltage = dc_bus_voltage
         self.dc_bus_half_voltage = dc_bus_half_voltage
         self.Battery_SOC = Battery_SOC
@@ -166,7 +254,14 @@ class DBAgent(Agent):
 
     def __init__(self, db_path, file_path, curvefitfig_path,remote_input_file, default_pf, ESC_SOC_Limit,
                  inverter_rated_S, normalizing_voltage, max_iter_ESC_Vltg_Reg,
-                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, **kwargs):
+                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, modbus_peer='Mod_Commagent-0.1_1',
+                 modbus_devices=None, telemetry_deadbands=None, telemetry_heartbeat_interval=60,
+                 telemetry_history_size=3600, input_heartbeat_interval=900, dso_poll_interval=2,
+                 dso_input_seq_file='~/Log_Files/dso_input_seq.txt', sample_periods=None,
+                 db_journal_mode='WAL', db_synchronous='NORMAL', db_commit_batch_size=50, db_commit_interval=2,
+                 retention_interval=60, retention_raw_days=7, retention_1m_days=90, retention_15m_days=0,
+                 retention_batch_size=500, db_partition_hours=24, db_partition_dir='~/Log_Files/partitions',
+                 db_partition_compress_after_days=2, **kwargs):
         super(DBAgent, self).__init__(**kwargs)
 
         # Assign configuration values to instance variables
@@ -182,7 +277,49 @@ class DBAgent(Agent):
         self.ESC_Step_Time = ESC_Step_Time
         self.SOC_UP_VltReg_Limit = SOC_UP_VltReg_Limit
         self.SOC_DN_VltReg_Limit = SOC_DN_VltReg_Limit
-
+        self.db_journal_mode = db_journal_mode
+        self.db_synchronous = db_synchronous
+        self.db_commit_batch_size = db_commit_batch_size
+        self.db_commit_interval = db_commit_interval
+        self.retention_interval = retention_interval
+        self.retention_raw_days = retention_raw_days
+        self.retention_1m_days = retention_1m_days
+        self.retention_15m_days = retention_15m_days
+        self.retention_batch_size = retention_batch_size
+        # 0 keeps all telemetry in the database file; None never compresses partitions
+        self.db_partition_hours = db_partition_hours
+        self.db_partition_dir = os.path.expanduser(db_partition_dir)
+        self.db_partition_compress_after_days = db_partition_compress_after_days
+
+        # Inverters polled through the Modbus agent: (device_id, register map) pairs.
+        # Without modbus_devices the single inverter is polled under Mod_Comm's default id.
+        self.modbus_peer = modbus_peer
+        self.modbus_devices = []
+        for device_config in modbus_devices or [{'device_id': 'inverter1'}]:
+            map_name = device_config.get('register_map', 'inverter')
+            if map_name not in REGISTER_MAPS:
+                raise ValueError(f"Unknown register map {map_name} for device {device_config['device_id']}")
+            self.modbus_devices.append((str(device_config['device_id']), REGISTER_MAPS[map_name]))
+
+        # Report by exception: only fields that moved past their deadband are published,
+        # logged and stored, with a full snapshot every heartbeat interval
+        self.change_detector = ChangeDetector(deadbands=telemetry_deadbands,
+                                              heartbeat_interval=telemetry_heartbeat_interval)
+
+        # Periodic work runs on absolute deadlines, one period per task, see sampling.py
+        unknown = set(sample_periods or {}) - set(SAMPLE_PERIODS)
+        if unknown:
+            raise ValueError(f"Unknown sampling tasks {sorted(unknown)}, expected some of {list(SAMPLE_PERIODS)}")
+        self.sample_periods = dict(SAMPLE_PERIODS, **{name: float(period)
+                                                      for name, period in (sample_periods or {}).items()})
+        self.sampler = PeriodicSampler(sleep=gevent.sleep)
+        self.sampling_greenlet = None
+
+        # Every decoded sample of the last telemetry_history_size polls, per device, for
+        # get_telemetry_history; see telemetry_buffer.py
+        self.telemetry_history = {device_id: TelemetryRingBuffer(register_map.record_dtype,
+                                                                 capacity=telemetry_history_size)
+                                  for device_id, register_map in self.modbus_devices}
 
         # Log initialization
         agent_logger.info("ESC Agent initialized with configuration:")
@@ -198,10 +335,41 @@ class DBAgent(Agent):
         agent_logger.info(f"ESC Step Time: {self.ESC_Step_Time}")
         agent_logger.info(f"SOC Upper Voltage Limit: {self.SOC_UP_VltReg_Limit}")
         agent_logger.info(f"SOC Lower Voltage Limit: {self.SOC_DN_VltReg_Limit}")
+        agent_logger.info(f"Modbus Peer: {self.modbus_peer}")
+        agent_logger.info(f"Modbus Devices: {[device_id for device_id, _ in self.modbus_devices]}")
+        agent_logger.info(f"Telemetry Deadbands: {self.change_detector.deadbands}")
+        agent_logger.info(f"Telemetry Heartbeat Interval: {self.change_detector.heartbeat_interval}")
+        agent_logger.info(f"Telemetry History Size: {telemetry_history_size}")
+        agent_logger.info(f"Input Heartbeat Interval: {input_heartbeat_interval}")
+        agent_logger.info(f"DSO Poll Interval: {dso_poll_interval}")
+        agent_logger.info(f"DSO Input Seq File: {dso_input_seq_file}")
+        agent_logger.info(f"Sample Periods: {self.sample_periods}")
+        agent_logger.info(f"DB Journal Mode: {self.db_journal_mode}")
+        agent_logger.info(f"DB Synchronous: {self.db_synchronous}")
+        agent_logger.info(f"DB Commit Batch Size: {self.db_commit_batch_size}")
+        agent_logger.info(f"DB Commit Interval: {self.db_commit_interval}")
+        agent_logger.info(f"Retention Interval: {self.retention_interval}")
+        agent_logger.info(f"Retention Raw Days: {self.retention_raw_days}")
+        agent_logger.info(f"Retention 1m Rollup Days: {self.retention_1m_days}")
+        agent_logger.info(f"Retention 15m Rollup Days: {self.retention_15m_days}")
+        agent_logger.info(f"Retention Batch Size: {self.retention_batch_size}")
+        agent_logger.info(f"DB Partition Hours: {self.db_partition_hours}")
+        agent_logger.info(f"DB Partition Dir: {self.db_partition_dir}")
+        agent_logger.info(f"DB Partition Compress After Days: {self.db_partition_compress_after_days}")
 
         self.remote_file = self.remote_input_file
         # Later move to config
         self.local_file =os.path.expanduser("~/DSO_IN/LocalInputs.txt")
+        # The input files are watched with inotify; each new version is stored and published
+        # once, plus a heartbeat every input_heartbeat_interval, see dso_inputs.py
+        self.dso_inputs = DSOInputService(os.path.dirname(self.remote_file), self.on_dso_input_version,
+                                          files={os.path.basename(self.local_file): 'local',
+                                                 os.path.basename(self.remote_file): 'remote'},
+                                          heartbeat_interval=input_heartbeat_interval,
+                                          poll_interval=dso_poll_interval,
+                                          select=gevent.select.select, sleep=gevent.sleep,
+                                          seq_path=dso_input_seq_file)
+        self.dso_inputs_greenlet = None
         self.database_path =  self.db_path
         self.safety_data = SafetyData(remote_comm=0, modbus_comm=0, master_switch=0)
         self.ESCData= ESCData(Act_Reac_Ratio = 0.85)
@@ -228,8 +396,8 @@ class DBAgent(Agent):
 
         # Insert a row in safety_data WITH THE DEFAULT VALUES DEFINED
         self.cursor.execute('''
-            INSERT INTO safety_data (timestamp) VALUES (?)
-        ''', (time.strftime('%Y-%m-%d %H:%M:%S'),))
+            INSERT INTO safety_data (ts_ms) VALUES (?)
+        ''', (now_ms(),))
 
         # Insert the initial value in the ESC_data table if the table is empty
         self.cursor.execute(
@@ -238,13 +406,13 @@ class DBAgent(Agent):
         # Insert a row in operational_data with the initialized values
         self.cursor.execute('''
             INSERT INTO operational_data (
-                timestamp, allow_opr, fix_power_mode, voltage_regulation_mode, ESC_volt_reg_mode, 
+                ts_ms, allow_opr, fix_power_mode, voltage_regulation_mode, ESC_volt_reg_mode, 
                 fix_real_power, fix_reactive_power, QVVMax, VVVMax_Per, Low_Volt_Lmt, High_Volt_Lmt, 
                 ESC_VA, ESC_VA_steps, ESC_Repeat_Time
             ) 
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            time.strftime('%Y-%m-%d %H:%M:%S'),  # timestamp
+            now_ms(),  # ts_ms
             self.operational_data.allow_opr,  # allow_opr
             self.operational_data.fix_power_mode,  # fix_power_mode
             self.operational_data.voltage_regulation_mode,  # voltage_regulation_mode
@@ -268,89 +436,18 @@ class DBAgent(Agent):
         """Initialize the SQLite database and create tables if they don't exist."""
 
         # Generalized database file path in the home folder
-        self.conn = sqlite3.connect(self.database_path)
+        self.conn = open_database(self.database_path, journal_mode=self.db_journal_mode,
+                                  synchronous=self.db_synchronous)
 
         self.cursor = self.conn.cursor()
 
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS local_inputs (
-                timestamp TEXT,
-                fix_power_mode INTEGER,
-                voltage_regulation_mode INTEGER,
-                ESC_volt_reg_mode INTEGER,
-                fix_real_power INTEGER,
-                fix_reactive_power INTEGER,
-                QVVMax INTEGER,
-                VVVMax_Per REAL,
-                Low_Volt_Lmt REAL,
-                High_Volt_Lmt REAL,
-                ESC_VA INTEGER,
-                ESC_VA_steps INTEGER,
-                ESC_Repeat_Time INTEGER
-            )
-        ''')
-
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS remote_inputs (
-                timestamp TEXT,
-                fix_power_mode INTEGER,
-                voltage_regulation_mode INTEGER,
-                ESC_volt_reg_mode INTEGER,
-                fix_real_power INTEGER,
-                fix_reactive_power INTEGER,
-                QVVMax INTEGER,
-                VVVMax_Per REAL,
-                Low_Volt_Lmt REAL,
-                High_Volt_Lmt REAL,
-                ESC_VA INTEGER,
-                ESC_VA_steps INTEGER,
-                ESC_Repeat_Time INTEGER
-            )
-        ''')
-
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS operational_data (
-                timestamp TEXT,
-                allow_opr INTEGER DEFAULT 0,
-                fix_power_mode INTEGER,
-                voltage_regulation_mode INTEGER,
-                ESC_volt_reg_mode INTEGER,
-                fix_real_power INTEGER,
-                fix_reactive_power INTEGER,
-                QVVMax INTEGER,
-                VVVMax_Per REAL,
-                Low_Volt_Lmt REAL,
-                High_Volt_Lmt REAL,
-                ESC_VA INTEGER,
-                ESC_VA_steps INTEGER,
-                ESC_Repeat_Time INTEGER
-            )
-        ''')
-
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS safety_data (
-                timestamp TEXT,
-                remote_comm INTEGER DEFAULT 1,
-                modbus_comm INTEGER DEFAULT 0,
-                master_switch INTEGER DEFAULT 1
-            )
-        ''')
-
+        # Inserts are buffered and committed in groups, see db_writer.py
+        self.db_writer = GroupCommitWriter(self.conn, max_batch=self.db_commit_batch_size,
+                                           max_delay=self.db_commit_interval)
 
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inverter_registers (
-                timestamp TEXT,
-                dc_bus_voltage REAL,            
-                dc_bus_half_voltage REAL,       
-                Battery_SOC REAL,               
-                a_phase_voltage REAL,           
-                a_phase_current REAL,           
-                active_power REAL,              
-                reactive_power REAL,            
-                apparent_power REAL,            
-                inverter_status INTEGER
-            )
-        ''')
+        # Time-series tables, see schema.py
+        for table in TABLES:
+            self.cursor.execute(create_table_sql(table))
 
         # Create the new ESC_data table with the Act_Reac_Ratio column
         self.cursor.execute('''
@@ -359,48 +456,97 @@ class DBAgent(Agent):
             )
         ''')
 
+        # Databases created by earlier versions
+        self.migrate_inverter_registers()
+        for table in TABLES:
+            migrate_text_timestamps(self.conn, table)
 
+        for table in TABLES:
+            self.cursor.execute(create_view_sql(table))
+        self.create_indexes()
 
         self.conn.commit()
+
+        # Closed periods of telemetry move to their own files, see partitions.py
+        self.partitions = None
+        if self.db_partition_hours:
+            self.partitions = PartitionManager(self.conn, self.db_partition_dir,
+                                               partition_hours=self.db_partition_hours,
+                                               compress_after_days=self.db_partition_compress_after_days)
+
+        # Raw rows are pruned after retention_raw_days, telemetry is kept as 1m/15m rollups, see retention.py
+        self.retention = RetentionJob(self.conn, raw_days=self.retention_raw_days,
+                                      rollup_days={'inverter_registers_1m': self.retention_1m_days,
+                                                   'inverter_registers_15m': self.retention_15m_days},
+                                      batch_size=self.retention_batch_size, partitions=self.partitions)
         agent_logger.info("Database initialized.")
 
+    def migrate_inverter_registers(self):
+        """
+        Add the device_id column to an inverter_registers table created before
+        multi-inverter support; its rows belong to the first configured device.
+        """
+        self.cursor.execute("PRAGMA table_info(inverter_registers)")
+        columns = [row[1] for row in self.cursor.fetchall()]
+        if 'device_id' in columns:
+            return
+        default_device_id = self.modbus_devices[0][0]
+        agent_logger.info(f"Adding device_id to inverter_registers, existing rows assigned to {default_device_id}")
+        self.cursor.execute("ALTER TABLE inverter_registers ADD COLUMN device_id TEXT")
+        self.cursor.execute("UPDATE inverter_registers SET device_id = ?", (default_device_id,))
+
+    def create_indexes(self):
+        """
+        Index the columns the agents look rows up by: the latest row of a device
+        (ORDER BY seq DESC LIMIT 1) and time ranges on ts_ms. Also run on existing
+        databases, where building an index over a large table takes a while once.
+        """
+        for name, table, columns in INDEXES:
+            self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+            if self.cursor.fetchone():
+                continue
+            start = time.time()
+            self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            agent_logger.info(f"Created index {name} on {table} in {time.time() - start:.1f} s")
+
     def insert_inverter_data(self, inverter_data):
         """Insert the inverter data into the database."""
         agent_logger.info("inside Inverter data insert.")
-        timestamp = inverter_data.timestamp
-        values = (timestamp, inverter_data.dc_bus_voltage, inverter_data.dc_bus_half_voltage,
+        values = (inverter_data.ts_ms, inverter_data.device_id, inverter_data.dc_bus_voltage, inverter_data.dc_bus_half_voltage,
                   inverter_data.Battery_SOC, inverter_data.a_phase_voltage, inverter_data.a_phase_current,
                   inverter_data.active_power, inverter_data.reactive_power, inverter_data.apparent_power,
                   inverter_data.inverter_status)
 
         query = '''
             INSERT INTO inverter_registers (
-                timestamp, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status
+                ts_ms, device_id, dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current, active_power, reactive_power, apparent_power, inverter_status
             ) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         '''
-        self.cursor.execute(query, values)
-        self.conn.commit()
-        agent_logger.info("Inverter data inserted into the database.")
+        self.db_writer.insert(query, values)
+        agent_logger.info("Inverter data queued for the database.")
 
     def update_database(self, table_name, data_object):
         """Update the database with the current state."""
         agent_logger.info("Inside update database")
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
 
         # If data_object is a class instance, convert it to a dictionary
         if hasattr(data_object, '__dict__'):
-            data = (timestamp,) + tuple(vars(data_object).values())
+            fields = vars(data_object)
         elif isinstance(data_object, dict):  # If it's already a dictionary, use it as is
-            data = (timestamp,) + tuple(data_object.values())
+            fields = data_object
         else:
             raise TypeError("data_object must be a class instance or a dictionary")
 
-        placeholders = ', '.join('?' * len(data))
-        query = f'INSERT INTO {table_name} VALUES ({placeholders})'
+        # seq is assigned by SQLite; row columns read back from an earlier row are not copied
+        fields = {key: value for key, value in fields.items() if key not in ROW_COLUMNS and key != 'timestamp'}
+        columns = ', '.join(('ts_ms',) + tuple(fields))
+        placeholders = ', '.join('?' * (len(fields) + 1))
+        query = f'INSERT INTO {table_name} ({columns}) VALUES ({placeholders})'
+        data = (now_ms(),) + tuple(fields.values())
 
-        self.cursor.execute(query, data)
-        self.conn.commit()
+        # The other agents act on safety_data as soon as it is visible, so it is not held back
+        self.db_writer.insert(query, data, urgent=table_name in URGENT_TABLES)
         agent_logger.info(f"Database updated with current {table_name} state.")
 
     def _convert_to_dict(self, data_object):
@@ -428,8 +574,11 @@ class DBAgent(Agent):
             return {}
 
         try:
-            # Use a column to order the rows and fetch the latest entry
-            query = f"SELECT * FROM {table_name} ORDER BY timestamp DESC LIMIT 1"
+            # Rows still waiting for their group commit are part of the latest data
+            self.db_writer.flush()
+
+            # seq orders the rows, the latest entry has the highest
+            query = f"SELECT * FROM {table_name} ORDER BY seq DESC LIMIT 1"
             cursor = self.conn.cursor()
             cursor.execute(query)
             result = cursor.fetchone()
@@ -473,171 +622,290 @@ class DBAgent(Agent):
 
             # Merge current data with updated fields to keep unchanged fields intact
             for key, value in current_data.items():
-                if key not in kwargs:
+                if key not in kwargs and key not in ROW_COLUMNS:
                     setattr(self.safety_data, key, value)
                     agent_logger.info(f"Updating key {key} with value: {value}")
 
-            # Remove the 'timestamp' field before updating the database
-            data_to_update = self.safety_data.__dict__.copy()  # Copy the dictionary to avoid mutating the original
-            if 'timestamp' in data_to_update:
-                del data_to_update['timestamp']  # Remove the 'timestamp' field
+            # Copy the dictionary to avoid mutating the original; update_database stamps the new row
+            data_to_update = self.safety_data.__dict__.copy()
 
-            # Now you can use self.safety_data to update the database without the timestamp
             self.update_database('safety_data', data_to_update)
-            agent_logger.info(f"Updated safety_data (without timestamp): {data_to_update}")
+            agent_logger.info(f"Updated safety_data: {data_to_update}")
         else:
             agent_logger.error("Invalid data_type received")
 
-    def read_files_and_update_data(self):
-        """Reads LocalInputs.txt and RemoteInputs.txt, and updates the database with the values."""
-        # Read and update local inputs
-        agent_logger.info("Inside read files local")
-        local_input_file = self.local_file
-
-        if os.path.exists(local_input_file):
-            with open(local_input_file, 'r') as file:
-                lines = file.readlines()
-                if len(lines) >= 12:  # Ensure there are exactly 12 lines
-                    self.local_inputs = LocalInputs(
-                        int(lines[0].split('=')[1].strip()),  # fix_power_mode
-                        int(lines[1].split('=')[1].strip()),  # voltage_regulation_mode
-                        int(lines[2].split('=')[1].strip()),  # ESC_volt_reg_mode
-                        int(lines[3].split('=')[1].strip()),  # fix_real_power
-                        int(lines[4].split('=')[1].strip()),  # fix_reactive_power
-                        int(lines[5].split('=')[1].strip()),  # QVVMax
-                        float(lines[6].split('=')[1].strip()),  # VVVMax_Per
-                        float(lines[7].split('=')[1].strip()),  # Low_Volt_Lmt
-                        float(lines[8].split('=')[1].strip()),  # High_Volt_Lmt
-                        int(lines[9].split('=')[1].strip()),  # ESC_VA
-                        int(lines[10].split('=')[1].strip()),  # ESC_VA_steps
-                        int(lines[11].split('=')[1].strip())  # ESC_Repeat_Time
-                    )
-                    # Update the database with the new data
-                    self.update_database('local_inputs', self.local_inputs)
-                else:
-                    agent_logger.error(f"File {local_input_file} has an incorrect format or insufficient data.")
-
-        # Read and update remote inputs
-        agent_logger.info("Inside read files remote")
-        remote_input_file = self.remote_file
-        if os.path.exists(remote_input_file):
-            with open(remote_input_file, 'r') as file:
-                lines = file.readlines()
-                if len(lines) >= 12:
-                    self.remote_inputs = RemoteInputs(
-                        int(lines[0].split('=')[1].strip()),  # fix_power_mode
-                        int(lines[1].split('=')[1].strip()),  # voltage_regulation_mode
-                        int(lines[2].split('=')[1].strip()),  # ESC_volt_reg_mode
-                        int(lines[3].split('=')[1].strip()),  # fix_real_power
-                        int(lines[4].split('=')[1].strip()),  # fix_reactive_power
-                        int(lines[5].split('=')[1].strip()),  # QVVMax
-                        float(lines[6].split('=')[1].strip()),  # VVVMax_Per
-                        float(lines[7].split('=')[1].strip()),  # Low_Volt_Lmt
-                        float(lines[8].split('=')[1].strip()),  # High_Volt_Lmt
-                        int(lines[9].split('=')[1].strip()),  # ESC_VA
-                        int(lines[10].split('=')[1].strip()),  # ESC_VA_steps
-                        int(lines[11].split('=')[1].strip())  # ESC_Repeat_Time
-                    )
-                    self.update_database('remote_inputs', self.remote_inputs)
-
- 
+    @RPC.export
+    def get_telemetry_stats(self):
+        """Counters of the telemetry change detection (samples, snapshots, deltas, suppressed)."""
+        return self.change_detector.stats()
 
+    @RPC.export
+    def request_telemetry_snapshot(self, device_id=None):
+        """Publish the next sample of device_id (of every device for None) as a full snapshot."""
+        agent_logger.info(f"Telemetry snapshot requested for {device_id or 'all devices'}")
+        self.change_detector.reset(device_id)
 
-    def read_inverter_registers_and_updata_DB(self):
-        agent_logger.info("Reading inverter registers and updating database.")
+    @RPC.export
+    def get_telemetry_history(self, device_id=None, seconds=None, last_n=None, fields=None):
+        """
+        Recent samples of device_id (the first device for None) from memory: those of the
+        last seconds, else the last_n ones, else all that are kept. Returned as columns,
+        {'device_id': ..., 'ts_ms': [...], <field>: [...]}, oldest first; fields limits
+        the columns. Samples cover every poll, not only the reported changes.
+        """
+        device_id = device_id or self.modbus_devices[0][0]
+        history = self.telemetry_history.get(device_id)
+        if history is None:
+            agent_logger.error(f"No telemetry history for unknown device {device_id}")
+            return None
+        unknown = set(fields or []) - set(history.fields) - {'ts_ms'}
+        if unknown:
+            agent_logger.error(f"Unknown telemetry fields {sorted(unknown)} requested")
+            return None
+        if seconds is not None:
+            samples = history.window(now_ms() - int(seconds * 1000))
+        else:
+            samples = history.last(last_n)
+        columns = to_columns(samples, fields)
+        columns['device_id'] = device_id
+        return columns
+
+    @RPC.export
+    def get_telemetry_history_stats(self):
+        """Fill level of the telemetry ring buffers, per device."""
+        return {device_id: history.stats() for device_id, history in self.telemetry_history.items()}
 
-        peer = "Mod_Commagent-0.1_1"  # The name of the modbus agent
+    @RPC.export
+    def get_input_stats(self):
+        """Counters of the input file watch (wakeups, events) and change detection per file."""
+        return self.dso_inputs.stats()
+
+    @RPC.export
+    def get_dso_inputs(self, source=None):
+        """
+        Latest version of the 'local' or 'remote' input file, as published on
+        dso/inputs/<source>; of both as {source: version} for None.
+        """
+        if source is None:
+            return self.dso_inputs.latest
+        return self.dso_inputs.latest.get(source)
+
+    @RPC.export
+    def update_dso_inputs(self, source, **changes):
+        """
+        Set inputs of the 'local' or 'remote' input file, keeping the others. The file is
+        replaced with a rename, never rewritten in place; the new version is published
+        once the watch sees it. Returns the values written, None on an error.
+        """
+        path = {'local': self.local_file, 'remote': self.remote_file}.get(source)
+        if path is None:
+            agent_logger.error(f"Unknown input source {source}")
+            return None
         try:
-            agent_logger.info(f"starting tries")
-            # Read inverter register values using the RPC method like read_voltage
-            dc_bus_voltage = self.read_inverter_register(peer, 33071, 1) * 0.1
-            dc_bus_half_voltage = self.read_inverter_register(peer, 33072, 1) * 0.1
-            a_phase_voltage = self.read_inverter_register(peer, 33073, 1) * 0.1
-            a_phase_current = self.read_inverter_register(peer, 33076, 1) * 0.1
-
-            # Read Battery SOC from register 33139
-            battery_soc = self.read_inverter_register(peer, 33139, 1)
-
-            # Manually combine two registers to read 32-bit Active, Reactive, and Apparent Power
-            active_power_high = self.read_inverter_register(peer, 33079, 1)  # High 16 bits
-            active_power_low = self.read_inverter_register(peer, 33080, 1)  # Low 16 bits
-            active_power = (active_power_high << 16) | active_power_low  # Combine high and low to 32-bit value
-            if active_power >= 0x80000000:
-                active_power -= 0x100000000
-
-            reactive_power_high = self.read_inverter_register(peer, 33081, 1)  # High 16 bits
-            reactive_power_low = self.read_inverter_register(peer, 33082, 1)  # Low 16 bits
-            reactive_power = (reactive_power_high << 16) | reactive_power_low  # Combine high and low to 32-bit value
-            if reactive_power >= 0x80000000:
-                reactive_power -= 0x100000000
-
-            apparent_power_high = self.read_inverter_register(peer, 33083, 1)  # High 16 bits
-            apparent_power_low = self.read_inverter_register(peer, 33084, 1)  # Low 16 bits
-            apparent_power = (apparent_power_high << 16) | apparent_power_low  # Combine high and low to 32-bit value
-            if apparent_power >= 0x80000000:
-                apparent_power -= 0x100000000
-
-            # Convert inverter status from hex to integer
-            inverter_status_hex = self.read_inverter_register(peer, 33095, 1)
-            inverter_status = int(inverter_status_hex)
-
-            # Create an InverterData object with Battery_SOC
-            inverter_data = InverterData(
-                timestamp=time.strftime('%Y-%m-%d %H:%M:%S'),
-                dc_bus_voltage=dc_bus_voltage,
-                dc_bus_half_voltage=dc_bus_half_voltage,
-                Battery_SOC=battery_soc,  # Add SOC here
-                a_phase_voltage=a_phase_voltage,
-                a_phase_current=a_phase_current,
-                active_power=active_power,
-                reactive_power=reactive_power,
-                apparent_power=apparent_power,
-                inverter_status=inverter_status  # Store as integer directly
-            )
+            values = update_input_file(path, **changes)
+        except (OSError, ValueError) as e:
+            agent_logger.error(f"Failed to update {path} with {changes}: {e}")
+            return None
+        agent_logger.info(f"Updated {path} with {changes}")
+        return values
+
+    @RPC.export
+    def get_sampling_stats(self):
+        """Timing of each sampling task: runs, overruns, skipped deadlines, jitter and duration."""
+        return self.sampler.stats()
+
+    @RPC.export
+    def set_sample_period(self, name, period):
+        """Change the period in seconds of a sampling task ('inverter_registers')."""
+        if name not in self.sampler.tasks:
+            agent_logger.error(f"Unknown sampling task {name}")
+            return False
+        try:
+            self.sampler.set_period(name, float(period))
+        except ValueError as e:
+            agent_logger.error(f"Cannot set the period of {name}: {e}")
+            return False
+        self.sample_periods[name] = float(period)
+        return True
+
+    @RPC.export
+    def get_db_stats(self):
+        """Counters of the group-commit write path (rows, commits, failures, commit latency)."""
+        return self.db_writer.stats()
+
+    @RPC.export
+    def get_retention_stats(self):
+        """Progress of the rollups and rows pruned per table by the retention job."""
+        return self.retention.stats()
 
-            # Insert the inverter data into the database
-            self.insert_inverter_data(inverter_data)
+    @RPC.export
+    def query_telemetry(self, start_ms, end_ms, device_id=None, fields=None, limit=10000):
+        """
+        inverter_registers rows with start_ms <= ts_ms < end_ms across the partition
+        files and the database, oldest first, as {'columns': [...], 'rows': [[...], ...]}.
+        """
+        self.db_writer.flush()
+        directory = self.db_partition_dir if self.partitions is not None else None
+        columns, rows = query_telemetry(self.conn, directory, start_ms, end_ms, device_id=device_id,
+                                        fields=fields, limit=limit)
+        return {'columns': columns, 'rows': [list(row) for row in rows]}
+
+    def run_retention(self):
+        """Periodic retention pass; an error is logged and the next pass retries."""
+        try:
+            # Rows still buffered for the group commit are rolled up with their bucket
+            self.db_writer.flush()
+            if self.partitions is not None:
+                self.partitions.rotate()
+                self.partitions.compress_closed()
+            self.retention.run()
+            agent_logger.debug(f"Retention pass took {self.retention.last_run_seconds * 1000:.0f} ms")
+        except Exception as e:
+            agent_logger.error(f"Retention pass failed: {e}")
 
+    def on_dso_input_version(self, version):
+        """
+        Store a version of LocalInputs.txt or RemoteInputs.txt and publish it on
+        dso/inputs/<source>, so the other agents act on it without reading the file.
+        A version whose setpoints were rejected (values None) is not stored but still
+        published, so its modes reach the other agents.
+        """
+        source = version['source']
+        agent_logger.info(f"{source.capitalize()} inputs {version['reason']} (seq {version['seq']}): "
+                          f"modes {version['modes']}, values {version['values']}")
+        if version['values'] is None:
+            agent_logger.warning(f"{source.capitalize()} inputs (seq {version['seq']}) not stored, "
+                                 f"their setpoints were rejected")
+        elif source == 'local':
+            self.local_inputs = LocalInputs(**version['values'])
+            self.update_database('local_inputs', self.local_inputs)
+        else:
+            self.remote_inputs = RemoteInputs(**version['values'])
+            self.update_database('remote_inputs', self.remote_inputs)
+        try:
+            self.vip.pubsub.publish('pubsub', f'dso/inputs/{source}',
+                                    headers={'published_at': time.time()},
+                                    message=version)
         except Exception as e:
-            agent_logger.error(f"Failed to read inverter registers or update database: {str(e)}")
+            agent_logger.error(f"Failed to publish {source} inputs: {str(e)}")
 
-    def read_inverter_register(self, peer, register_address, num_registers, function_code=4):
+    def read_inverter_registers_and_updata_DB(self):
+        agent_logger.info("Reading inverter registers and updating database.")
+
+        peer = self.modbus_peer  # The name of the modbus agent
+        agent_logger.info(f"starting tries")
+        # One block-read RPC per inverter, all sent before any answer is awaited: Mod_Comm
+        # serves inverters on different ports in parallel, so polling the fleet takes as
+        # long as the busiest port rather than the sum of all of them
+        pending = [(device_id, register_map, self.request_inverter_block(peer, register_map.addresses, device_id=device_id))
+                   for device_id, register_map in self.modbus_devices]
+
+        for device_id, register_map, request in pending:
+            try:
+                registers = self.collect_inverter_block(peer, register_map.addresses, request, device_id)
+
+                # Scaling, 32 bit high/low combining and signedness all come from the register map
+                decoded = register_map.decode_one([registers[address] for address in register_map.addresses])
+                ts_ms = now_ms()
+                self.telemetry_history[device_id].append(ts_ms, decoded)
+
+                # Keep only the fields that moved past their deadband (everything on a heartbeat)
+                changes, snapshot = self.change_detector.update(device_id, decoded)
+                if not changes:
+                    agent_logger.debug(f"No telemetry change for {device_id}")
+                    continue
+                timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts_ms / 1000))
+                agent_logger.info(f"Telemetry {'snapshot' if snapshot else 'change'} of {device_id}: {changes}")
+
+                # Hand the changes to the control agents first, then store them
+                self.publish_telemetry(device_id, ts_ms, timestamp, changes, snapshot)
+
+                # The stored row holds the reported state (the changes applied over the last
+                # report), so the latest row of a device is always complete
+                inverter_data = InverterData(timestamp=timestamp, ts_ms=ts_ms, device_id=device_id,
+                                             **self.change_detector.state(device_id))
+                self.insert_inverter_data(inverter_data)
+
+            except Exception as e:
+                agent_logger.error(f"Failed to read inverter registers of {device_id} or update database: {str(e)}")
+
+    def publish_telemetry(self, device_id, ts_ms, timestamp, changes, snapshot):
         """
-        General method to read an inverter register using the Modbus agent (tester).
-        If the read fails, return -1 and log the issue.
+        Publish inverter telemetry on inverter/telemetry/<device_id>, so the control agents
+        react to it immediately instead of polling inverter_registers.
+
+        The message carries device_id, ts_ms, timestamp, snapshot and the reported fields: every
+        field when snapshot is True, otherwise only those that changed, to be applied over
+        the last snapshot.
         """
+        message = {'device_id': device_id, 'ts_ms': ts_ms, 'timestamp': timestamp, 'snapshot': snapshot}
+        message.update(changes)
         try:
-            agent_logger.info(f"Trying to read inverter reg via RPC call at register address {register_address}")
-            # Attempt the RPC call
-            result = self.vip.rpc.call(peer, '_Read_Inverter', register_address, num_registers, function_code).get(
-                timeout=10)
-
-            # Check if the result is valid
-            if result is None:
-                agent_logger.error(f"RPC call returned None for register address {register_address}.")
-                return -1  # Returning -1 to indicate a failure
-            if isinstance(result, list) and len(result) > 0:
-                agent_logger.info(f"Successfully read inverter reg: {result[0]}")
-                return result[0]  # Return the first element from the list as the valid value
-            else:
-                agent_logger.error(f"Unexpected result format or empty list from RPC call: {result}")
-                return -1
+            self.vip.pubsub.publish('pubsub', f'inverter/telemetry/{device_id}',
+                                    headers={'published_at': time.time()},
+                                    message=message)
+        except Exception as e:
+            agent_logger.error(f"Failed to publish inverter telemetry: {str(e)}")
 
+    def request_inverter_block(self, peer, register_addresses, function_code=4, device_id=None):
+        """Send a block-read RPC to the Modbus agent without waiting; returns the pending result or None."""
+        try:
+            agent_logger.info(f"Trying to read regs of {device_id} via block RPC call: {register_addresses}")
+            return self.vip.rpc.call(peer, '_Read_Inverter_Block', register_addresses, function_code,
+                                     device_id=device_id)
         except Exception as e:
-            agent_logger.error(f"Error during RPC call to {peer} for register {register_address}: {str(e)}")
-            return -1
+            agent_logger.error(f"Error during block RPC call to {peer}: {str(e)}")
+            return None
+
+    def collect_inverter_block(self, peer, register_addresses, request, device_id=None):
+        """
+        Wait for a block-read RPC sent by request_inverter_block.
+        Returns a dict of register address to value; registers that could not be read are -1.
+        """
+        result = [None] * len(register_addresses)
+        if request is not None:
+            try:
+                response = request.get(timeout=30)
+                if isinstance(response, list) and len(response) == len(register_addresses):
+                    result = response
+                else:
+                    agent_logger.error(f"Unexpected result format from block RPC call: {response}")
+            except Exception as e:
+                agent_logger.error(f"Error during block RPC call to {peer} for {device_id}: {str(e)}")
+
+        registers = {}
+        for address, value in zip(register_addresses, result):
+            if value is None:
+                agent_logger.error(f"Register {address} of {device_id} could not be read.")
+                value = -1  # Failure marker of an unread register
+            registers[address] = value
+        agent_logger.debug(f"Successfully read inverter regs of {device_id}: {registers}")
+        return registers
 
     @Core.receiver('onstart')
     def on_start(self, sender, **kwargs):
         agent_logger.info("Agent established")
-        while True:
-            self.read_files_and_update_data()
-            time.sleep(2)  # Pause for 2 seconds before the next update
-            self.read_inverter_registers_and_updata_DB()
-            time.sleep(2)  # Pause for 2 seconds before the next update
+        # Commit buffered rows that reached db_commit_interval while no new insert came in
+        self.core.periodic(DB_FLUSH_CHECK_INTERVAL, self.db_writer.flush_if_due)
+        self.core.periodic(self.retention_interval, self.run_retention)
+        # Current input versions first, then changes as they are written
+        self.dso_inputs.start()
+        self.dso_inputs_greenlet = self.core.spawn(self.dso_inputs.run)
+        # Inverter reads are due every sample period from now, however long each one takes
+        self.sampler.add('inverter_registers', self.read_inverter_registers_and_updata_DB,
+                         self.sample_periods['inverter_registers'])
+        self.sampling_greenlet = self.core.spawn(self.sampler.run)
 
     @Core.receiver('onstop')
     def on_stop(self, sender, **kwargs):
+        self.sampler.stop()
+        if self.sampling_greenlet is not None:
+            self.sampling_greenlet.kill()
+        # Killed before its inotify fd and the connection it stores through are closed
+        if self.dso_inputs_greenlet is not None:
+            self.dso_inputs_greenlet.kill()
+        self.dso_inputs.stop()
+        self.db_writer.flush()
         self.conn.close()
         agent_logger.info("Database connection closed.")
 
@@ -0,0 +1,147 @@
+"""
+Write path of the DataBase agent's SQLite file.
+
+Seven agents share inverter_operations.db. In the default rollback-journal mode
+every reader blocks the writer and the other way round, and committing each row
+costs an fsync on the Pi's SD card. The database is therefore run in WAL mode,
+where readers never block the writer nor each other, with synchronous=NORMAL,
+which syncs at checkpoints instead of on every commit (a power cut can lose the
+last commits, never corrupt the file).
+
+Rows are buffered in memory by GroupCommitWriter and written in one short
+transaction once max_batch rows are waiting or the oldest one has waited
+max_delay seconds. The buffer is not an open transaction, so other writers
+(OpsAgent writes operational_data itself) only wait for the flush itself.
+"""
+
+import itertools
+import logging
+import sqlite3
+import time
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def open_database(path, journal_mode='WAL', synchronous='NORMAL', busy_timeout=5):
+    """
+    Connect to the SQLite file at path and set its journal mode and synchronous level.
+    The journal mode is stored in the file, so the other agents' connections use it too.
+    """
+    journal_mode = journal_mode.upper()
+    synchronous = synchronous.upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unknown journal mode {journal_mode}, expected one of {JOURNAL_MODES}")
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Unknown synchronous level {synchronous}, expected one of {SYNCHRONOUS_LEVELS}")
+
+    conn = sqlite3.connect(path, timeout=busy_timeout)
+    active_mode = conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+    if active_mode.upper() != journal_mode:
+        agent_logger.warning(f"Journal mode {journal_mode} not available for {path}, using {active_mode}")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    agent_logger.info(f"Opened {path} with journal_mode={active_mode}, synchronous={synchronous}")
+    return conn
+
+
+class GroupCommitWriter:
+    """
+    Buffers INSERTs and commits them in groups.
+
+    A buffered row is committed once max_batch rows are waiting, once it is
+    max_delay seconds old (checked on every insert and by flush_if_due, which the
+    agent calls periodically), or right away when inserted as urgent. max_delay
+    plus the flush_if_due period bounds how long a row can be lost or invisible to
+    the other agents.
+
+    A flush that fails (e.g. "database is locked" while another agent writes)
+    keeps the rows for the next one; beyond max_pending rows the oldest are dropped.
+
+    Args:
+        conn: connection the rows are written with.
+        max_batch: rows per group commit.
+        max_delay: seconds a buffered row may wait for its commit.
+        max_pending: rows kept buffered while commits fail.
+        clock: monotonic time source.
+    """
+
+    def __init__(self, conn, max_batch=50, max_delay=2.0, max_pending=5000, clock=time.monotonic):
+        self.conn = conn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.clock = clock
+
+        # (query, params) in insert order, and when the oldest of them was inserted
+        self.pending = []
+        self.oldest = None
+
+        # Counters
+        self.rows = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.dropped = 0
+        self.commit_seconds_total = 0.0
+        self.commit_seconds_max = 0.0
+
+    def insert(self, query, params, urgent=False):
+        """Buffer one parameterised INSERT; commits if urgent or a threshold is reached."""
+        if not self.pending:
+            self.oldest = self.clock()
+        self.pending.append((query, tuple(params)))
+        if urgent or len(self.pending) >= self.max_batch or self.clock() - self.oldest >= self.max_delay:
+            self.flush()
+
+    def flush_if_due(self):
+        """Commit the buffered rows if the oldest has waited max_delay."""
+        if self.pending and self.clock() - self.oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Commit every buffered row in one transaction. Returns True on success."""
+        if not self.pending:
+            return True
+        rows = self.pending
+        start = time.perf_counter()
+        try:
+            with self.conn:
+                # Consecutive rows of the same statement go in one executemany
+                for query, group in itertools.groupby(rows, key=lambda row: row[0]):
+                    self.conn.executemany(query, [params for _, params in group])
+        except sqlite3.Error as e:
+            self.failed_commits += 1
+            if len(rows) > self.max_pending:
+                dropped = len(rows) - self.max_pending
+                del rows[:dropped]
+                self.dropped += dropped
+                agent_logger.error(f"Group commit of {len(rows) + dropped} rows failed: {e}, "
+                                   f"dropped the {dropped} oldest")
+            else:
+                agent_logger.error(f"Group commit of {len(rows)} rows failed, retrying on the next flush: {e}")
+            return False
+
+        elapsed = time.perf_counter() - start
+        self.pending = []
+        self.oldest = None
+        self.rows += len(rows)
+        self.commits += 1
+        self.commit_seconds_total += elapsed
+        self.commit_seconds_max = max(self.commit_seconds_max, elapsed)
+        agent_logger.debug(f"Committed {len(rows)} rows in {elapsed * 1000:.1f} ms")
+        return True
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'rows': self.rows,
+            'commits': self.commits,
+            'failed_commits': self.failed_commits,
+            'dropped': self.dropped,
+            'rows_per_commit': self.rows / self.commits if self.commits else 0.0,
+            'commit_ms_mean': 1000 * self.commit_seconds_total / self.commits if self.commits else 0.0,
+            'commit_ms_max': 1000 * self.commit_seconds_max,
+        }
@@ -0,0 +1,334 @@
+"""
+One reader of the DSO input files (LocalInputs.txt, RemoteInputs.txt in ~/DSO_IN).
+
+The DataBase agent and the supervisory scripts used to read RemoteInputs.txt
+every few seconds each, by line position. DSOInputService watches the
+directory with inotify instead and wakes up when a file is closed after
+writing or renamed into place. A changed file is parsed once, by name and
+checked against the schema (input_files.parse_input_version), and handed to a
+callback as a version:
+
+    {'source': 'remote', 'seq': 7, 'ts_ms': ..., 'digest': <sha1 hex>,
+     'reason': 'changed' | 'heartbeat', 'modes': {mode column: value},
+     'values': {column: value} or None}
+
+The modes are read on their own: a file whose setpoints are malformed or out of
+range still hands on its modes, with values None, so that a mode change (all
+modes 0 from the SafetySwitch agent) is never held back by a bad setpoint.
+
+seq counts the changed versions and only grows. With seq_path (the DataBase
+agent's dso_input_seq_file) the counter is kept in that file and goes on from
+where it stopped after a restart, so the seqs published on dso/inputs/<source>
+order the versions across restarts. A service without seq_path, like the one
+of Interupt_Detection.py, numbers the versions it sees from 1: those seqs are
+local to the process. digest identifies the file content the version was parsed
+from, the same in every process that reads it: versions of different
+processes, or the same content handed on again under a new seq after a
+restart, are matched by digest. The DataBase agent stores each version with
+values and publishes every version on dso/inputs/<source>.
+
+Without inotify (another OS, or the inotify limits reached) the files are
+stat'ed every poll_interval seconds. With inotify they are still stat'ed every
+RESCAN_SECONDS in case an event was lost. Either way a stat that did not
+change costs no read, see input_files.InputFileTracker.
+
+Nothing here needs VOLTTRON or gevent, so the supervisory scripts import it
+directly; an agent passes gevent's select and sleep.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import tempfile
+import time
+
+from .input_files import InputFileTracker, parse_input_version
+from .schema import now_ms
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+# Input files and the source name their versions are published under
+DSO_INPUT_FILES = {'LocalInputs.txt': 'local', 'RemoteInputs.txt': 'remote'}
+
+# Seconds between stat checks of every file while inotify is watching
+RESCAN_SECONDS = 60
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_MODIFY is left out on purpose: a file being written is read once it is closed
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    inotify watch of one directory. Raises OSError where inotify is not available.
+
+    Args:
+        directory: directory to watch.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "no C library to call inotify through")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watch = None
+        try:
+            self.add_watch()
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self):
+        self.watch = self.libc.inotify_add_watch(self.fd, os.fsencode(self.directory), WATCH_MASK)
+        if self.watch < 0:
+            self.watch = None
+            code = ctypes.get_errno()
+            raise OSError(code, f"inotify_add_watch of {self.directory} failed: {os.strerror(code)}")
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """
+        Names of the files with pending events, None for 'all of them' after a queue
+        overflow or when the directory went away, an empty set when nothing is pending.
+        """
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(buffer):
+            _, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                names = None
+            elif mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # The directory was removed or moved: watch it again once it is back
+                self.watch = None
+                names = None
+            elif names is not None and name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DSOInputService:
+    """
+    Versions of the DSO input files, see the module docstring.
+
+    Args:
+        directory: directory of the input files.
+        on_version: called with each version.
+        files: {file name: source} of the files to read.
+        heartbeat_interval: seconds after which an unchanged version is handed on again
+            with reason 'heartbeat' (None for never).
+        poll_interval: seconds between stat checks without inotify.
+        use_inotify: False to poll even where inotify is available.
+        select: select.select or a cooperative equivalent (gevent.select.select).
+        sleep: time.sleep or a cooperative equivalent (gevent.sleep).
+        clock: monotonic time in seconds.
+        seq_path: file the last seq is kept in across restarts (None: seq starts at 0).
+    """
+
+    def __init__(self, directory, on_version, files=None, heartbeat_interval=900, poll_interval=2,
+                 use_inotify=True, select=select.select, sleep=time.sleep, clock=time.monotonic,
+                 seq_path=None):
+        self.directory = os.path.expanduser(directory)
+        self.on_version = on_version
+        self.files = dict(files or DSO_INPUT_FILES)
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.select = select
+        self.sleep = sleep
+        self.clock = clock
+        self.seq_path = os.path.expanduser(seq_path) if seq_path else None
+
+        # A heartbeat every heartbeat_interval, or never
+        tracker_heartbeat = heartbeat_interval if heartbeat_interval else float('inf')
+        self.trackers = {name: InputFileTracker(os.path.join(self.directory, name), parse=parse_input_version,
+                                                heartbeat_interval=tracker_heartbeat, clock=clock)
+                         for name in self.files}
+        self.watcher = None
+        self.seq = self.load_seq()
+        self.latest = {}
+        self.checked_at = None
+
+        # Counters
+        self.wakeups = 0
+        self.events = 0
+
+    def load_seq(self):
+        """Last seq kept in seq_path, 0 when there is none."""
+        if self.seq_path is None:
+            return 0
+        try:
+            with open(self.seq_path) as file:
+                seq = int(file.read())
+        except FileNotFoundError:
+            return 0
+        except ValueError as e:
+            agent_logger.error(f"Input version counter {self.seq_path} is not a number ({e}), counting from 0")
+            return 0
+        agent_logger.info(f"Input versions numbered from {seq + 1}")
+        return seq
+
+    def save_seq(self):
+        """
+        Keep seq in seq_path, renamed into place so a crash never leaves a partial number.
+        A failure is logged and the version still handed on: a mode change is not held back.
+        """
+        if self.seq_path is None:
+            return
+        temp_path = None
+        try:
+            directory = os.path.dirname(os.path.abspath(self.seq_path))
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.seq_path)}.",
+                                             suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                file.write(f"{self.seq}\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.seq_path)
+            temp_path = None
+        except OSError as e:
+            agent_logger.error(f"Failed to keep input version counter in {self.seq_path}: {e}")
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def start(self):
+        """Watch the directory (or fall back to polling) and read the current versions."""
+        if self.use_inotify:
+            try:
+                self.watcher = InotifyWatcher(self.directory)
+                agent_logger.info(f"Watching {self.directory} for input file changes with inotify")
+            except OSError as e:
+                agent_logger.warning(f"inotify not available for {self.directory} ({e}), "
+                                     f"polling every {self.poll_interval} s")
+        return self.check()
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def run_once(self, timeout=None):
+        """
+        Wait up to timeout seconds for a file to change, then hand on the new versions
+        and any heartbeat due. Returns the versions.
+        """
+        if self.watcher is not None and self.watcher.watch is None:
+            # The directory went away: polled until it can be watched again
+            try:
+                self.watcher.add_watch()
+                return self.check()
+            except OSError:
+                pass
+        if self.watcher is None or self.watcher.watch is None:
+            self.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+            return self.check()
+
+        timeout = RESCAN_SECONDS if timeout is None else min(timeout, RESCAN_SECONDS)
+        readable, _, _ = self.select([self.watcher], [], [], timeout)
+        self.wakeups += 1
+        if readable:
+            names = self.watcher.read()
+            if names is None:
+                return self.check()
+            names &= set(self.files)
+            self.events += len(names)
+            versions = self.check(names)
+        else:
+            versions = []
+        if self.clock() - self.checked_at >= RESCAN_SECONDS:
+            versions += self.check()
+        versions += self.heartbeats()
+        return versions
+
+    def run(self):
+        """run_once forever, for a greenlet or a script's main loop."""
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                agent_logger.error(f"Input file check failed: {e}")
+                self.sleep(1)
+
+    def check(self, names=None):
+        """Poll the trackers of names (every file for None); returns the versions handed on."""
+        if names is None:
+            names = self.files
+            self.checked_at = self.clock()
+        versions = []
+        for name in names:
+            values, reason = self.trackers[name].poll()
+            if values is not None:
+                versions.append(self.hand_on(name, values, reason))
+        return versions
+
+    def heartbeats(self):
+        versions = []
+        for name, tracker in self.trackers.items():
+            values, reason = tracker.heartbeat()
+            if values is not None:
+                versions.append(self.hand_on(name, values, reason))
+        return versions
+
+    def hand_on(self, name, parsed, reason):
+        source = self.files[name]
+        if reason == 'changed':
+            self.seq += 1
+            # Kept before the version is handed on, so no seq is handed on twice
+            self.save_seq()
+            seq = self.seq
+            if parsed['error']:
+                agent_logger.error(f"Inputs of {name} rejected, only its modes are handed on: {parsed['error']}")
+        else:
+            seq = self.latest[source]['seq']
+        values = dict(parsed['values']) if parsed['values'] is not None else None
+        version = {'source': source, 'seq': seq, 'ts_ms': now_ms(), 'digest': self.trackers[name].digest.hex(),
+                   'reason': reason, 'modes': dict(parsed['modes']), 'values': values}
+        self.latest[source] = version
+        self.on_version(version)
+        return version
+
+    def stats(self):
+        return {
+            'mode': 'polling' if self.watcher is None else 'inotify',
+            'seq': self.seq,
+            'wakeups': self.wakeups,
+            'events': self.events,
+            'files': {self.files[name]: tracker.stats() for name, tracker in self.trackers.items()},
+        }
@@ -0,0 +1,211 @@
+"""
+Columnar export of the inverter telemetry history.
+
+Reading months of inverter_registers row by row through sqlite3 builds a
+Python tuple per row and a Python float per value, which is what makes
+analysis on the Pi slow. This tool streams a time range out of the partition
+files and the database (see partitions.py) in chunks of chunk_rows rows and
+writes it column by column, so memory stays bounded whatever the range:
+
+  npy      one .npy file per column in an output directory, plus meta.json.
+           ts_ms.npy is the time index (sorted, epoch ms UTC): a range is
+           np.searchsorted(ts_ms, [start, end]). device_id.npy holds codes
+           into meta['devices']. INTEGER columns store NULL as -1, REAL
+           columns as NaN; -1 register read failures are kept as they are.
+           load_npy() memory-maps the files, so a year of data opens without
+           being read into memory.
+  parquet  one Parquet file, a row group per chunk, if pyarrow is installed.
+
+    cd ~/AGENTS/DataBase_Agent
+    python3 -m DBAgent.export --start 2024-01-01 --end 2024-04-01 --out ~/export_q1
+    python3 -m DBAgent.export --start 2024-01-01 --end 2024-04-01 --device inverter1 \\
+        --fields ts_ms a_phase_voltage active_power --format parquet --out ~/q1.parquet
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+import urllib.request
+
+import numpy as np
+
+from .partitions import TABLE, iter_telemetry, telemetry_query
+from .schema import TABLES, now_ms
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+# Bytes before the data of an exported .npy file; the header is rewritten with
+# the row count at the end, so it is written at a fixed size first
+NPY_HEADER_SIZE = 128
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def column_dtype(column):
+    """NumPy dtype of an exported inverter_registers column."""
+    if column in ('seq', 'ts_ms'):
+        return np.dtype('<i8')
+    if column == 'device_id':
+        return np.dtype('<i4')
+    declaration = dict(TABLES[TABLE])[column]
+    return np.dtype('<i8') if declaration.startswith('INTEGER') else np.dtype('<f8')
+
+
+def chunk_arrays(columns, rows, devices):
+    """Column arrays of a chunk of rows; device ids are coded through devices {device_id: code}."""
+    arrays = {}
+    for column, values in zip(columns, zip(*rows)):
+        dtype = column_dtype(column)
+        if column == 'device_id':
+            arrays[column] = np.array([devices.setdefault(value, len(devices)) for value in values], dtype=dtype)
+            continue
+        # NumPy turns None into NaN
+        array = np.array(values, dtype=np.float64)
+        if dtype.kind == 'i':
+            array[np.isnan(array)] = -1
+        arrays[column] = array.astype(dtype, copy=False)
+    return arrays
+
+
+def npy_header(dtype, rows):
+    """Version 1.0 .npy header of a 1-D array, padded to NPY_HEADER_SIZE bytes."""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)})
+    magic = np.lib.format.magic(1, 0)
+    length = NPY_HEADER_SIZE - len(magic) - 2
+    header = header.ljust(length - 1) + '\n'
+    if len(header) != length:
+        raise ValueError(f"npy header longer than {NPY_HEADER_SIZE} bytes: {header}")
+    return magic + length.to_bytes(2, 'little') + header.encode('latin1')
+
+
+def export_npy(conn, directory, out_dir, start_ms, end_ms, device_id=None, fields=None, chunk_rows=20000):
+    """
+    Export the inverter_registers rows with start_ms <= ts_ms < end_ms into one
+    .npy file per column in out_dir. Returns the number of rows.
+    """
+    columns, _ = telemetry_query(fields, device_id)
+    if 'ts_ms' not in columns:
+        columns = ['ts_ms'] + columns
+    os.makedirs(out_dir, exist_ok=True)
+    files = {column: open(os.path.join(out_dir, f"{column}.npy"), 'wb') for column in columns}
+    devices = {}
+    rows = 0
+    try:
+        for column, handle in files.items():
+            handle.write(npy_header(column_dtype(column), 0))
+        for chunk in iter_telemetry(conn, directory, start_ms, end_ms, device_id=device_id, fields=columns,
+                                    chunk_rows=chunk_rows):
+            for column, array in chunk_arrays(columns, chunk, devices).items():
+                files[column].write(array.tobytes())
+            rows += len(chunk)
+        for column, handle in files.items():
+            handle.seek(0)
+            handle.write(npy_header(column_dtype(column), rows))
+    finally:
+        for handle in files.values():
+            handle.close()
+
+    meta = {
+        'table': TABLE,
+        'start_ms': start_ms,
+        'end_ms': end_ms,
+        'device_id': device_id,
+        'rows': rows,
+        'columns': {column: column_dtype(column).str for column in columns},
+        'devices': list(devices),
+        'exported_ms': now_ms(),
+    }
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as handle:
+        json.dump(meta, handle, indent=2)
+    return rows
+
+
+def load_npy(out_dir, mmap_mode='r'):
+    """(meta, {column: array}) of an export_npy directory, memory-mapped by default."""
+    with open(os.path.join(out_dir, 'meta.json')) as handle:
+        meta = json.load(handle)
+    arrays = {column: np.load(os.path.join(out_dir, f"{column}.npy"), mmap_mode=mmap_mode)
+              for column in meta['columns']}
+    return meta, arrays
+
+
+def export_parquet(conn, directory, path, start_ms, end_ms, device_id=None, fields=None, chunk_rows=100000):
+    """
+    Export the inverter_registers rows with start_ms <= ts_ms < end_ms into a
+    Parquet file, one row group per chunk. Returns the number of rows.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet export needs pyarrow, use the npy format or install pyarrow")
+    columns, _ = telemetry_query(fields, device_id)
+    types = {column: pyarrow.float64() if column_dtype(column).kind == 'f' else pyarrow.int64()
+             for column in columns}
+    types['device_id'] = pyarrow.string()
+    types['ts_ms'] = pyarrow.timestamp('ms', tz='UTC')
+    schema = pyarrow.schema([(column, types[column]) for column in columns])
+
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in iter_telemetry(conn, directory, start_ms, end_ms, device_id=device_id, fields=columns,
+                                    chunk_rows=chunk_rows):
+            arrays = [pyarrow.array(values, type=types[column]) for column, values in zip(columns, zip(*chunk))]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+def parse_time(value):
+    """Epoch ms of a local date/time or of an epoch ms number."""
+    if value.isdigit():
+        return int(value)
+    for fmt in DATE_FORMATS:
+        try:
+            return int(time.mktime(time.strptime(value, fmt)) * 1000)
+        except ValueError:
+            continue
+    raise ValueError(f"Unknown time {value}, expected epoch ms or one of {DATE_FORMATS}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='~/Log_Files/inverter_operations.db', help='database file')
+    parser.add_argument('--partitions', default='~/Log_Files/partitions', help='partition directory')
+    parser.add_argument('--start', required=True, help='local time (YYYY-MM-DD[ HH:MM[:SS]]) or epoch ms')
+    parser.add_argument('--end', default=None, help='same, default now')
+    parser.add_argument('--device', default=None, help='only this device_id')
+    parser.add_argument('--fields', nargs='+', default=None, help='columns, default all')
+    parser.add_argument('--format', choices=('npy', 'parquet'), default='npy')
+    parser.add_argument('--out', required=True, help='output directory (npy) or file (parquet)')
+    parser.add_argument('--chunk-rows', type=int, default=20000, help='rows read and written at a time')
+    args = parser.parse_args()
+
+    db_path = os.path.expanduser(args.db)
+    start_ms = parse_time(args.start)
+    end_ms = parse_time(args.end) if args.end else now_ms()
+    out = os.path.expanduser(args.out)
+
+    conn = sqlite3.connect(f"file:{urllib.request.pathname2url(db_path)}?mode=ro", uri=True)
+    # One read transaction, so rows DBAgent moves into a partition meanwhile are not missed
+    conn.execute("BEGIN")
+    began = time.time()
+    try:
+        export = export_parquet if args.format == 'parquet' else export_npy
+        rows = export(conn, os.path.expanduser(args.partitions), out, start_ms, end_ms, device_id=args.device,
+                      fields=args.fields, chunk_rows=args.chunk_rows)
+    finally:
+        conn.close()
+    print(f"Exported {rows} rows to {out} in {time.time() - began:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Change-only ingestion of the mode/setpoint input files (LocalInputs.txt,
+RemoteInputs.txt).
+
+DBAgent reads both files every poll, but they change a few times a day.
+InputFileTracker keeps a fingerprint of each file and only hands values on to
+be stored when they differ from the last stored ones:
+
+  1. os.stat: the same (mtime_ns, size, inode) as last time means the file was
+     not rewritten, and it is not even read.
+  2. content hash: a rewrite with the same bytes is not parsed.
+  3. parsed values: a rewrite that parses to the same values (whitespace,
+     1.0 against 1.00) is not stored.
+
+A heartbeat row with the current values is stored every heartbeat_interval
+seconds anyway, so the latest row of local_inputs/remote_inputs shows the
+inputs were still being read.
+
+A file rewritten twice within the filesystem's timestamp granularity can keep
+its mtime and size; as in git's "racy clean" check, the stat fingerprint is
+only trusted once the file's mtime is RACY_SECONDS older than when it was read.
+
+The files are 'name=value' lines, parsed by name and checked against
+INPUT_COLUMNS and INPUT_LIMITS; unknown names are logged and skipped. The
+MODE_COLUMNS are read on their own (parse_input_version), so that a malformed
+or out-of-range setpoint never holds back a mode change such as all modes set
+to 0. Writers should go through write_input_file or
+update_input_file, which replace the file with a rename so that readers see
+either the old or the new content, never a half-written file.
+"""
+
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+import time
+
+from .schema import INPUT_COLUMNS
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+# mtime resolution to allow for (FAT on SD cards stores mtimes in 2 s steps)
+RACY_SECONDS = 2.0
+
+
+# Checks on the parsed values: column -> (minimum, maximum), None for no bound
+INPUT_LIMITS = {
+    'fix_power_mode': (0, None),
+    'voltage_regulation_mode': (0, None),
+    'ESC_volt_reg_mode': (0, None),
+    'VVVMax_Per': (0, None),
+    'Low_Volt_Lmt': (0, None),
+    'High_Volt_Lmt': (0, None),
+    'ESC_VA_steps': (1, None),
+    'ESC_Repeat_Time': (1, None),
+}
+
+
+# Permissions of an input file written where there was none; mkstemp creates 0600
+NEW_FILE_MODE = 0o644
+
+# Inputs that switch the control modes on and off
+MODE_COLUMNS = ('fix_power_mode', 'voltage_regulation_mode', 'ESC_volt_reg_mode')
+
+
+def read_input_lines(text):
+    """
+    (values, errors) of the 'name=value' lines of an input file, in any order; blank
+    lines and '#' comments are skipped. values holds each input that could be read,
+    converted to its INPUT_COLUMNS type, errors describes the lines that could not.
+    Unknown names are logged as warnings and skipped.
+    """
+    declarations = dict(INPUT_COLUMNS)
+    values = {}
+    errors = []
+    repeated = set()
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name, separator, raw = line.partition('=')
+        name = name.strip()
+        if not separator:
+            errors.append(f"line {number}: expected name=value, got {line!r}")
+            continue
+        if name not in declarations:
+            agent_logger.warning(f"Unknown input {name} on line {number} skipped")
+            continue
+        if name in values or name in repeated:
+            # Neither value is trusted
+            errors.append(f"line {number}: {name} given twice")
+            repeated.add(name)
+            values.pop(name, None)
+            continue
+        try:
+            values[name] = float(raw) if declarations[name] == 'REAL' else int(raw)
+        except ValueError:
+            errors.append(f"line {number}: {name} is not a number: {raw.strip()!r}")
+    return values, errors
+
+
+def check_inputs(values, errors):
+    """
+    values of read_input_lines in column order, once complete and within INPUT_LIMITS.
+    Raises ValueError when there were errors, an input is missing or a value is out of range.
+    """
+    if errors:
+        raise ValueError('; '.join(errors))
+    missing = [column for column, _ in INPUT_COLUMNS if column not in values]
+    if missing:
+        raise ValueError(f"missing inputs {missing}")
+    validate_inputs(values)
+    # Column order, whatever the order of the lines
+    return {column: values[column] for column, _ in INPUT_COLUMNS}
+
+
+def parse_input_lines(text):
+    """
+    {column: value} of an input file: one 'name=value' line for each INPUT_COLUMNS
+    entry, in any order. Raises ValueError on a malformed line, a missing input or
+    values outside INPUT_LIMITS.
+    """
+    return check_inputs(*read_input_lines(text))
+
+
+def parse_input_version(text):
+    """
+    {'modes': {column: value}, 'values': {column: value} or None, 'error': str or None}
+    of an input file. The MODE_COLUMNS are taken on their own: as long as they can be
+    read the modes are returned, with values None and the reason in error when any
+    other line is malformed, an input is missing or a setpoint is out of range.
+    Raises ValueError when a mode cannot be read or is out of range.
+    """
+    values, errors = read_input_lines(text)
+    missing = [column for column in MODE_COLUMNS if column not in values]
+    if missing:
+        raise ValueError(f"modes {missing} missing or malformed" + (f" ({'; '.join(errors)})" if errors else ''))
+    modes = {column: values[column] for column in MODE_COLUMNS}
+    for column, value in modes.items():
+        low, high = INPUT_LIMITS[column]
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise ValueError(f"{column}={value} is outside [{low}, {high}]")
+    try:
+        return {'modes': modes, 'values': check_inputs(values, errors), 'error': None}
+    except ValueError as e:
+        return {'modes': modes, 'values': None, 'error': str(e)}
+
+
+def validate_inputs(values):
+    """Raise ValueError when a value is outside INPUT_LIMITS or the voltage limits are reversed."""
+    for column, (low, high) in INPUT_LIMITS.items():
+        value = values[column]
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise ValueError(f"{column}={value} is outside [{low}, {high}]")
+    if values['Low_Volt_Lmt'] >= values['High_Volt_Lmt']:
+        raise ValueError(f"Low_Volt_Lmt={values['Low_Volt_Lmt']} is not below "
+                         f"High_Volt_Lmt={values['High_Volt_Lmt']}")
+
+
+def format_input_lines(values):
+    """Text of an input file with values, the format parse_input_lines reads."""
+    return ''.join(f"{column}={values[column]}\n" for column, _ in INPUT_COLUMNS)
+
+
+def read_input_file(path):
+    """Parsed values of the input file at path."""
+    with open(path) as file:
+        return parse_input_lines(file.read())
+
+
+def read_input_modes(path):
+    """MODE_COLUMNS of the input file at path, read even when its setpoints are not valid."""
+    with open(path) as file:
+        return parse_input_version(file.read())['modes']
+
+
+def file_mode(path):
+    """Permission bits of the file at path, NEW_FILE_MODE when there is none."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return NEW_FILE_MODE
+
+
+def write_input_file(path, values):
+    """
+    Replace the input file at path with values. The text goes to a temporary file in
+    the same directory, is flushed to disk and renamed over path, so a reader opens
+    either the old file or the complete new one. The file keeps its permissions
+    (NEW_FILE_MODE for a new file).
+    """
+    values = {column: values[column] for column, _ in INPUT_COLUMNS}
+    validate_inputs(values)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(format_input_lines(values))
+            file.flush()
+            os.fsync(file.fileno())
+            os.fchmod(file.fileno(), file_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # The rename itself is durable once the directory is synced
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+def update_input_file(path, **changes):
+    """
+    Set some inputs of the file at path, keeping the others, with write_input_file.
+    Returns the values written. A write by another process between the read and the
+    rename is overwritten.
+    """
+    values = read_input_file(path)
+    unknown = set(changes) - set(values)
+    if unknown:
+        raise ValueError(f"unknown inputs {sorted(unknown)}")
+    values.update(changes)
+    write_input_file(path, values)
+    return values
+
+
+class InputFileTracker:
+    """
+    Fingerprint of one input file and the values last stored from it.
+
+    Args:
+        path: the input file.
+        parse: text -> {column: value}, raising ValueError on a malformed file.
+        heartbeat_interval: seconds after which unchanged values are stored again.
+        clock: monotonic time in seconds, for the heartbeat.
+    """
+
+    def __init__(self, path, parse=parse_input_lines, heartbeat_interval=900, clock=time.monotonic):
+        self.path = path
+        self.parse = parse
+        self.heartbeat_interval = heartbeat_interval
+        self.clock = clock
+
+        self.stat_key = None
+        # sha1 of the content values were parsed from, and of the last content that did not parse
+        self.digest = None
+        self.bad_digest = None
+        self.values = None
+        self.stored_at = None
+
+        # Counters
+        self.polls = 0
+        self.stat_skips = 0
+        self.hash_skips = 0
+        self.value_skips = 0
+        self.changes = 0
+        self.heartbeats = 0
+        self.parse_errors = 0
+
+    def poll(self):
+        """
+        Check the file. Returns (values, reason) when a row has to be stored, reason
+        being 'changed' or 'heartbeat', else (None, None).
+        """
+        self.polls += 1
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, None
+        stat_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        if stat_key == self.stat_key:
+            self.stat_skips += 1
+            return self.heartbeat()
+
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        read_at = time.time()
+        # A file modified within RACY_SECONDS of the read could change again without its stat changing
+        trusted_key = stat_key if read_at - stat.st_mtime > RACY_SECONDS else None
+
+        digest = hashlib.sha1(content).digest()
+        if digest == self.digest or digest == self.bad_digest:
+            self.stat_key = trusted_key
+            self.hash_skips += 1
+            return self.heartbeat()
+
+        self.stat_key = trusted_key
+        try:
+            values = self.parse(content.decode())
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
+            # Logged once per content; the last good values and their digest stay the current ones
+            self.bad_digest = digest
+            self.parse_errors += 1
+            agent_logger.error(f"File {self.path} has an incorrect format or insufficient data: {e}")
+            return None, None
+        self.digest = digest
+        self.bad_digest = None
+
+        if values == self.values:
+            self.value_skips += 1
+            return self.heartbeat()
+
+        self.values = values
+        self.stored_at = self.clock()
+        self.changes += 1
+        return values, 'changed'
+
+    def heartbeat(self):
+        if self.values is None or self.clock() - self.stored_at < self.heartbeat_interval:
+            return None, None
+        self.stored_at = self.clock()
+        self.heartbeats += 1
+        return self.values, 'heartbeat'
+
+    def stats(self):
+        return {
+            'polls': self.polls,
+            'stat_skips': self.stat_skips,
+            'hash_skips': self.hash_skips,
+            'value_skips': self.value_skips,
+            'changes': self.changes,
+            'heartbeats': self.heartbeats,
+            'parse_errors': self.parse_errors,
+        }
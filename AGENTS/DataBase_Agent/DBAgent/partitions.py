@@ -0,0 +1,362 @@
+"""
+Time partitions of the raw inverter telemetry.
+
+Every agent reads the current state from the newest rows of
+inverter_operations.db, and inverter_registers is the table that grows with
+every sample. With partitions that live ("hot") file only holds the telemetry
+of the current period: once a period of partition_hours (UTC, aligned to the
+epoch) has closed, PartitionManager copies its rows into a file of their own
+
+    <directory>/inverter_registers_20231114.db       periods of whole days
+    <directory>/inverter_registers_20231114_13.db    shorter periods
+
+and RetentionJob then prunes them from the hot file in small batches (see
+retention.py). Rotation is done online: the copy runs in chunks on the
+ATTACHed partition file with a yield between chunks, and the other agents'
+readers of the hot file never wait for it (WAL). How far rotation has got is
+kept in retention_state, so an interrupted copy is resumed after a restart.
+
+Closed partitions are not written again. Once compress_after_days old they are
+gzipped, a chunk at a time, into <name>.db.gz; raw_days retention deletes whole
+partition files.
+
+query_telemetry() and iter_telemetry() read a time range of inverter_registers
+across the partition files (compressed ones through a temporary copy) and the
+hot file.
+"""
+
+import calendar
+import contextlib
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import urllib.request
+
+import gevent
+
+from .retention import DAY_MS, GRACE_MS, create_state_table, read_state, write_state
+from .schema import INDEXES, ROW_COLUMNS, data_columns, create_table_sql, now_ms
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+TABLE = 'inverter_registers'
+
+# retention_state entry: rows of TABLE with ts_ms below it are in partition files
+STATE_NAME = 'partitioned_inverter_registers'
+
+HOUR_MS = 3600 * 1000
+
+# Indexes of a partition file: the time-range indexes of the hot table
+PARTITION_INDEXES = [(name, columns) for name, table, columns in INDEXES if table == TABLE and 'ts_ms' in columns]
+
+PARTITION_FILE = re.compile(r'^inverter_registers_(\d{8})(?:_(\d{2}))?\.db(\.gz)?$')
+
+# Bytes compressed between two yields
+COMPRESS_CHUNK = 256 * 1024
+
+
+def partition_path(directory, start_ms, period_ms):
+    fmt = '%Y%m%d' if period_ms % DAY_MS == 0 else '%Y%m%d_%H'
+    return os.path.join(directory, f"{TABLE}_{time.strftime(fmt, time.gmtime(start_ms // 1000))}.db")
+
+
+def list_partitions(directory, watermark):
+    """
+    (start ms, end ms, path) of the partition files in directory, oldest first.
+    A partition ends where the next one starts, the last one at the watermark,
+    so files written with another partition_hours are still covered.
+    """
+    starts = {}
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = PARTITION_FILE.match(name)
+            if not match:
+                continue
+            day, hour, compressed = match.groups()
+            start = calendar.timegm(time.strptime(day, '%Y%m%d')) * 1000 + int(hour or 0) * HOUR_MS
+            # A file being compressed exists both ways for a moment; the uncompressed one is complete
+            if start not in starts or not compressed:
+                starts[start] = os.path.join(directory, name)
+    ordered = sorted(starts)
+    ends = ordered[1:] + [max(watermark or 0, ordered[-1] + 1)] if ordered else []
+    return [(start, end, starts[start]) for start, end in zip(ordered, ends)]
+
+
+@contextlib.contextmanager
+def open_partition(path):
+    """Read-only connection to the partition file at path, compressed or not."""
+    if not path.endswith('.gz'):
+        try:
+            conn = sqlite3.connect(f"file:{urllib.request.pathname2url(path)}?mode=ro", uri=True)
+        except sqlite3.OperationalError:
+            # Compressed since it was listed
+            if not os.path.exists(path + '.gz'):
+                raise
+            path += '.gz'
+        else:
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+    with tempfile.NamedTemporaryFile(suffix='.db') as copy:
+        with gzip.open(path, 'rb') as source:
+            shutil.copyfileobj(source, copy)
+        copy.flush()
+        conn = sqlite3.connect(copy.name)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def telemetry_query(fields=None, device_id=None):
+    """(columns, SELECT of inverter_registers for ts_ms >= ? AND ts_ms < ? [AND device_id = ?], oldest first)."""
+    columns = list(fields) if fields else list(ROW_COLUMNS) + data_columns(TABLE)
+    unknown = set(columns) - set(ROW_COLUMNS) - set(data_columns(TABLE))
+    if unknown:
+        raise ValueError(f"Unknown {TABLE} columns {sorted(unknown)}")
+    query = f"SELECT {', '.join(columns)} FROM {TABLE} WHERE ts_ms >= ? AND ts_ms < ?"
+    if device_id is not None:
+        query += " AND device_id = ?"
+    return columns, query + " ORDER BY ts_ms, seq"
+
+
+def telemetry_sources(conn, directory, start_ms, end_ms):
+    """
+    Where the rows of [start_ms, end_ms) are: (partition path, start, end) for
+    the partition files, then (None, start, end) for the hot file of conn.
+    """
+    try:
+        watermark = read_state(conn, STATE_NAME) or 0
+    except sqlite3.OperationalError:
+        # No retention_state yet
+        watermark = 0
+
+    # The hot file is only read from the watermark on: older rows are in the partitions,
+    # even the newest row of a device that the hot file keeps
+    sources = []
+    for start, end, path in list_partitions(directory, watermark):
+        if end > start_ms and start < min(end_ms, watermark):
+            sources.append((path, max(start_ms, start), min(end_ms, end)))
+    sources.append((None, max(start_ms, watermark), end_ms))
+    return sources
+
+
+def iter_telemetry(conn, directory, start_ms, end_ms, device_id=None, fields=None, chunk_rows=10000):
+    """
+    Rows of inverter_registers with start_ms <= ts_ms < end_ms, oldest first, from
+    the partition files in directory and the hot database of conn, as lists of
+    at most chunk_rows rows, so a long range is read in bounded memory.
+    """
+    columns, query = telemetry_query(fields, device_id)
+    for path, start, end in telemetry_sources(conn, directory, start_ms, end_ms):
+        params = (start, end) + ((device_id,) if device_id is not None else ())
+        if path is None:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+            continue
+        with open_partition(path) as partition:
+            cursor = partition.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+
+
+def query_telemetry(conn, directory, start_ms, end_ms, device_id=None, fields=None, limit=None):
+    """
+    Rows of inverter_registers with start_ms <= ts_ms < end_ms, oldest first, from
+    the partition files in directory and the hot database of conn.
+
+    Args:
+        conn: connection to the hot database.
+        directory: directory of the partition files, None without partitions.
+        device_id: only the rows of this device.
+        fields: columns to return, all of them by default.
+        limit: maximum number of rows.
+
+    Returns: (columns, rows).
+    """
+    columns, _ = telemetry_query(fields, device_id)
+    rows = []
+    for chunk in iter_telemetry(conn, directory, start_ms, end_ms, device_id=device_id, fields=fields,
+                                chunk_rows=min(limit, 10000) if limit else 10000):
+        rows.extend(chunk)
+        if limit and len(rows) >= limit:
+            return columns, rows[:limit]
+    return columns, rows
+
+
+class PartitionManager:
+    """
+    Moves closed periods of raw telemetry from the hot file into partition files,
+    compresses old partitions and drops expired ones, a bounded amount per call.
+
+    Args:
+        conn: connection to the hot database.
+        directory: directory of the partition files.
+        partition_hours: length of a partition in hours.
+        compress_after_days: age in days after which a partition is gzipped; None never compresses.
+        copy_batch: rows copied per transaction.
+        batch_pause: seconds yielded between two copy batches.
+        clock: current time in epoch ms.
+    """
+
+    def __init__(self, conn, directory, partition_hours=24, compress_after_days=2, copy_batch=2000,
+                 batch_pause=0.05, clock=now_ms):
+        if partition_hours <= 0:
+            raise ValueError(f"partition_hours must be positive, got {partition_hours}")
+        self.conn = conn
+        self.directory = os.path.expanduser(directory)
+        self.period_ms = int(partition_hours * HOUR_MS)
+        self.compress_after_days = compress_after_days
+        self.copy_batch = copy_batch
+        self.batch_pause = batch_pause
+        self.clock = clock
+
+        # Counters
+        self.rotated = 0
+        self.rows_copied = 0
+        self.compressed = 0
+        self.compressed_bytes_in = 0
+        self.compressed_bytes_out = 0
+        self.dropped = 0
+        self.last_rotate_seconds = 0.0
+
+        os.makedirs(self.directory, exist_ok=True)
+        create_state_table(self.conn)
+        self.conn.commit()
+
+    def watermark(self):
+        """End of the last partitioned period, None before the first rotation."""
+        return read_state(self.conn, STATE_NAME)
+
+    def partitions(self):
+        return list_partitions(self.directory, self.watermark())
+
+    def rotate(self):
+        """Copy the oldest closed period that is not partitioned yet into its file. Returns True if one was."""
+        closed = ((self.clock() - GRACE_MS) // self.period_ms) * self.period_ms
+        # Periods without rows (the agents were stopped) are skipped
+        first = self.conn.execute(f"SELECT MIN(ts_ms) FROM {TABLE} WHERE ts_ms >= ?",
+                                  (self.watermark() or 0,)).fetchone()[0]
+        if first is None:
+            return False
+        start = (first // self.period_ms) * self.period_ms
+        if start >= closed:
+            return False
+        end = start + self.period_ms
+
+        began = time.perf_counter()
+        path = partition_path(self.directory, start, self.period_ms)
+        copied = self.copy_period(path, start, end)
+        with self.conn:
+            write_state(self.conn, STATE_NAME, end)
+        self.last_rotate_seconds = time.perf_counter() - began
+        self.rotated += 1
+        self.rows_copied += copied
+        agent_logger.info(f"Moved {copied} {TABLE} rows to {path} in {self.last_rotate_seconds:.1f} s")
+        return True
+
+    def copy_period(self, path, start, end):
+        """Copy the rows of [start, end) into the partition file at path, resuming an interrupted copy."""
+        columns = ', '.join(list(ROW_COLUMNS) + data_columns(TABLE))
+        copied = 0
+        self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS part", (path,))
+        try:
+            self.conn.execute(create_table_sql(TABLE, name=f"part.{TABLE}"))
+            for name, index_columns in PARTITION_INDEXES:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS part.{name} ON {TABLE} ({', '.join(index_columns)})")
+            self.conn.commit()
+            while True:
+                # Rows are copied in seq order, so the partition's last seq is where to go on
+                with self.conn:
+                    last = self.conn.execute(f"SELECT COALESCE(MAX(seq), 0) FROM part.{TABLE}").fetchone()[0]
+                    cursor = self.conn.execute(
+                        f"INSERT INTO part.{TABLE} ({columns}) SELECT {columns} FROM main.{TABLE} "
+                        f"WHERE ts_ms >= ? AND ts_ms < ? AND seq > ? ORDER BY seq LIMIT ?",
+                        (start, end, last, self.copy_batch))
+                copied += cursor.rowcount
+                if cursor.rowcount < self.copy_batch:
+                    return copied
+                # Let the sampling loop and the group commits in between batches
+                gevent.sleep(self.batch_pause)
+        finally:
+            self.conn.commit()
+            self.conn.execute("DETACH DATABASE part")
+
+    def compress_closed(self):
+        """Gzip the oldest uncompressed partition that is compress_after_days old. Returns True if one was."""
+        if self.compress_after_days is None:
+            return False
+        cutoff = self.clock() - self.compress_after_days * DAY_MS
+        for start, end, path in self.partitions():
+            if end > cutoff:
+                return False
+            if not path.endswith('.gz'):
+                self.compress(path)
+                return True
+        return False
+
+    def compress(self, path):
+        began = time.perf_counter()
+        size = os.path.getsize(path)
+        temp = path + '.gz.tmp'
+        with open(path, 'rb') as source, open(temp, 'wb') as raw:
+            with gzip.GzipFile(filename=os.path.basename(path), mode='wb', fileobj=raw) as target:
+                while True:
+                    chunk = source.read(COMPRESS_CHUNK)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    gevent.sleep(0)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp, path + '.gz')
+        os.remove(path)
+        compressed_size = os.path.getsize(path + '.gz')
+        self.compressed += 1
+        self.compressed_bytes_in += size
+        self.compressed_bytes_out += compressed_size
+        agent_logger.info(f"Compressed {path} from {size / 1e6:.1f} MB to {compressed_size / 1e6:.1f} MB "
+                          f"in {time.perf_counter() - began:.1f} s")
+
+    def drop_before(self, cutoff):
+        """Delete the partition files that end before cutoff (epoch ms)."""
+        for start, end, path in self.partitions():
+            if end > cutoff:
+                return
+            os.remove(path)
+            self.dropped += 1
+            agent_logger.info(f"Deleted expired partition {path}")
+
+    def stats(self):
+        partitions = self.partitions()
+        return {
+            'watermark': self.watermark(),
+            'partitions': len(partitions),
+            'compressed_partitions': sum(1 for _, _, path in partitions if path.endswith('.gz')),
+            'partition_bytes': sum(os.path.getsize(path) for _, _, path in partitions),
+            'rotated': self.rotated,
+            'rows_copied': self.rows_copied,
+            'last_rotate_ms': self.last_rotate_seconds * 1000,
+            'compressed': self.compressed,
+            'compression_ratio': (self.compressed_bytes_in / self.compressed_bytes_out
+                                  if self.compressed_bytes_out else None),
+            'dropped': self.dropped,
+        }
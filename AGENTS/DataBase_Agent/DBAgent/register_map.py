@@ -0,0 +1,145 @@
+"""
+Declarative inverter register map and vectorised decoder.
+
+Every measured value is described once (address, width, signedness, scale, unit)
+and decoded from the raw 16-bit words returned by the Modbus agent. The decoder
+works on a 2-D array of words, one row per sample or per inverter, so a batch
+of any size is decoded with one NumPy operation per field.
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+
+# name: field name (matches the inverter_registers column)
+# address: first register; multi-word values are high word first
+# words: 1 for 16 bit, 2 for 32 bit values
+# signed: two's complement value
+# scale: multiplier from raw value to engineering unit (1 keeps it an integer)
+# unit: engineering unit, for documentation and exports
+RegisterField = namedtuple('RegisterField', 'name address words signed scale unit')
+
+# Failure marker used for registers that could not be read
+MISSING = -1
+
+# struct format character for (words, signed)
+STRUCT_CODES = {(1, False): 'H', (1, True): 'h', (2, False): 'I', (2, True): 'i'}
+
+
+class RegisterMap:
+    """
+    A set of RegisterFields read together.
+
+    addresses lists every register address that has to be read, in ascending
+    order; a row of raw words in that order is decoded by decode().
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.addresses = sorted({field.address + offset for field in self.fields
+                                 for offset in range(field.words)})
+        index = {address: position for position, address in enumerate(self.addresses)}
+
+        # Structured big-endian view over one row of words. Multi-word fields must
+        # sit on consecutive addresses, which holds because addresses is sorted and
+        # contains every word of every field.
+        self.raw_dtype = np.dtype({
+            'names': [field.name for field in self.fields],
+            'formats': [self._raw_format(field) for field in self.fields],
+            'offsets': [2 * index[field.address] for field in self.fields],
+            'itemsize': 2 * len(self.addresses),
+        })
+        self.record_dtype = np.dtype([
+            (field.name, np.int64 if field.scale == 1 else np.float64) for field in self.fields
+        ])
+        self.word_slices = {field.name: slice(index[field.address], index[field.address] + field.words)
+                            for field in self.fields}
+
+        # The same layout as one precompiled struct, for decoding a single row
+        # without the NumPy per-call overhead
+        layout = sorted(self.fields, key=lambda field: field.address)
+        fmt = '>'
+        position = 0
+        for field in layout:
+            fmt += 'x' * (2 * (index[field.address] - position)) + STRUCT_CODES[field.words, field.signed]
+            position = index[field.address] + field.words
+        self.row_words = struct.Struct(f'>{len(self.addresses)}H')
+        self.row_struct = struct.Struct(fmt + 'x' * (2 * (len(self.addresses) - position)))
+        self.row_fields = layout
+
+    @staticmethod
+    def _raw_format(field):
+        if field.words not in (1, 2):
+            raise ValueError(f"Register field {field.name} has unsupported width {field.words}")
+        return ('>i' if field.signed else '>u') + str(2 * field.words)
+
+    def decode(self, words):
+        """
+        Decode raw register words into typed records.
+
+        Args:
+            words: array-like of shape (n_samples, len(addresses)) or (len(addresses),)
+                holding the 16-bit register values in the order of addresses.
+                Registers that could not be read are given as MISSING (or None).
+
+        Returns:
+            structured array of record_dtype with one record per row. Fields with any
+            missing word are set to MISSING.
+        """
+        if not isinstance(words, np.ndarray) or words.dtype == object:
+            # Lists straight from the RPC may hold None for failed registers
+            words = np.array(words, dtype=object)
+            words = np.where(np.equal(words, None), MISSING, words)
+        words = np.atleast_2d(words.astype(np.int64))
+        if words.shape[1] != len(self.addresses):
+            raise ValueError(f"Expected {len(self.addresses)} words per row, got {words.shape[1]}")
+
+        missing = words < 0
+        raw = np.ascontiguousarray(words.astype('>u2')).view(self.raw_dtype).reshape(-1)
+
+        records = np.empty(len(raw), dtype=self.record_dtype)
+        for field in self.fields:
+            values = raw[field.name].astype(np.int64)
+            records[field.name] = values if field.scale == 1 else values * field.scale
+            bad = missing[:, self.word_slices[field.name]].any(axis=1)
+            records[field.name][bad] = MISSING
+        return records
+
+    def decode_one(self, words):
+        """Decode a single row of words into a dict of plain Python values."""
+        if len(words) != len(self.addresses):
+            raise ValueError(f"Expected {len(self.addresses)} words, got {len(words)}")
+        missing = [value is None or value < 0 for value in words]
+        raw = self.row_words.pack(*(0 if bad else value for bad, value in zip(missing, words)))
+        decoded = {}
+        for field, value in zip(self.row_fields, self.row_struct.unpack(raw)):
+            if any(missing[self.word_slices[field.name]]):
+                value = MISSING
+            elif field.scale != 1:
+                value = value * field.scale
+            decoded[field.name] = value
+        return {field.name: decoded[field.name] for field in self.fields}
+
+    def units(self):
+        return {field.name: field.unit for field in self.fields}
+
+
+INVERTER_REGISTER_MAP = RegisterMap([
+    RegisterField('dc_bus_voltage', 33071, 1, False, 0.1, 'V'),
+    RegisterField('dc_bus_half_voltage', 33072, 1, False, 0.1, 'V'),
+    RegisterField('Battery_SOC', 33139, 1, False, 1, '%'),
+    RegisterField('a_phase_voltage', 33073, 1, False, 0.1, 'V'),
+    RegisterField('a_phase_current', 33076, 1, False, 0.1, 'A'),
+    RegisterField('active_power', 33079, 2, True, 1, 'W'),
+    RegisterField('reactive_power', 33081, 2, True, 1, 'var'),
+    RegisterField('apparent_power', 33083, 2, True, 1, 'VA'),
+    RegisterField('inverter_status', 33095, 1, False, 1, None),
+])
+
+
+# Register maps that can be named in the register_map key of a modbus_devices entry
+REGISTER_MAPS = {
+    'inverter': INVERTER_REGISTER_MAP,
+}
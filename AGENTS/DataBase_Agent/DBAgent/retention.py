@@ -0,0 +1,259 @@
+"""
+Retention of the DataBase agent's time-series tables.
+
+Raw rows are kept for a configurable number of days. Before inverter telemetry
+is pruned it is summarised into rollup tables holding the min, mean and max of
+every field per device:
+
+  inverter_registers_1m   one row per device per minute, from the raw rows
+  inverter_registers_15m  one row per device per 15 minutes, from the 1m rollups
+
+so long-term trends stay queryable after the raw rows are gone. Only buckets
+that can no longer receive rows (older than GRACE_MS) are rolled up; how far
+each rollup has got is kept in the retention_state table, so every run only
+processes the new buckets and a restart picks up where the last run stopped.
+
+Rows are written by change detection (see change_detection.py), so a bucket
+summarises the reported rows in it and a minute without any change has no
+bucket; its value is the one of the last bucket before it.
+
+Pruning deletes at most batch_size rows per transaction and yields between
+batches, so the sampling loop and the other agents' readers never wait long.
+The newest row of every table (of every device for inverter_registers) is kept
+whatever its age, because the agents read the current state from it. Freed
+pages are reused by SQLite, which keeps the file size bounded.
+
+With time partitions (see partitions.py) raw telemetry is pruned from the live
+file as soon as it is in its partition file, and raw_days drops whole
+partition files instead of deleting rows.
+"""
+
+import logging
+import time
+
+import gevent
+
+from .schema import TABLES, now_ms
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+# Rollup tables: (name, source table, bucket length in ms); each one is built from the one before it
+ROLLUPS = [
+    ('inverter_registers_1m', 'inverter_registers', 60 * 1000),
+    ('inverter_registers_15m', 'inverter_registers_1m', 15 * 60 * 1000),
+]
+
+# Raw fields summarised in the rollups
+ROLLUP_FIELDS = [column for column, _ in TABLES['inverter_registers'] if column != 'device_id']
+
+# Rows arriving this late (group commit, clock skew) still land in a bucket that is not rolled up yet
+GRACE_MS = 2 * 60 * 1000
+
+# Raw time rolled up per run at most, so catching up on a large database is spread over runs
+MAX_ROLLUP_WINDOW_MS = 6 * 3600 * 1000
+
+# Batches deleted per table per run at most
+MAX_BATCHES_PER_RUN = 20
+
+DAY_MS = 24 * 3600 * 1000
+
+# seq of the latest row of every device: one (device_id, seq) index lookup per device,
+# where MAX(seq) ... GROUP BY device_id would scan the whole index
+LATEST_PER_DEVICE_SQL = '''
+    WITH RECURSIVE devices(device_id) AS (
+        SELECT MIN(device_id) FROM inverter_registers
+        UNION ALL
+        SELECT (SELECT MIN(device_id) FROM inverter_registers WHERE device_id > devices.device_id)
+        FROM devices WHERE device_id IS NOT NULL)
+    SELECT (SELECT MAX(seq) FROM inverter_registers WHERE device_id = devices.device_id)
+    FROM devices WHERE device_id IS NOT NULL
+'''
+
+
+def create_state_table(conn):
+    """retention_state holds the progress (epoch ms) of the rollups and the partition rotation."""
+    conn.execute("CREATE TABLE IF NOT EXISTS retention_state (name TEXT PRIMARY KEY, value INTEGER)")
+
+
+def read_state(conn, name):
+    row = conn.execute("SELECT value FROM retention_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def write_state(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO retention_state (name, value) VALUES (?, ?)", (name, value))
+
+
+def create_rollup_sql(name):
+    columns = ',\n    '.join(f"{field}_{stat} REAL" for field in ROLLUP_FIELDS for stat in ('min', 'mean', 'max'))
+    return (f"CREATE TABLE IF NOT EXISTS {name} (\n"
+            f"    bucket_ms INTEGER NOT NULL,\n"
+            f"    device_id TEXT NOT NULL,\n"
+            f"    samples INTEGER NOT NULL,\n"
+            f"    {columns},\n"
+            f"    PRIMARY KEY (bucket_ms, device_id)\n)")
+
+
+def rollup_select_sql(source, bucket_ms):
+    """SELECT producing the rollup rows of source for bucket_ms >= ? AND < ?."""
+    if source == 'inverter_registers':
+        # From raw rows; -1 marks a register that could not be read and is left out
+        stats = ', '.join(f"MIN(NULLIF({field}, -1)), AVG(NULLIF({field}, -1)), MAX(NULLIF({field}, -1))"
+                          for field in ROLLUP_FIELDS)
+        return (f"SELECT (ts_ms / {bucket_ms}) * {bucket_ms} AS bucket, device_id, COUNT(*), {stats} "
+                f"FROM inverter_registers WHERE ts_ms >= ? AND ts_ms < ? GROUP BY bucket, device_id")
+    # From a finer rollup; the mean is weighted by the samples behind each row
+    stats = ', '.join(f"MIN({field}_min), SUM({field}_mean * samples) / "
+                      f"SUM(CASE WHEN {field}_mean IS NOT NULL THEN samples END), MAX({field}_max)"
+                      for field in ROLLUP_FIELDS)
+    return (f"SELECT (bucket_ms / {bucket_ms}) * {bucket_ms} AS bucket, device_id, SUM(samples), {stats} "
+            f"FROM {source} WHERE bucket_ms >= ? AND bucket_ms < ? GROUP BY bucket, device_id")
+
+
+class RetentionJob:
+    """
+    Rolls up inverter telemetry and prunes old rows, a bounded amount per run().
+
+    Args:
+        conn: connection to the database.
+        raw_days: age in days after which raw rows are pruned; 0 keeps them.
+        rollup_days: {rollup table: age in days after which its rows are pruned};
+            missing or 0 keeps them.
+        batch_size: rows deleted per transaction.
+        batch_pause: seconds yielded between two batches.
+        clock: current time in epoch ms.
+        partitions: PartitionManager of the raw telemetry, None without partitions.
+    """
+
+    def __init__(self, conn, raw_days=7, rollup_days=None, batch_size=500, batch_pause=0.05, clock=now_ms,
+                 partitions=None):
+        self.conn = conn
+        self.raw_days = raw_days
+        self.rollup_days = dict(rollup_days or {})
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.clock = clock
+        self.partitions = partitions
+
+        # Counters
+        self.runs = 0
+        self.rolled_buckets = {name: 0 for name, _, _ in ROLLUPS}
+        self.pruned = {}
+        self.last_run_seconds = 0.0
+
+        create_state_table(self.conn)
+        for name, _, _ in ROLLUPS:
+            self.conn.execute(create_rollup_sql(name))
+        self.conn.commit()
+
+    def watermark(self, name):
+        """Start of the first bucket of name that is not rolled up yet, None before the first run."""
+        return read_state(self.conn, name)
+
+    def set_watermark(self, name, value):
+        write_state(self.conn, name, value)
+
+    def run(self):
+        """One retention pass: new rollup buckets, then a bounded number of prune batches."""
+        start = time.perf_counter()
+        self.runs += 1
+        try:
+            for name, source, bucket_ms in ROLLUPS:
+                self.roll_up(name, source, bucket_ms)
+            self.prune_all()
+        finally:
+            self.last_run_seconds = time.perf_counter() - start
+
+    def roll_up(self, name, source, bucket_ms):
+        """Roll up the complete buckets of source that are past the watermark of name."""
+        if source == 'inverter_registers':
+            end = self.clock() - GRACE_MS
+        else:
+            # A coarser bucket is complete once the finer rollup has passed its end
+            end = self.watermark(source)
+            if end is None:
+                return
+        end = (end // bucket_ms) * bucket_ms
+
+        start = self.watermark(name)
+        if start is None:
+            time_column = 'ts_ms' if source == 'inverter_registers' else 'bucket_ms'
+            first = self.conn.execute(f"SELECT MIN({time_column}) FROM {source}").fetchone()[0]
+            if first is None:
+                return
+            start = (first // bucket_ms) * bucket_ms
+        if start >= end:
+            return
+        end = min(end, start + max(MAX_ROLLUP_WINDOW_MS // bucket_ms, 1) * bucket_ms)
+
+        with self.conn:
+            cursor = self.conn.execute(f"INSERT OR REPLACE INTO {name} {rollup_select_sql(source, bucket_ms)}",
+                                       (start, end))
+            self.set_watermark(name, end)
+        self.rolled_buckets[name] += max(cursor.rowcount, 0)
+        agent_logger.debug(f"Rolled up {source} into {name} up to {end}")
+
+    def prune_all(self):
+        now = self.clock()
+        # Telemetry is only pruned once it is in the finest rollup
+        rolled = self.watermark(ROLLUPS[0][0])
+        rolled = rolled if rolled is not None else 0
+        if self.partitions is not None:
+            # and, with partitions, from the live file as soon as it is in its partition file
+            self.prune('inverter_registers', min(self.partitions.watermark() or 0, rolled))
+        if self.raw_days:
+            cutoff = now - self.raw_days * DAY_MS
+            if self.partitions is not None:
+                self.partitions.drop_before(cutoff)
+            else:
+                self.prune('inverter_registers', min(cutoff, rolled))
+            for table in TABLES:
+                if table != 'inverter_registers':
+                    self.prune(table, cutoff)
+        for name, _, _ in ROLLUPS:
+            days = self.rollup_days.get(name)
+            if days:
+                cutoff = now - days * DAY_MS
+                # Rows not yet in the next coarser rollup are kept
+                for coarser, source, _ in ROLLUPS:
+                    if source == name:
+                        rolled = self.watermark(coarser)
+                        cutoff = min(cutoff, rolled if rolled is not None else 0)
+                self.prune(name, cutoff, time_column='bucket_ms', keep_latest=False)
+
+    def prune(self, table, cutoff, time_column='ts_ms', keep_latest=True):
+        """Delete rows of table older than cutoff (epoch ms), batch_size rows per transaction."""
+        # Looked up once: rows inserted in between are newer than the ones kept
+        if keep_latest and table == 'inverter_registers':
+            kept = [row[0] for row in self.conn.execute(LATEST_PER_DEVICE_SQL)]
+        elif keep_latest:
+            kept = [row[0] for row in self.conn.execute(f"SELECT MAX(seq) FROM {table}") if row[0] is not None]
+        else:
+            kept = []
+        keep = f"AND seq NOT IN ({', '.join('?' * len(kept))})" if kept else ""
+        key = 'seq' if keep_latest else 'rowid'
+        query = (f"DELETE FROM {table} WHERE {key} IN "
+                 f"(SELECT {key} FROM {table} WHERE {time_column} < ? {keep} LIMIT ?)")
+
+        for _ in range(MAX_BATCHES_PER_RUN):
+            with self.conn:
+                deleted = self.conn.execute(query, (cutoff, *kept, self.batch_size)).rowcount
+            if deleted <= 0:
+                return
+            self.pruned[table] = self.pruned.get(table, 0) + deleted
+            if deleted < self.batch_size:
+                return
+            # Let the sampling loop and the group commits in between batches
+            gevent.sleep(self.batch_pause)
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'last_run_ms': self.last_run_seconds * 1000,
+            'watermarks': {name: self.watermark(name) for name, _, _ in ROLLUPS},
+            'rolled_buckets': dict(self.rolled_buckets),
+            'pruned': dict(self.pruned),
+            'partitions': self.partitions.stats() if self.partitions is not None else None,
+        }
@@ -0,0 +1,144 @@
+"""
+Deadline-driven periodic sampling for the DataBase agent.
+
+The agent used to poll in a loop that slept a fixed time after each pass, so
+the real period was the sleep plus however long the Modbus reads took, and it
+drifted with them. PeriodicSampler runs each task on absolute deadlines of a
+monotonic clock instead: the k-th run of a task with period p is due at
+start + k * p whatever the earlier runs took.
+
+A run that takes longer than its period is an overrun. The deadlines it ran
+over are skipped rather than run back to back to catch up, so a slow Modbus
+link lowers the sample rate instead of queueing reads; the run after it starts
+at the next deadline still ahead. Tasks run one at a time, earliest deadline
+first, so one task's long run shows up as jitter of the others.
+
+For each task the sampler keeps the runs, overruns and skipped deadlines, and
+the jitter (how late a run started after its deadline) and duration of the
+last STATS_WINDOW runs.
+"""
+
+import collections
+import logging
+import math
+import time
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+# Runs per task the jitter and duration statistics are computed over
+STATS_WINDOW = 1000
+
+
+def percentile(values, fraction):
+    """Value at fraction (0-1) of the sorted values, 0.0 when there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PeriodicTask:
+    """A function run every period seconds, and its timing counters."""
+
+    def __init__(self, name, function, period, deadline):
+        if period <= 0:
+            raise ValueError(f"period of {name} must be positive, got {period}")
+        self.name = name
+        self.function = function
+        self.period = period
+        self.deadline = deadline
+
+        # Counters
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = collections.deque(maxlen=STATS_WINDOW)
+        self.durations = collections.deque(maxlen=STATS_WINDOW)
+
+    def stats(self):
+        return {
+            'period': self.period,
+            'runs': self.runs,
+            'failures': self.failures,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter_ms_mean': 1000 * sum(self.jitter) / len(self.jitter) if self.jitter else 0.0,
+            'jitter_ms_p99': 1000 * percentile(self.jitter, 0.99),
+            'jitter_ms_max': 1000 * max(self.jitter, default=0.0),
+            'duration_ms_mean': 1000 * sum(self.durations) / len(self.durations) if self.durations else 0.0,
+            'duration_ms_max': 1000 * max(self.durations, default=0.0),
+        }
+
+
+class PeriodicSampler:
+    """
+    Runs tasks on absolute deadlines, see the module docstring.
+
+    Args:
+        clock: monotonic time in seconds.
+        sleep: time.sleep or a cooperative equivalent (gevent.sleep).
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.tasks = {}
+        self.running = False
+
+    def add(self, name, function, period, offset=0.0):
+        """Run function every period seconds, the first time offset seconds from now."""
+        self.tasks[name] = PeriodicTask(name, function, period, self.clock() + offset)
+        agent_logger.info(f"Sampling {name} every {period} s")
+
+    def set_period(self, name, period):
+        """Change the period of a task; its next deadline moves to the last run plus period."""
+        task = self.tasks[name]
+        if period <= 0:
+            raise ValueError(f"period of {name} must be positive, got {period}")
+        task.deadline += period - task.period
+        task.period = period
+        agent_logger.info(f"Sampling {name} every {period} s")
+
+    def run_once(self):
+        """Wait for the earliest deadline and run its task. Returns the task."""
+        task = min(self.tasks.values(), key=lambda task: task.deadline)
+        delay = task.deadline - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+        start = self.clock()
+        task.jitter.append(max(0.0, start - task.deadline))
+        try:
+            task.function()
+        except Exception as e:
+            task.failures += 1
+            agent_logger.error(f"Sampling task {task.name} failed: {e}")
+        end = self.clock()
+        task.durations.append(end - start)
+        task.runs += 1
+
+        # The next deadline still ahead; the ones the run went over are skipped
+        task.deadline += task.period
+        if task.deadline <= end:
+            missed = math.floor((end - task.deadline) / task.period) + 1
+            task.overruns += 1
+            task.skipped += missed
+            task.deadline += missed * task.period
+            agent_logger.warning(f"Sampling task {task.name} took {1000 * (end - start):.0f} ms, "
+                                 f"skipped {missed} deadline(s) of its {task.period} s period")
+        return task
+
+    def run(self):
+        """run_once until stop is called, for a greenlet."""
+        self.running = True
+        while self.running and self.tasks:
+            self.run_once()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {name: task.stats() for name, task in self.tasks.items()}
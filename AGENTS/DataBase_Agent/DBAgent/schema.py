@@ -0,0 +1,138 @@
+"""
+Schema of inverter_operations.db, shared by the DataBase agent and its tools.
+
+Every time-series table starts with two row columns:
+
+  seq    INTEGER PRIMARY KEY AUTOINCREMENT: a per-table sequence number that only
+         grows, so ORDER BY seq DESC LIMIT 1 is the latest row even when several
+         rows share a timestamp, and is answered from the table's own B-tree.
+  ts_ms  time of the row in milliseconds since the Unix epoch (UTC). Integer
+         comparisons and range queries on it are cheaper than on text.
+
+The '%Y-%m-%d %H:%M:%S' local-time text the tables used to store is computed
+from ts_ms by the <table>_timestamped views, for tools that still expect it.
+"""
+
+import logging
+import time
+
+
+agent_logger = logging.getLogger('DataBaseAgent')
+
+
+# Current time in epoch milliseconds in SQL, the default of ts_ms for rows inserted without it
+NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+# Columns every time-series table starts with
+ROW_COLUMNS = ('seq', 'ts_ms')
+
+# Mode and setpoint columns shared by the input tables and operational_data
+INPUT_COLUMNS = [
+    ('fix_power_mode', 'INTEGER'),
+    ('voltage_regulation_mode', 'INTEGER'),
+    ('ESC_volt_reg_mode', 'INTEGER'),
+    ('fix_real_power', 'INTEGER'),
+    ('fix_reactive_power', 'INTEGER'),
+    ('QVVMax', 'INTEGER'),
+    ('VVVMax_Per', 'REAL'),
+    ('Low_Volt_Lmt', 'REAL'),
+    ('High_Volt_Lmt', 'REAL'),
+    ('ESC_VA', 'INTEGER'),
+    ('ESC_VA_steps', 'INTEGER'),
+    ('ESC_Repeat_Time', 'INTEGER'),
+]
+
+# Data columns of each time-series table, after seq and ts_ms
+TABLES = {
+    'local_inputs': INPUT_COLUMNS,
+    'remote_inputs': INPUT_COLUMNS,
+    'operational_data': [('allow_opr', 'INTEGER DEFAULT 0')] + INPUT_COLUMNS,
+    'safety_data': [
+        ('remote_comm', 'INTEGER DEFAULT 1'),
+        ('modbus_comm', 'INTEGER DEFAULT 0'),
+        ('master_switch', 'INTEGER DEFAULT 1'),
+    ],
+    'inverter_registers': [
+        ('device_id', 'TEXT'),
+        ('dc_bus_voltage', 'REAL'),
+        ('dc_bus_half_voltage', 'REAL'),
+        ('Battery_SOC', 'REAL'),
+        ('a_phase_voltage', 'REAL'),
+        ('a_phase_current', 'REAL'),
+        ('active_power', 'REAL'),
+        ('reactive_power', 'REAL'),
+        ('apparent_power', 'REAL'),
+        ('inverter_status', 'INTEGER'),
+    ],
+}
+
+# (index name, table, columns): latest row per device (the other tables use seq itself)
+# and time ranges, per device and across devices (rollups and retention)
+INDEXES = [
+    ('idx_inverter_registers_device_seq', 'inverter_registers', ('device_id', 'seq')),
+    ('idx_inverter_registers_device_ts', 'inverter_registers', ('device_id', 'ts_ms')),
+    ('idx_inverter_registers_ts', 'inverter_registers', ('ts_ms',)),
+    ('idx_operational_data_ts', 'operational_data', ('ts_ms',)),
+    ('idx_safety_data_ts', 'safety_data', ('ts_ms',)),
+    ('idx_local_inputs_ts', 'local_inputs', ('ts_ms',)),
+    ('idx_remote_inputs_ts', 'remote_inputs', ('ts_ms',)),
+]
+
+
+def now_ms():
+    """Current time in epoch milliseconds, for ts_ms."""
+    return int(time.time() * 1000)
+
+
+def data_columns(table):
+    return [name for name, _ in TABLES[table]]
+
+
+def create_table_sql(table, name=None):
+    """CREATE TABLE statement of table, optionally under another name."""
+    columns = ',\n    '.join(f"{column} {declaration}" for column, declaration in TABLES[table])
+    return (f"CREATE TABLE IF NOT EXISTS {name or table} (\n"
+            f"    seq INTEGER PRIMARY KEY AUTOINCREMENT,\n"
+            f"    ts_ms INTEGER NOT NULL DEFAULT ({NOW_MS_SQL}),\n"
+            f"    {columns}\n)")
+
+
+def view_name(table):
+    return f"{table}_timestamped"
+
+
+def create_view_sql(table):
+    """View of table with the text timestamp column it had before ts_ms."""
+    return (f"CREATE VIEW IF NOT EXISTS {view_name(table)} AS "
+            f"SELECT strftime('%Y-%m-%d %H:%M:%S', ts_ms / 1000, 'unixepoch', 'localtime') AS timestamp, * "
+            f"FROM {table}")
+
+
+def migrate_text_timestamps(conn, table):
+    """
+    Rebuild a table of the old schema (text timestamp, no seq) into the current
+    one, in one transaction. ts_ms comes from the local-time text and seq follows
+    the original insertion order. Returns True if the table was migrated.
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if 'seq' in columns or 'timestamp' not in columns:
+        return False
+
+    kept = ', '.join(column for column in data_columns(table) if column in columns)
+    old = f"{table}_before_ts_ms"
+    start = time.time()
+    conn.commit()
+    try:
+        conn.execute("BEGIN")
+        conn.execute(f"ALTER TABLE {table} RENAME TO {old}")
+        conn.execute(create_table_sql(table))
+        conn.execute(f"INSERT INTO {table} (ts_ms, {kept}) "
+                     f"SELECT COALESCE(CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000, 0), {kept} "
+                     f"FROM {old} ORDER BY rowid")
+        conn.execute(f"DROP TABLE {old}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    agent_logger.info(f"Migrated {table} to seq/ts_ms in {time.time() - start:.1f} s")
+    return True
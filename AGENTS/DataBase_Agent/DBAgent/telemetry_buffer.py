@@ -0,0 +1,88 @@
+"""
+Recent inverter telemetry kept in memory.
+
+Control agents that filter or trend the last minutes of telemetry would
+otherwise query inverter_registers, which only holds the changes that passed
+the deadbands, or reread register_data_log.txt. DBAgent records every decoded
+sample of a device in a TelemetryRingBuffer instead: a preallocated NumPy
+structured array of capacity records (ts_ms plus the register map's fields)
+that is overwritten oldest first. A sample costs its record's bytes and no
+Python objects; reads copy out a slice in time order, never touching disk.
+
+Values are as decoded: registers that could not be read hold MISSING (-1).
+ts_ms comes from the wall clock and is expected to increase; after a clock step
+back a time window can miss the samples around the step.
+"""
+
+import numpy as np
+
+
+class TelemetryRingBuffer:
+    """
+    The last capacity samples of one device.
+
+    Args:
+        record_dtype: dtype of a decoded sample (RegisterMap.record_dtype).
+        capacity: number of samples kept.
+    """
+
+    def __init__(self, record_dtype, capacity=3600):
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.fields = list(record_dtype.names)
+        self.dtype = np.dtype([('ts_ms', np.int64)] + [(name, record_dtype[name]) for name in self.fields])
+        self.capacity = capacity
+        self.samples = np.zeros(capacity, dtype=self.dtype)
+        self.next = 0
+        self.count = 0
+        self.appended = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts_ms, fields):
+        """Record a sample: ts_ms and a {field: value} dict of decoded values."""
+        self.samples[self.next] = (ts_ms, *[fields[name] for name in self.fields])
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.appended += 1
+
+    def last(self, n=None):
+        """Copy of the last n samples (all of them for None), oldest first."""
+        n = self.count if n is None else max(0, min(n, self.count))
+        start = self.next - n
+        if start >= 0:
+            return self.samples[start:self.next].copy()
+        # Wrapped, which only happens once the buffer is full
+        return np.concatenate((self.samples[start:], self.samples[:self.next]))
+
+    def window(self, start_ms, end_ms=None):
+        """Copy of the samples with start_ms <= ts_ms < end_ms (no upper bound for None), oldest first."""
+        # The buffer is two runs in time order: samples[next:] once it has wrapped, then samples[:next]
+        runs = (self.samples[self.next:] if self.count == self.capacity else self.samples[:0],
+                self.samples[:self.next])
+        parts = []
+        for run in runs:
+            ts_ms = run['ts_ms']
+            low = ts_ms.searchsorted(start_ms, side='left')
+            high = len(run) if end_ms is None else ts_ms.searchsorted(end_ms, side='left')
+            if high > low:
+                parts.append(run[low:high])
+        if len(parts) == 2:
+            return np.concatenate(parts)
+        return parts[0].copy() if parts else self.samples[:0].copy()
+
+    def stats(self):
+        return {
+            'samples': self.count,
+            'capacity': self.capacity,
+            'appended': self.appended,
+            'bytes_per_sample': self.dtype.itemsize,
+            'oldest_ts_ms': int(self.samples['ts_ms'][(self.next - self.count) % self.capacity]) if self.count else None,
+        }
+
+
+def to_columns(samples, fields=None):
+    """{'ts_ms': [...], field: [...]} of a slice of samples, the form returned over RPC."""
+    names = ['ts_ms'] + [name for name in (fields or samples.dtype.names) if name != 'ts_ms']
+    return {name: samples[name].tolist() for name in names}
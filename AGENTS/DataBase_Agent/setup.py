@@ -20,6 +20,7 @@ setup(
     description="For Caryying out remote control task",
     install_requires=[
         'volttron',
+        'numpy',
         'pymodbus==3.6.4'  # Specify the pymodbus version you have installed or simply use 'pymodbus' for the latest version
     ],
     packages=packages,
@@ -4,9 +4,10 @@ import logging
 import sys
 from volttron.platform.agent import utils
 import sqlite3
-from volttron.platform.vip.agent import Agent, Core, RPC
+from volttron.platform.vip.agent import Agent, Core, RPC, PubSub
 import os
 import time
+from gevent.event import Event
 import csv
 import struct
 import json
@@ -52,6 +53,8 @@ def escvr_factory(config_path, **kwargs):
     ESC_Step_Time = int(config.get('ESC_Step_Time', 2))
     SOC_UP_VltReg_Limit = int(config.get('SOC_UP_VltReg_Limit', 25))
     SOC_DN_VltReg_Limit = int(config.get('SOC_DN_VltReg_Limit', 95))
+    modbus_device_id = config.get('modbus_device_id', 'inverter1')
+    telemetry_max_age = float(config.get('telemetry_max_age', 120))
 
     # Log the values read from the configuration
     agent_logger.info("Configuration values loaded:")
@@ -67,6 +70,8 @@ def escvr_factory(config_path, **kwargs):
     agent_logger.info(f"ESC Step Time: {ESC_Step_Time}")
     agent_logger.info(f"SOC Upper Voltage Limit: {SOC_UP_VltReg_Limit}")
     agent_logger.info(f"SOC Lower Voltage Limit: {SOC_DN_VltReg_Limit}")
+    agent_logger.info(f"Modbus Device ID: {modbus_device_id}")
+    agent_logger.info(f"Telemetry Max Age: {telemetry_max_age}")
 
     # Pass the loaded configuration values to the ESC agent
     return ESCVR(
@@ -82,6 +87,8 @@ def escvr_factory(config_path, **kwargs):
         ESC_Step_Time=ESC_Step_Time,
         SOC_UP_VltReg_Limit=SOC_UP_VltReg_Limit,
         SOC_DN_VltReg_Limit=SOC_DN_VltReg_Limit,
+        modbus_device_id=modbus_device_id,
+        telemetry_max_age=telemetry_max_age,
         **kwargs
     )
 
@@ -92,7 +99,8 @@ class ESCVR(Agent):
 
     def __init__(self, db_path, file_path, curvefitfig_path,remote_input_file, default_pf, ESC_SOC_Limit,
                  inverter_rated_S, normalizing_voltage, max_iter_ESC_Vltg_Reg,
-                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, **kwargs):
+                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, modbus_device_id='inverter1',
+                 telemetry_max_age=120, **kwargs):
         super(ESCVR, self).__init__(**kwargs)
 
         # Assign configuration values to instance variables
@@ -108,6 +116,11 @@ class ESCVR(Agent):
         self.ESC_Step_Time = ESC_Step_Time
         self.SOC_UP_VltReg_Limit = SOC_UP_VltReg_Limit
         self.SOC_DN_VltReg_Limit = SOC_DN_VltReg_Limit
+        # Inverter (of the ones the Modbus agent manages) this agent regulates
+        self.modbus_device_id = modbus_device_id
+        # Inverter values older than this (s) are not acted on, twice the DataBase
+        # agent's telemetry_heartbeat_interval at which it publishes a full snapshot
+        self.telemetry_max_age = telemetry_max_age
 
         # Log initialization
         agent_logger.info("ESC Agent initialized with configuration:")
@@ -123,6 +136,8 @@ class ESCVR(Agent):
         agent_logger.info(f"ESC Step Time: {self.ESC_Step_Time}")
         agent_logger.info(f"SOC Upper Voltage Limit: {self.SOC_UP_VltReg_Limit}")
         agent_logger.info(f"SOC Lower Voltage Limit: {self.SOC_DN_VltReg_Limit}")
+        agent_logger.info(f"Modbus Device: {self.modbus_device_id}")
+        agent_logger.info(f"Telemetry Max Age: {self.telemetry_max_age}")
 
         #General constants used
         self.act_reac_ratio = 0.5
@@ -174,6 +189,12 @@ class ESCVR(Agent):
         # Initialize placeholders for the database connection and cursor
         self.conn = None
         self.cursor = None
+
+        # Latest snapshot published by the DataBase agent on inverter/telemetry
+        self.latest_telemetry = None
+        # Set when the latest inverter values are older than telemetry_max_age
+        self.inverter_data_stale = False
+        self.telemetry_event = Event()
         # Connect to the database
         agent_logger.info(f"trying connecting to data base")
         self.connect_to_db()
@@ -188,6 +209,49 @@ class ESCVR(Agent):
         except sqlite3.Error as e:
             agent_logger.error(f"Error connecting to SQLite database: {e}")
 
+    @PubSub.subscribe('pubsub', 'inverter/telemetry')
+    def on_inverter_telemetry(self, peer, sender, bus, topic, headers, message):
+        """Keep the latest inverter values published by the DataBase agent and wake the control loop."""
+        if message.get('device_id', self.modbus_device_id) != self.modbus_device_id:
+            return
+        if message.get('snapshot', True):
+            self.latest_telemetry = message
+        elif self.latest_telemetry is not None:
+            # Only the fields that changed: apply them over the last snapshot
+            self.latest_telemetry = dict(self.latest_telemetry, **message)
+        else:
+            # No snapshot to apply the changes to yet, inverter_registers is used until one arrives
+            return
+        self.telemetry_event.set()
+
+    def latest_inverter_row(self, columns, query):
+        """
+        Latest inverter values for columns, taken from the last snapshot published on
+        inverter/telemetry while it is at most telemetry_max_age old, else from the latest
+        inverter_registers row of the device (query, selecting ts_ms after columns).
+        Sets inverter_data_stale when that row is older than telemetry_max_age too.
+        """
+        now_ms = time.time() * 1000
+        if self.latest_telemetry is not None:
+            age = (now_ms - self.latest_telemetry.get('ts_ms', 0)) / 1000
+            if age <= self.telemetry_max_age:
+                self.inverter_data_stale = False
+                return tuple(self.latest_telemetry.get(column) for column in columns)
+            # The DataBase agent stopped publishing: its last snapshot is dropped
+            agent_logger.warning(f"Telemetry snapshot is {age:.0f} s old, querying inverter_registers")
+            self.latest_telemetry = None
+        else:
+            agent_logger.info("No telemetry snapshot received yet, querying inverter_registers")
+        self.cursor.execute(query, (self.modbus_device_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        age = (now_ms - (row[-1] or 0)) / 1000
+        self.inverter_data_stale = age > self.telemetry_max_age
+        if self.inverter_data_stale:
+            agent_logger.warning(f"Latest inverter_registers row of {self.modbus_device_id} is {age:.0f} s old")
+        return row[:-1]
+
     def fetch_selected_inverter_data(self):
         """
         Fetch only the selected inverter data (a_phase_voltage, active_power, reactive_power, apparent_power) from the DBA.
@@ -195,14 +259,14 @@ class ESCVR(Agent):
         try:
             # Query to fetch the required data from the inverter_registers table
             query_selected_inverter = """
-                SELECT a_phase_voltage, active_power, reactive_power, apparent_power
+                SELECT a_phase_voltage, active_power, reactive_power, apparent_power, ts_ms
                 FROM inverter_registers
-                ORDER BY timestamp DESC
+                WHERE device_id = ?
+                ORDER BY seq DESC
                 LIMIT 1
             """
-            agent_logger.info("Executing query for selected inverter data")
-            self.cursor.execute(query_selected_inverter)
-            selected_inverter_row = self.cursor.fetchone()
+            selected_inverter_row = self.latest_inverter_row(
+                ('a_phase_voltage', 'active_power', 'reactive_power', 'apparent_power'), query_selected_inverter)
 
             if selected_inverter_row:
                 (a_phase_voltage, active_power, reactive_power, apparent_power) = selected_inverter_row
@@ -232,7 +296,7 @@ class ESCVR(Agent):
                        fix_real_power, fix_reactive_power, QVVMax, VVVMax_Per, Low_Volt_Lmt, High_Volt_Lmt, 
                        ESC_VA, ESC_VA_steps, ESC_Repeat_Time
                 FROM operational_data
-                ORDER BY timestamp DESC
+                ORDER BY seq DESC
                 LIMIT 1
             """
             agent_logger.info("Executing query for operational_data")
@@ -251,14 +315,16 @@ class ESCVR(Agent):
             # Query to fetch all inverter register data from the inverter_registers table
             query_inverter = """
                 SELECT dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current, 
-                       active_power, reactive_power, apparent_power, inverter_status
+                       active_power, reactive_power, apparent_power, inverter_status, ts_ms
                 FROM inverter_registers
-                ORDER BY timestamp DESC
+                WHERE device_id = ?
+                ORDER BY seq DESC
                 LIMIT 1
             """
-            agent_logger.info("Executing query for inverter_registers")
-            self.cursor.execute(query_inverter)
-            inverter_row = self.cursor.fetchone()
+            inverter_row = self.latest_inverter_row(
+                ('dc_bus_voltage', 'dc_bus_half_voltage', 'Battery_SOC', 'a_phase_voltage', 'a_phase_current',
+                 'active_power', 'reactive_power', 'apparent_power', 'inverter_status'),
+                query_inverter)
 
             if inverter_row:
                 (dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current,
@@ -437,11 +503,16 @@ class ESCVR(Agent):
                 # *********************************************************
 
                 # ***********RUN ESC to find right combo of PQ ***************
-                if self.ESC_VOLT_REG_Runing:
+                if self.inverter_data_stale:
+                    agent_logger.warning(f"Inverter data older than {self.telemetry_max_age} s, "
+                                         f"voltage regulation skipped")
+                elif self.ESC_VOLT_REG_Runing:
                     self.RUN_VOLTAGE_REGULATION(PU_Voltage)
                 # *********************************************************
 
-            time.sleep(5)
+            # Run again as soon as a new telemetry snapshot arrives, at the latest after 5 s
+            self.telemetry_event.wait(timeout=5)
+            self.telemetry_event.clear()
 
 
 def main():
@@ -4,9 +4,10 @@ import logging
 import sys
 from volttron.platform.agent import utils
 import sqlite3
-from volttron.platform.vip.agent import Agent, Core, RPC
+from volttron.platform.vip.agent import Agent, Core, RPC, PubSub
 import os
 import time
+from gevent.event import Event
 import csv
 import struct
 
@@ -50,6 +51,9 @@ def FixPQ_factory(config_path, **kwargs):
     ESC_Step_Time = int(config.get('ESC_Step_Time', 2))
     SOC_UP_VltReg_Limit = int(config.get('SOC_UP_VltReg_Limit', 25))
     SOC_DN_VltReg_Limit = int(config.get('SOC_DN_VltReg_Limit', 95))
+    modbus_peer = config.get('modbus_peer', 'Mod_Commagent-0.1_1')
+    modbus_device_id = config.get('modbus_device_id', 'inverter1')
+    telemetry_max_age = float(config.get('telemetry_max_age', 120))
 
     # Log the values read from the configuration
     agent_logger.info("Configuration values loaded:")
@@ -65,6 +69,9 @@ def FixPQ_factory(config_path, **kwargs):
     agent_logger.info(f"ESC Step Time: {ESC_Step_Time}")
     agent_logger.info(f"SOC Upper Voltage Limit: {SOC_UP_VltReg_Limit}")
     agent_logger.info(f"SOC Lower Voltage Limit: {SOC_DN_VltReg_Limit}")
+    agent_logger.info(f"Modbus Peer: {modbus_peer}")
+    agent_logger.info(f"Modbus Device ID: {modbus_device_id}")
+    agent_logger.info(f"Telemetry Max Age: {telemetry_max_age}")
 
     # Pass the loaded configuration values to the ESC agent
     return FixPQ(
@@ -80,6 +87,9 @@ def FixPQ_factory(config_path, **kwargs):
         ESC_Step_Time=ESC_Step_Time,
         SOC_UP_VltReg_Limit=SOC_UP_VltReg_Limit,
         SOC_DN_VltReg_Limit=SOC_DN_VltReg_Limit,
+        modbus_peer=modbus_peer,
+        modbus_device_id=modbus_device_id,
+        telemetry_max_age=telemetry_max_age,
         **kwargs
     )
 
@@ -91,7 +101,9 @@ class FixPQ(Agent):
 
     def __init__(self, db_path, file_path, curvefitfig_path, remote_input_file, default_pf, ESC_SOC_Limit,
                  inverter_rated_S, normalizing_voltage, max_iter_ESC_Vltg_Reg,
-                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, **kwargs):
+                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit,
+                 modbus_peer='Mod_Commagent-0.1_1', modbus_device_id='inverter1',
+                 telemetry_max_age=120, **kwargs):
         super(FixPQ, self).__init__(**kwargs)
 
         # Assign configuration values to instance variables
@@ -107,6 +119,15 @@ class FixPQ(Agent):
         self.ESC_Step_Time = ESC_Step_Time
         self.SOC_UP_VltReg_Limit = SOC_UP_VltReg_Limit
         self.SOC_DN_VltReg_Limit = SOC_DN_VltReg_Limit
+        # Modbus agent, and the inverter (of the ones it manages) this agent works on
+        self.modbus_peer = modbus_peer
+        self.modbus_device_id = modbus_device_id
+        # Inverter values older than this (s) are not acted on, twice the DataBase
+        # agent's telemetry_heartbeat_interval at which it publishes a full snapshot
+        self.telemetry_max_age = telemetry_max_age
+
+        # Set from the Modbus agent's circuit breaker; no setpoints are sent while open
+        self.modbus_breaker_open = False
 
         # Log initialization
         agent_logger.info("ESC Agent initialized with configuration:")
@@ -122,6 +143,8 @@ class FixPQ(Agent):
         agent_logger.info(f"ESC Step Time: {self.ESC_Step_Time}")
         agent_logger.info(f"SOC Upper Voltage Limit: {self.SOC_UP_VltReg_Limit}")
         agent_logger.info(f"SOC Lower Voltage Limit: {self.SOC_DN_VltReg_Limit}")
+        agent_logger.info(f"Modbus Device: {self.modbus_device_id} via {self.modbus_peer}")
+        agent_logger.info(f"Telemetry Max Age: {self.telemetry_max_age}")
 
 
         # General constants used
@@ -170,6 +193,12 @@ class FixPQ(Agent):
         self.conn = None
         self.cursor = None
 
+        # Latest snapshot published by the DataBase agent on inverter/telemetry
+        self.latest_telemetry = None
+        # Set when the latest inverter values are older than telemetry_max_age
+        self.inverter_data_stale = False
+        self.telemetry_event = Event()
+
         # Connect to the database
         agent_logger.info(f"trying connecting to data base")
         self.connect_to_db()
@@ -184,6 +213,49 @@ class FixPQ(Agent):
         except sqlite3.Error as e:
             agent_logger.error(f"Error connecting to SQLite database: {e}")
 
+    @PubSub.subscribe('pubsub', 'inverter/telemetry')
+    def on_inverter_telemetry(self, peer, sender, bus, topic, headers, message):
+        """Keep the latest inverter values published by the DataBase agent and wake the control loop."""
+        if message.get('device_id', self.modbus_device_id) != self.modbus_device_id:
+            return
+        if message.get('snapshot', True):
+            self.latest_telemetry = message
+        elif self.latest_telemetry is not None:
+            # Only the fields that changed: apply them over the last snapshot
+            self.latest_telemetry = dict(self.latest_telemetry, **message)
+        else:
+            # No snapshot to apply the changes to yet, inverter_registers is used until one arrives
+            return
+        self.telemetry_event.set()
+
+    def latest_inverter_row(self, columns, query):
+        """
+        Latest inverter values for columns, taken from the last snapshot published on
+        inverter/telemetry while it is at most telemetry_max_age old, else from the latest
+        inverter_registers row of the device (query, selecting ts_ms after columns).
+        Sets inverter_data_stale when that row is older than telemetry_max_age too.
+        """
+        now_ms = time.time() * 1000
+        if self.latest_telemetry is not None:
+            age = (now_ms - self.latest_telemetry.get('ts_ms', 0)) / 1000
+            if age <= self.telemetry_max_age:
+                self.inverter_data_stale = False
+                return tuple(self.latest_telemetry.get(column) for column in columns)
+            # The DataBase agent stopped publishing: its last snapshot is dropped
+            agent_logger.warning(f"Telemetry snapshot is {age:.0f} s old, querying inverter_registers")
+            self.latest_telemetry = None
+        else:
+            agent_logger.info("No telemetry snapshot received yet, querying inverter_registers")
+        self.cursor.execute(query, (self.modbus_device_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        age = (now_ms - (row[-1] or 0)) / 1000
+        self.inverter_data_stale = age > self.telemetry_max_age
+        if self.inverter_data_stale:
+            agent_logger.warning(f"Latest inverter_registers row of {self.modbus_device_id} is {age:.0f} s old")
+        return row[:-1]
+
     def fetch_from_DBA(self):
         """
         Fetch all operational and inverter register data from the DBA and update instance variables.
@@ -195,7 +267,7 @@ class FixPQ(Agent):
                        fix_real_power, fix_reactive_power, QVVMax, VVVMax_Per, Low_Volt_Lmt, High_Volt_Lmt, 
                        ESC_VA, ESC_VA_steps, ESC_Repeat_Time
                 FROM operational_data
-                ORDER BY timestamp DESC
+                ORDER BY seq DESC
                 LIMIT 1
             """
             agent_logger.info("Executing query for operational_data")
@@ -213,14 +285,16 @@ class FixPQ(Agent):
             # Query to fetch all inverter register data from the inverter_registers table
             query_inverter = """
                 SELECT dc_bus_voltage, dc_bus_half_voltage, Battery_SOC, a_phase_voltage, a_phase_current, 
-                       active_power, reactive_power, apparent_power, inverter_status
+                       active_power, reactive_power, apparent_power, inverter_status, ts_ms
                 FROM inverter_registers
-                ORDER BY timestamp DESC
+                WHERE device_id = ?
+                ORDER BY seq DESC
                 LIMIT 1
             """
-            agent_logger.info("Executing query for inverter_registers")
-            self.cursor.execute(query_inverter)
-            inverter_row = self.cursor.fetchone()
+            inverter_row = self.latest_inverter_row(
+                ('dc_bus_voltage', 'dc_bus_half_voltage', 'Battery_SOC', 'a_phase_voltage', 'a_phase_current',
+                 'active_power', 'reactive_power', 'apparent_power', 'inverter_status'),
+                query_inverter)
 
             if inverter_row:
                 (self.dc_bus_voltage, self.dc_bus_half_voltage, self.Battery_SOC, self.a_phase_voltage,
@@ -259,9 +333,25 @@ class FixPQ(Agent):
         agent_logger.info(f"Voltage {self.PU_Voltage}")
 
     #Second
+    @PubSub.subscribe('pubsub', 'modbus/circuit_breaker')
+    def on_modbus_breaker(self, peer, sender, bus, topic, headers, message):
+        """Track the Modbus link state published by the Modbus communication agent."""
+        if message.get('device_id', self.modbus_device_id) != self.modbus_device_id:
+            return
+        self.modbus_breaker_open = message.get('state') == 'open'
+        agent_logger.info(f"Modbus circuit breaker for {message.get('device')} is {message.get('state')}")
+
     def Execute_Powers(self, real_power, reactive_power, dc_bus_voltage):
 
-        peer = "Mod_Commagent-0.1_1"
+        peer = self.modbus_peer
+
+        if self.modbus_breaker_open:
+            agent_logger.info("Modbus link is down (circuit breaker open), setpoints not sent")
+            return
+
+        if self.inverter_data_stale:
+            agent_logger.warning(f"Inverter data older than {self.telemetry_max_age} s, setpoints not sent")
+            return
 
         # Calculate reactive power as a percentage of the inverter's rated capacity
         reactive_power_percentage = (reactive_power / self.inverter_rated_S) * 100
@@ -297,87 +387,102 @@ class FixPQ(Agent):
         # Set the working mode to Reactive Power Mode (4)
         working_mode_reactive_power = 4
 
+        # All setpoints are collected first and sent in one batch RPC;
+        # contiguous registers are written with a single FC16 frame
+        setpoints = {}
+
         try:
             # Step 1: Set the working mode to "Reactive Power"
-            agent_logger.info("Setting working mode to Reactive Power Mode (4)")
-            self.vip.rpc.call(peer, '_Write_Inverter', 43050, working_mode_reactive_power, 16).get(timeout=10)
-            agent_logger.info("Working mode set to Reactive Power Mode (4)")
+            agent_logger.info("Queueing working mode Reactive Power Mode (4) for register 43050")
+            setpoints[43050] = working_mode_reactive_power
 
             # Step 2: Write the limited reactive power value to the inverter register
-            agent_logger.info(f"Writing {reg_limit_reactive_power} to Limit Reactive Power register 43051")
-            self.vip.rpc.call(peer, '_Write_Inverter', 43051, reg_limit_reactive_power, 16).get(timeout=10)
+            agent_logger.info(f"Queueing {reg_limit_reactive_power} for Limit Reactive Power register 43051")
+            setpoints[43051] = reg_limit_reactive_power
 
             # Step 3: Set charging or discharging current based on real power
             if real_power > 0:
 
                 # Set discharge time for the entire day (start at 00:01 and end at 23:58)
-                agent_logger.info("Setting discharge time for the entire day.")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43147, 0, 16).get(timeout=10)  # Discharge start hour to 0
-                self.vip.rpc.call(peer, '_Write_Inverter', 43148, 1, 16).get(timeout=10)  # Discharge start minute to 1
-                self.vip.rpc.call(peer, '_Write_Inverter', 43149, 23, 16).get(timeout=10)  # Discharge end hour to 23
-                self.vip.rpc.call(peer, '_Write_Inverter', 43150, 58, 16).get(timeout=10)  # Discharge end minute to 58
-                agent_logger.info("Discharge time set to 00:01 - 23:58.")
+                agent_logger.info("Planning discharge time for the entire day.")
+                setpoints[43147] = 0  # Discharge start hour to 0
+                setpoints[43148] = 1  # Discharge start minute to 1
+                setpoints[43149] = 23  # Discharge end hour to 23
+                setpoints[43150] = 58  # Discharge end minute to 58
+                agent_logger.info("Discharge time planned as 00:01 - 23:58.")
 
                 # Set charge time for 1 minute
-                agent_logger.info("Setting charge time for 1 minute")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43143, 23, 16).get(timeout=10)  # Charge start hour to 23
-                self.vip.rpc.call(peer, '_Write_Inverter', 43144, 59, 16).get(timeout=10)  # Charge start minute to 59
-                self.vip.rpc.call(peer, '_Write_Inverter', 43145, 0, 16).get(timeout=10)  # Charge end hour to 0
-                self.vip.rpc.call(peer, '_Write_Inverter', 43146, 0, 16).get(timeout=10)  # Charge end minute to 0
-                agent_logger.info("Charge time set to 23:59 - 00:00.")
+                agent_logger.info("Planning charge time for 1 minute")
+                setpoints[43143] = 23  # Charge start hour to 23
+                setpoints[43144] = 59  # Charge start minute to 59
+                setpoints[43145] = 0  # Charge end hour to 0
+                setpoints[43146] = 0  # Charge end minute to 0
+                agent_logger.info("Charge time planned as 23:59 - 00:00.")
 
 
                 # Discharge the battery
                 discharge_current = abs(current_real+1) #+1
                 reg_discharge_current = int(discharge_current * 10)  # Convert to 0.1A steps
-                agent_logger.info(f"Writing discharge current {reg_discharge_current} to register 43142")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43142, reg_discharge_current, 16).get(timeout=10)
+                agent_logger.info(f"Queueing discharge current {reg_discharge_current} for register 43142")
+                setpoints[43142] = reg_discharge_current
 
-                agent_logger.info(f"Writing charge current 0 to register 43141")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43141, 0, 16).get(timeout=10)
+                agent_logger.info(f"Queueing charge current 0 for register 43141")
+                setpoints[43141] = 0
 
 
             elif real_power < 0:
 
                 # Set charge time for the entire day (start at 00:01 and end at 23:58)
-                agent_logger.info("Setting charge time for the entire day.")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43143, 0, 16).get(timeout=10)
-                self.vip.rpc.call(peer, '_Write_Inverter', 43144, 1, 16).get(timeout=10)
-                self.vip.rpc.call(peer, '_Write_Inverter', 43145, 23, 16).get(timeout=10)
-                self.vip.rpc.call(peer, '_Write_Inverter', 43146, 58, 16).get(timeout=10)
-                agent_logger.info("Charge time set to 00:01 - 23:58.")
+                agent_logger.info("Planning charge time for the entire day.")
+                setpoints[43143] = 0
+                setpoints[43144] = 1
+                setpoints[43145] = 23
+                setpoints[43146] = 58
+                agent_logger.info("Charge time planned as 00:01 - 23:58.")
 
                 # Set discharge time for 1 minute
-                agent_logger.info("Setting discharge time for 1 minute")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43147, 23, 16).get(timeout=10)  # Discharge start hour to 23
-                self.vip.rpc.call(peer, '_Write_Inverter', 43148, 59, 16).get(timeout=10)  # Discharge start minute to 59
-                self.vip.rpc.call(peer, '_Write_Inverter', 43149, 0, 16).get(timeout=10)  # Discharge end hour to 0
-                self.vip.rpc.call(peer, '_Write_Inverter', 43150, 0, 16).get(timeout=10)  # Discharge end minute to 0
-                agent_logger.info("Discharge time set to 23:59 - 00:00.")
+                agent_logger.info("Planning discharge time for 1 minute")
+                setpoints[43147] = 23  # Discharge start hour to 23
+                setpoints[43148] = 59  # Discharge start minute to 59
+                setpoints[43149] = 0  # Discharge end hour to 0
+                setpoints[43150] = 0  # Discharge end minute to 0
+                agent_logger.info("Discharge time planned as 23:59 - 00:00.")
 
                 # Charge the battery
                 charge_current = abs(current_real)#-0
                 reg_charge_current = int(charge_current * 10)  # Convert to 0.1A steps
-                agent_logger.info(f"Writing charge current {reg_charge_current} to register 43141")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43141, reg_charge_current, 16).get(timeout=10)
+                agent_logger.info(f"Queueing charge current {reg_charge_current} for register 43141")
+                setpoints[43141] = reg_charge_current
 
-                agent_logger.info(f"Writing discharge current 0 to register 43142")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43142, 0, 16).get(timeout=10)
+                agent_logger.info(f"Queueing discharge current 0 for register 43142")
+                setpoints[43142] = 0
 
 
             else:
-                agent_logger.info("Real power is zero, both charge discharge setting zero")
+                agent_logger.info("Real power is zero, both charge and discharge current planned as zero")
                 discharge_current = 0
                 reg_0_current = int(discharge_current * 10)  # Convert to 0.1A steps
-                agent_logger.info(f"Writing discharge current {reg_0_current} to register 43142")
-                self.vip.rpc.call(peer, '_Write_Inverter', 43142, reg_0_current, 16).get(timeout=10)
-                self.vip.rpc.call(peer, '_Write_Inverter', 43141, reg_0_current, 16).get(timeout=10)
+                agent_logger.info(f"Queueing charge and discharge current {reg_0_current} for registers 43141, 43142")
+                setpoints[43142] = reg_0_current
+                setpoints[43141] = reg_0_current
+
+            # Step 4: Send the whole setpoint program to the inverter
+            agent_logger.info(f"Sending setpoint batch: {setpoints}")
+            result = self.vip.rpc.call(peer, '_Write_Inverter_Batch', setpoints, 16,
+                                       device_id=self.modbus_device_id).get(timeout=30)
+            # Only the registers the Modbus agent confirmed are reported as written
+            for register, success in sorted(result.items(), key=lambda item: int(item[0])):
+                if success:
+                    agent_logger.info(f"Register {register} written: {setpoints[int(register)]}")
+            failed = [register for register, success in result.items() if not success]
+            if failed:
+                agent_logger.error(f"Failed to write registers {failed}")
 
         except Exception as e:
             agent_logger.error(f"Error during RPC call to {peer}: {str(e)}")
 
     def FixPQFun(self):
-        peer = "Mod_Commagent-0.1_1"
+        peer = self.modbus_peer
         agent_logger.info("Fix Power Mode started...")
 
         # Get fix real and reactive power from the registers
@@ -415,7 +520,7 @@ class FixPQ(Agent):
                     """
                             Prepare fix power  settings by writing small power values before switching to remote functionality.
                     """
-                    peer = "Mod_Commagent-0.1_1"
+                    peer = self.modbus_peer
                     agent_logger.info("Preparing FP mode initial settings...")
 
                 else:
@@ -433,7 +538,9 @@ class FixPQ(Agent):
                 agent_logger.info(f"Conditions not met for FixPQ: skipping. Fix power Mode = {self.fix_power_mode}, Allow Operation = {self.allow_opr}")
 
 
-            time.sleep(5)
+            # Run again as soon as a new telemetry snapshot arrives, at the latest after 5 s
+            self.telemetry_event.wait(timeout=5)
+            self.telemetry_event.clear()
 
 
 #add allow operation from database,self.allow_operation
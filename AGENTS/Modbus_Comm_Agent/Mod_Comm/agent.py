@@ -12,8 +12,14 @@ from volttron.platform.agent import utils
 import minimalmodbus
 import threading
 import time
+import gevent
 import os
 
+from .block_planner import plan_block_reads, plan_block_writes, trim_block_writes, extract_registers
+from .devices import ModbusDevice, ModbusPort, DEFAULT_DEVICE_ID
+from .resilience import RetryPolicy, CircuitBreaker, CircuitOpenError
+from .scheduler import DeadlineExceeded
+
 
 """
 Setup agent-specific logging
@@ -29,6 +35,9 @@ agent_logger.addHandler(file_handler)
 utils.setup_logging()
 __version__ = '0.1'
 
+# Topic on which circuit breaker state changes are published
+BREAKER_TOPIC = 'modbus/circuit_breaker'
+
 
 
 
@@ -56,6 +65,28 @@ def Mod_Comm_factory(config_path, **kwargs):
     ESC_Step_Time = int(config.get('ESC_Step_Time', 2))
     SOC_UP_VltReg_Limit = int(config.get('SOC_UP_VltReg_Limit', 25))
     SOC_DN_VltReg_Limit = int(config.get('SOC_DN_VltReg_Limit', 95))
+    modbus_port = config.get('modbus_port', '/dev/Modbus_Converter')
+    modbus_slave_id = int(config.get('modbus_slave_id', 1))
+    modbus_baudrate = int(config.get('modbus_baudrate', 9600))
+    modbus_timeout = float(config.get('modbus_timeout', 1))
+    modbus_health_check_interval = int(config.get('modbus_health_check_interval', 30))
+    block_read_max_gap = int(config.get('block_read_max_gap', 16))
+    block_read_max_size = int(config.get('block_read_max_size', 32))
+    shadow_refresh_interval = int(config.get('shadow_refresh_interval', 300))
+    shadow_max_bridge = int(config.get('shadow_max_bridge', 4))
+    inverter_status_register = int(config.get('inverter_status_register', 33095))
+    scheduler_deadlines = config.get('scheduler_deadlines', {'safety': 30, 'control': 10, 'telemetry': 5})
+    scheduler_aging_interval = float(config.get('scheduler_aging_interval', 2))
+    read_retry_policy = config.get('read_retry_policy', {'max_attempts': 5, 'initial_delay': 0.5, 'max_delay': 2, 'total_deadline': 6})
+    write_retry_policy = config.get('write_retry_policy', {'max_attempts': 5, 'initial_delay': 0.5, 'max_delay': 4, 'total_deadline': 8})
+    breaker_failure_threshold = int(config.get('breaker_failure_threshold', 3))
+    breaker_probe_interval = float(config.get('breaker_probe_interval', 10))
+    read_cache_ttl = float(config.get('read_cache_ttl', 0.5))
+    metrics_dump_path = config.get('metrics_dump_path', '~/Log_Files/ModbusMetrics.jsonl')
+    metrics_dump_interval = float(config.get('metrics_dump_interval', 60))
+    modbus_devices = config.get('modbus_devices', None)
+    modbus_tcp_pool_size = int(config.get('modbus_tcp_pool_size', 2))
+    modbus_tcp_max_in_flight = int(config.get('modbus_tcp_max_in_flight', 4))
 
     # Log the values read from the configuration
     agent_logger.info("Configuration values loaded:")
@@ -71,6 +102,28 @@ def Mod_Comm_factory(config_path, **kwargs):
     agent_logger.info(f"ESC Step Time: {ESC_Step_Time}")
     agent_logger.info(f"SOC Upper Voltage Limit: {SOC_UP_VltReg_Limit}")
     agent_logger.info(f"SOC Lower Voltage Limit: {SOC_DN_VltReg_Limit}")
+    agent_logger.info(f"Modbus Port: {modbus_port}")
+    agent_logger.info(f"Modbus Slave ID: {modbus_slave_id}")
+    agent_logger.info(f"Modbus Baudrate: {modbus_baudrate}")
+    agent_logger.info(f"Modbus Timeout: {modbus_timeout}")
+    agent_logger.info(f"Modbus Health Check Interval: {modbus_health_check_interval}")
+    agent_logger.info(f"Block Read Max Gap: {block_read_max_gap}")
+    agent_logger.info(f"Block Read Max Size: {block_read_max_size}")
+    agent_logger.info(f"Shadow Refresh Interval: {shadow_refresh_interval}")
+    agent_logger.info(f"Shadow Max Bridge: {shadow_max_bridge}")
+    agent_logger.info(f"Inverter Status Register: {inverter_status_register}")
+    agent_logger.info(f"Scheduler Deadlines: {scheduler_deadlines}")
+    agent_logger.info(f"Scheduler Aging Interval: {scheduler_aging_interval}")
+    agent_logger.info(f"Read Retry Policy: {read_retry_policy}")
+    agent_logger.info(f"Write Retry Policy: {write_retry_policy}")
+    agent_logger.info(f"Breaker Failure Threshold: {breaker_failure_threshold}")
+    agent_logger.info(f"Breaker Probe Interval: {breaker_probe_interval}")
+    agent_logger.info(f"Read Cache TTL: {read_cache_ttl}")
+    agent_logger.info(f"Metrics Dump Path: {metrics_dump_path}")
+    agent_logger.info(f"Metrics Dump Interval: {metrics_dump_interval}")
+    agent_logger.info(f"Modbus Devices: {modbus_devices}")
+    agent_logger.info(f"Modbus TCP Pool Size: {modbus_tcp_pool_size}")
+    agent_logger.info(f"Modbus TCP Max In Flight: {modbus_tcp_max_in_flight}")
 
     # Pass the loaded configuration values to the ESC agent
     return Mod_Comm(
@@ -86,6 +139,28 @@ def Mod_Comm_factory(config_path, **kwargs):
         ESC_Step_Time=ESC_Step_Time,
         SOC_UP_VltReg_Limit=SOC_UP_VltReg_Limit,
         SOC_DN_VltReg_Limit=SOC_DN_VltReg_Limit,
+        modbus_port=modbus_port,
+        modbus_slave_id=modbus_slave_id,
+        modbus_baudrate=modbus_baudrate,
+        modbus_timeout=modbus_timeout,
+        modbus_health_check_interval=modbus_health_check_interval,
+        block_read_max_gap=block_read_max_gap,
+        block_read_max_size=block_read_max_size,
+        shadow_refresh_interval=shadow_refresh_interval,
+        shadow_max_bridge=shadow_max_bridge,
+        inverter_status_register=inverter_status_register,
+        scheduler_deadlines=scheduler_deadlines,
+        scheduler_aging_interval=scheduler_aging_interval,
+        read_retry_policy=read_retry_policy,
+        write_retry_policy=write_retry_policy,
+        breaker_failure_threshold=breaker_failure_threshold,
+        breaker_probe_interval=breaker_probe_interval,
+        read_cache_ttl=read_cache_ttl,
+        metrics_dump_path=metrics_dump_path,
+        metrics_dump_interval=metrics_dump_interval,
+        modbus_devices=modbus_devices,
+        modbus_tcp_pool_size=modbus_tcp_pool_size,
+        modbus_tcp_max_in_flight=modbus_tcp_max_in_flight,
         **kwargs
     )
 
@@ -99,12 +174,19 @@ class SafetyData:
 
 class Mod_Comm(Agent):
     """
-    An agent that performs asynchronous Modbus RTU communication.
+    An agent that performs asynchronous Modbus RTU and Modbus TCP communication.
     """
 
     def __init__(self, db_path, file_path, curvefitfig_path,remote_input_file, default_pf, ESC_SOC_Limit,
                  inverter_rated_S, normalizing_voltage, max_iter_ESC_Vltg_Reg,
-                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, **kwargs):
+                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, modbus_port='/dev/Modbus_Converter',
+                 modbus_slave_id=1, modbus_baudrate=9600, modbus_timeout=1, modbus_health_check_interval=30,
+                 block_read_max_gap=16, block_read_max_size=32, shadow_refresh_interval=300,
+                 shadow_max_bridge=4, inverter_status_register=33095, scheduler_deadlines=None,
+                 scheduler_aging_interval=2, read_retry_policy=None, write_retry_policy=None,
+                 breaker_failure_threshold=3, breaker_probe_interval=10, read_cache_ttl=0.5,
+                 metrics_dump_path='~/Log_Files/ModbusMetrics.jsonl', metrics_dump_interval=60,
+                 modbus_devices=None, modbus_tcp_pool_size=2, modbus_tcp_max_in_flight=4, **kwargs):
         super(Mod_Comm, self).__init__(**kwargs)
 
         # Assign configuration values to instance variables
@@ -140,6 +222,75 @@ class Mod_Comm(Agent):
         # Initialize SafetyData with default values
         self.safety_data = SafetyData(remote_comm=1, modbus_comm=0, master_switch=1)
 
+        # Latency, traffic and error figures are kept per line and appended to metrics_dump_path
+        self.metrics_dump_path = metrics_dump_path
+        self.metrics_dump_interval = metrics_dump_interval
+        self.modbus_health_check_interval = modbus_health_check_interval
+
+        # Limits used when merging scattered register reads into block reads
+        self.block_read_max_gap = block_read_max_gap
+        self.block_read_max_size = block_read_max_size
+
+        # Longest run of unchanged registers bridged when trimming a batch write
+        self.shadow_max_bridge = shadow_max_bridge
+
+        # Bounded retries; every device also has a breaker that fails fast while it is unreachable
+        self.read_retry_policy = RetryPolicy.from_config(read_retry_policy)
+        self.write_retry_policy = RetryPolicy.from_config(write_retry_policy)
+
+        # One ModbusPort (session and scheduler) per serial adapter or TCP endpoint and
+        # one ModbusDevice per inverter. Without modbus_devices the single inverter given
+        # by modbus_port and modbus_slave_id is managed as DEFAULT_DEVICE_ID.
+        if not modbus_devices:
+            modbus_devices = [{'device_id': DEFAULT_DEVICE_ID, 'port': modbus_port, 'slave_id': modbus_slave_id}]
+        self.ports = {}
+        self.devices = {}
+        for device_config in modbus_devices:
+            device_id = str(device_config['device_id'])
+            if device_id in self.devices:
+                raise ValueError(f"Modbus device {device_id} is configured more than once")
+            port_name = device_config.get('port', modbus_port)
+            slave_id = int(device_config.get('slave_id', modbus_slave_id))
+            port = self.ports.get(port_name)
+            if port is None:
+                # The line settings are taken from the first device on the port
+                port = self.ports[port_name] = ModbusPort(
+                    port=port_name,
+                    slave_id=slave_id,
+                    transport=device_config.get('transport', 'rtu'),
+                    baudrate=int(device_config.get('baudrate', modbus_baudrate)),
+                    timeout=float(device_config.get('timeout', modbus_timeout)),
+                    health_check_interval=modbus_health_check_interval,
+                    pool_size=int(device_config.get('pool_size', modbus_tcp_pool_size)),
+                    max_in_flight=int(device_config.get('max_in_flight', modbus_tcp_max_in_flight)),
+                    scheduler_deadlines=scheduler_deadlines,
+                    scheduler_aging_interval=scheduler_aging_interval,
+                )
+            self.devices[device_id] = ModbusDevice(
+                device_id=device_id,
+                port=port,
+                slave_id=slave_id,
+                inverter_status_register=int(device_config.get('inverter_status_register', inverter_status_register)),
+                breaker_failure_threshold=breaker_failure_threshold,
+                breaker_probe_interval=breaker_probe_interval,
+                shadow_refresh_interval=shadow_refresh_interval,
+                read_cache_ttl=read_cache_ttl,
+                on_breaker_state_change=self.on_breaker_state_change,
+            )
+            agent_logger.info(f"Modbus device {device_id}: slave {slave_id} on {port_name} ({port.transport})")
+
+        # RPCs that do not name a device address the first one configured
+        self.default_device_id = str(modbus_devices[0]['device_id'])
+
+    def device(self, device_id=None):
+        """The ModbusDevice called device_id, or the default device for None."""
+        if device_id is None:
+            device_id = self.default_device_id
+        try:
+            return self.devices[str(device_id)]
+        except KeyError:
+            raise ValueError(f"Unknown Modbus device {device_id}")
+
 
     def update_database(self, table_name, data):
         """
@@ -168,101 +319,363 @@ class Mod_Comm(Agent):
             agent_logger.error(f"Invalid data type passed: {type(data)}. Expected a dictionary.")
             raise TypeError("Data must be a dictionary")
 
+    def set_device_comm(self, device, comm_ok):
+        """
+        Record whether device is answering. safety_data.modbus_comm is 1 only while
+        every configured device answers; the database is only updated when it changes.
+        """
+        device.comm_ok = comm_ok
+        modbus_comm = int(all(other.comm_ok for other in self.devices.values()))
+        if self.safety_data.modbus_comm != modbus_comm:
+            self.safety_data.modbus_comm = modbus_comm
+            self.update_database('safety_data', {'modbus_comm': modbus_comm})
+
+    def transact(self, device, priority, func, *args):
+        """
+        Run one bus transaction for device through its circuit breaker and the
+        scheduler of its port. Raises CircuitOpenError without touching the bus
+        while the breaker is open.
+        """
+        device.breaker.check()
+        try:
+            result = device.scheduler.run(priority, func, *args)
+        except DeadlineExceeded:
+            # Dropped in the queue; says nothing about the link
+            raise
+        except Exception:
+            device.breaker.record_failure()
+            raise
+        device.breaker.record_success()
+        return result
+
+    def read_with_retries(self, device, register_address, num_registers, function_code, priority='telemetry'):
+        """
+        Read a block of registers from device, retrying on failure according to read_retry_policy.
+        Returns the list of register values, or None if every attempt failed.
+        Each attempt is queued separately, so the line is free for other
+        requests while this one waits to retry.
+        """
+        for attempt in self.read_retry_policy.attempts(sleep=gevent.sleep):
+            if attempt > 0:
+                device.metrics.record_retry(register_address)
+            # Attempt to read the registers using the provided function code
+            try:
+                response = self.transact(device, priority, device.read_registers,
+                                         register_address, num_registers, function_code)
+                if response is not None:
+                    agent_logger.info(f"Published input register values of {device.device_id}: {response}")
+                    device.read_cache.store(function_code, register_address, response)
+                    device.observe_inverter_status(register_address, response)
+
+                    # Only updates the database if modbus_comm has changed
+                    self.set_device_comm(device, True)
+
+                    return response
+                else:
+                    agent_logger.warning(f"Read attempt {attempt + 1} returned None, retrying...")
+            except DeadlineExceeded as e:
+                # The bus is busy with higher priority work, not broken
+                agent_logger.warning(f"Read of register {register_address} dropped: {str(e)}")
+                return None
+            except CircuitOpenError as e:
+                agent_logger.warning(f"Read of register {register_address} rejected: {str(e)}")
+                return None
+            except Exception as e:
+                agent_logger.error(f"An error occurred while reading on attempt {attempt + 1}: {str(e)}")
+
+        # After all retries, log that communication was unsuccessful
+        agent_logger.error(f"Modbus communication with {device.device_id} failed after retries")
+        device.metrics.record_failure(register_address)
+        self.mark_comm_lost(device, "Modbus communication lost")
+        return None
+
+    def mark_comm_lost(self, device, reason):
+        """Record the lost link in safety_data and drop the device's shadow registers."""
+        # Update database with modbus_comm set to 0 (communication failed)
+        self.set_device_comm(device, False)
+        device.shadow.invalidate(reason)
+        device.read_cache.invalidate(reason)
+
+    def on_breaker_state_change(self, device, old_state, new_state):
+        """Publish breaker transitions so control agents stop writing while it is open."""
+        if new_state == CircuitBreaker.OPEN:
+            self.mark_comm_lost(device, "circuit breaker opened")
+        try:
+            self.vip.pubsub.publish('pubsub', f"{BREAKER_TOPIC}/{device.device_id}", headers={}, message={
+                'device_id': device.device_id,
+                'device': device.session.port,
+                'state': new_state,
+                'previous_state': old_state,
+                'timestamp': time.time(),
+            })
+        except Exception as e:
+            agent_logger.error(f"Failed to publish circuit breaker state: {str(e)}")
+
+    def probe_circuit(self):
+        """Background probe of every open breaker, each on its own greenlet so ports are probed in parallel."""
+        for device in self.devices.values():
+            if device.breaker.probe_due():
+                gevent.spawn(self.probe_device, device)
+
+    def probe_device(self, device):
+        """One read of the status register of a device whose breaker is open."""
+        agent_logger.info(f"Probing Modbus device {device.device_id} on {device.session.port}")
+        try:
+            device.scheduler.run('safety', device.read_registers, device.inverter_status_register, 1, 4)
+        except DeadlineExceeded:
+            return
+        except Exception as e:
+            agent_logger.info(f"Probe of {device.device_id} failed, circuit stays open: {str(e)}")
+            device.breaker.record_failure()
+        else:
+            device.breaker.record_success()
+
     @RPC.export
-    def _Read_Inverter(self, register_address, num_registers, function_code):
+    def _Read_Inverter(self, register_address, num_registers, function_code, priority='telemetry', max_age=None,
+                       device_id=None):
+        """
+        Read num_registers registers from register_address of device_id (None for the default device).
+        max_age bounds how old (in s) a cached value may be; None uses read_cache_ttl,
+        0 always reads from the inverter.
+        """
         agent_logger.info("inside mod fun")
-        max_retries = 5 # Maximum number of retries
-        retry_delay = 2  # Delay between retries in seconds
-        topic = "error/inverter_communication"  # Define the topic where the message will be published
+        device = self.device(device_id)
 
         try:
-            agent_logger.info("connecting...")
-            instrument = minimalmodbus.Instrument('/dev/Modbus_Converter', 1)
-            instrument.serial.baudrate = 9600
-            instrument.serial.bytesize = 8
-            instrument.serial.parity = minimalmodbus.serial.PARITY_NONE
-            instrument.serial.stopbits = 1
-            instrument.serial.timeout = 1
-
-            for attempt in range(max_retries):
-                # Attempt to read the registers using the provided function code
-                try:
-                    response = instrument.read_registers(register_address, num_registers, functioncode=function_code)
-                    if response is not None:
-                        agent_logger.info(f"Published input register values: {response}")
-
-                        # Only update the database if modbus_comm has changed
-                        if self.safety_data.modbus_comm != 1:
-                            self.safety_data.modbus_comm = 1
-                            self.update_database('safety_data', {'modbus_comm': 1})  # Update modbus_comm to 1
-
-                        return response
-                    else:
-                        agent_logger.warning(f"Read attempt {attempt + 1} returned None, retrying...")
-                        time.sleep(retry_delay)
-                except Exception as e:
-                    agent_logger.error(f"An error occurred while reading on attempt {attempt + 1}: {str(e)}")
-                    time.sleep(retry_delay)
-
-            # After all retries, log that communication was unsuccessful and publish a message
-            agent_logger.error("Modbus communication failed after retries")
-            # Update database with modbus_comm set to 0 (communication failed)
-            self.update_database('safety_data', {'modbus_comm': 0})
-            response = [-11]
-            agent_logger.error(f"Returning response: {response}")
-            return response  # Return None if all retries failed
+            response = device.read_cache.get(function_code, register_address, num_registers, max_age)
+            if response is not None:
+                agent_logger.info(f"Served registers {register_address}+{num_registers} from read cache")
+                return response
+            response = self.read_with_retries(device, register_address, num_registers, function_code, priority)
+            if response is None:
+                response = [-11]
+                agent_logger.error(f"Returning response: {response}")
+            return response
 
         except Exception as e:
             agent_logger.error(f"An error occurred while setting up Modbus connection: {str(e)}")
             # Update database with modbus_comm set to 0 (communication failed)
-            self.update_database('safety_data', {'modbus_comm': 0})
+            self.set_device_comm(device, False)
         response = [-1]
         agent_logger.error(f"Returning response: {response}")
         return response  # Return None if all retries failed
 
+    @RPC.export
+    def _Read_Inverter_Block(self, register_addresses, function_code=4, max_gap=None, max_block=None,
+                             priority='telemetry', max_age=None, device_id=None):
+        """
+        Read a set of single registers of device_id (None for the default device)
+        with as few bus transactions as possible.
+
+        Registers found in the read cache (no older than max_age) are not read
+        again; the rest are merged into contiguous block reads (see
+        block_planner.plan_block_reads) and the values are returned in one RPC,
+        aligned with register_addresses. A register whose block could not be
+        read is returned as None.
+        """
+        device = self.device(device_id)
+        max_gap = self.block_read_max_gap if max_gap is None else max_gap
+        max_block = self.block_read_max_size if max_block is None else max_block
+        cached = device.read_cache.lookup(function_code, register_addresses, max_age)
+        missing = [address for address in register_addresses if address not in cached]
+        blocks = plan_block_reads(missing, max_gap, max_block)
+        agent_logger.info(f"Block read of {len(register_addresses)} registers of {device.device_id} "
+                          f"({len(cached)} cached) planned as {len(blocks)} transactions: {blocks}")
+
+        block_values = []
+        for start, count in blocks:
+            try:
+                block_values.append(self.read_with_retries(device, start, count, function_code, priority))
+            except Exception as e:
+                agent_logger.error(f"An error occurred while reading block {start}+{count}: {str(e)}")
+                block_values.append(None)
+
+        values = extract_registers(register_addresses, blocks, block_values)
+        return [cached[address] if address in cached else value
+                for address, value in zip(register_addresses, values)]
+
     def to_unsigned(self, value):
         """ Convert a signed integer to an unsigned integer using two's complement for 16-bit numbers. """
         if value < 0:
             return 65536 + value  # Convert negative to two's complement unsigned equivalent
         return value
 
-    @RPC.export
-    def _Write_Inverter(self, register_address, value_to_write, function_code=16):
-        # Set up the serial connection parameters
-        instrument = minimalmodbus.Instrument('/dev/Modbus_Converter', 1)  # Port name, slave address (in decimal)
-        instrument.serial.baudrate = 9600
-        instrument.serial.bytesize = 8
-        instrument.serial.parity = minimalmodbus.serial.PARITY_NONE
-        instrument.serial.stopbits = 1
-        instrument.serial.timeout = 1 # Timeout in seconds
-
-        max_retries = 5000
-        retry_delay = 4  # Delay between retries in seconds
-        value_to_write = self.to_unsigned(value_to_write)  # Convert to unsigned if necessary
-
+    def write_with_retries(self, device, register_address, values, function_code=16, priority='control'):
+        """
+        Write one register, or a run of contiguous registers, of device, retrying
+        on failure according to write_retry_policy.
+        Returns True on success and False once the retries are exhausted.
+        """
+        values = [self.to_unsigned(value) for value in values]  # Convert to unsigned if necessary
 
-        for attempt in range(max_retries):
+        for attempt in self.write_retry_policy.attempts(sleep=gevent.sleep):
+            if attempt > 0:
+                device.metrics.record_retry(register_address)
             try:
-                # Write to the register using the provided function code
-                instrument.write_register(register_address, value_to_write, functioncode=function_code)
-                agent_logger.info(f"Successfully wrote {value_to_write} to register {register_address}")
+                # Write to the register(s) using the provided function code
+                if len(values) == 1:
+                    self.transact(device, priority, device.write_register,
+                                  register_address, values[0], function_code)
+                else:
+                    self.transact(device, priority, device.write_registers, register_address, values)
+                agent_logger.info(f"Successfully wrote {values} to register {register_address} of {device.device_id}")
+                device.shadow.record(register_address, values)
+                device.read_cache.discard(3, register_address, len(values))  # FC3 reads see the new value
                 return True  # Return True to indicate success
+            except DeadlineExceeded as e:
+                # Not written, so the shadow still describes the inverter
+                agent_logger.info(f"Write to register {register_address} dropped: {str(e)}")
+                return False
+            except CircuitOpenError as e:
+                agent_logger.info(f"Write to register {register_address} rejected: {str(e)}")
+                return False
             except minimalmodbus.NoResponseError:
-                agent_logger.info(f"No response from device on attempt {attempt + 1}, retrying after {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                agent_logger.info(f"No response from device on attempt {attempt + 1}, retrying...")
             except minimalmodbus.ModbusException as e:
-                agent_logger.info(f"Modbus error on attempt {attempt + 1}: {str(e)}, retrying after {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                agent_logger.info(f"Modbus error on attempt {attempt + 1}: {str(e)}, retrying...")
             except Exception as e:
-                agent_logger.info(f"An unexpected error occurred on attempt {attempt + 1}: {str(e)}, retrying after {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                agent_logger.info(f"An unexpected error occurred on attempt {attempt + 1}: {str(e)}, retrying...")
 
-        agent_logger.info("Failed to write to register after maximum retries")
+        agent_logger.info(f"Failed to write to register of {device.device_id} after maximum retries")
+        device.metrics.record_failure(register_address)
+        device.shadow.invalidate("write failed")
         return False  # Return False to indicate failure
 
+    @RPC.export
+    def _Write_Inverter(self, register_address, value_to_write, function_code=16, priority='control', device_id=None):
+        device = self.device(device_id)
+        value_to_write = self.to_unsigned(value_to_write)
+        self.check_reconnects(device.port)
+        if device.shadow.is_current(register_address, value_to_write):
+            agent_logger.info(f"Register {register_address} already holds {value_to_write}, write skipped")
+            device.shadow.count_skipped(1, 1)
+            return True
+        return self.write_with_retries(device, register_address, [value_to_write], function_code, priority)
+
+    @RPC.export
+    def _Write_Inverter_Batch(self, values, function_code=16, priority='control', device_id=None):
+        """
+        Write a whole setpoint program to device_id (None for the default device)
+        in as few bus frames as possible.
+
+        values is a mapping of register address to value. Contiguous addresses are
+        grouped into single "write multiple registers" (FC16) transactions; a lone
+        register is written with function_code. Returns a mapping of register
+        address (as a string, the RPC is JSON) to True/False for success.
+        """
+        device = self.device(device_id)
+        values = {int(register): self.to_unsigned(value) for register, value in values.items()}
+        self.check_reconnects(device.port)
+        blocks = plan_block_writes(values)
+        blocks, skipped_registers, skipped_frames = trim_block_writes(
+            blocks, device.shadow.is_current, self.shadow_max_bridge)
+        device.shadow.count_skipped(skipped_registers, skipped_frames)
+        agent_logger.info(f"Batch write of {len(values)} registers to {device.device_id} planned as "
+                          f"{len(blocks)} frames, {skipped_registers} registers already current")
+
+        # Registers the inverter already holds count as written
+        results = {str(register): True for register in values}
+        for start, block in blocks:
+            try:
+                success = self.write_with_retries(device, start, block, function_code, priority)
+            except Exception as e:
+                agent_logger.error(f"An error occurred while writing block at {start}: {str(e)}")
+                success = False
+            for offset in range(len(block)):
+                results[str(start + offset)] = success
+        return results
+
+    @RPC.export
+    def get_devices(self):
+        """Every configured device with its port, slave id and link state."""
+        return {device_id: device.status() for device_id, device in self.devices.items()}
+
+    @RPC.export
+    def get_session_status(self, device_id=None):
+        """Report the state of the persistent Modbus session of a device's port."""
+        return self.device(device_id).session.status()
+
+    def check_session_health(self):
+        """Periodic health check; reopens the ports that went away."""
+        for port in self.ports.values():
+            try:
+                # On the I/O thread of the port like every other use of it
+                healthy = port.scheduler.run('safety', port.session.check_health)
+            except DeadlineExceeded:
+                continue
+            if not healthy:
+                agent_logger.error(f"Modbus session on {port.port} is unhealthy")
+            self.check_reconnects(port)
+
+    def check_reconnects(self, port):
+        """A reopened port means the link was down; the shadows of its devices can no longer be trusted."""
+        if port.reconnected():
+            for device in port.devices:
+                device.shadow.invalidate("Modbus session reconnected")
+
+    @RPC.export
+    def get_breaker_status(self, device_id=None):
+        """Circuit breaker state and the retry policies in force."""
+        status = self.device(device_id).breaker.status()
+        status['read_retry_policy'] = self.read_retry_policy.as_dict()
+        status['write_retry_policy'] = self.write_retry_policy.as_dict()
+        return status
+
+    @RPC.export
+    def get_bus_metrics(self, device_id=None):
+        """Latency histograms, bytes on the wire, busy percentage and errors by type of a device's port."""
+        return self.device(device_id).metrics.snapshot()
+
+    def dump_metrics(self):
+        for port in self.ports.values():
+            port.metrics.dump(self.metrics_dump_path)
+
+    @RPC.export
+    def get_read_cache_stats(self, device_id=None):
+        return self.device(device_id).read_cache.stats()
+
+    @RPC.export
+    def get_scheduler_stats(self, device_id=None):
+        """Queue depth and wait times per priority class on a device's port."""
+        return self.device(device_id).scheduler.stats()
+
+    @RPC.export
+    def get_shadow_stats(self, device_id=None):
+        """Writes sent vs. skipped by the shadow register cache."""
+        return self.device(device_id).shadow.stats()
+
+    @RPC.export
+    def invalidate_shadow(self, device_id=None):
+        """Force the next write of every register onto the wire, for one device or (None) all of them."""
+        devices = self.devices.values() if device_id is None else [self.device(device_id)]
+        for device in devices:
+            device.shadow.invalidate("requested over RPC")
+        return True
+
     @Core.receiver('onstart')
     def on_start(self, sender, **kwargs):
         agent_logger.info("Agent stablished")
+        for port in self.ports.values():
+            port.start()
+            try:
+                port.scheduler.run('safety', port.session.open)
+            except Exception as e:
+                # Not fatal: the first transaction or health check opens it again
+                agent_logger.error(f"Could not open Modbus session on {port.port} at startup: {str(e)}")
+        self.core.periodic(self.modbus_health_check_interval, self.check_session_health)
+        self.core.periodic(1, self.probe_circuit)
+        if self.metrics_dump_interval > 0:
+            self.core.periodic(self.metrics_dump_interval, self.dump_metrics)
+
+    @Core.receiver('onstop')
+    def on_stop(self, sender, **kwargs):
+        for port in self.ports.values():
+            try:
+                port.scheduler.run('safety', port.session.close)
+            except Exception as e:
+                agent_logger.error(f"Could not close Modbus session on {port.port} cleanly: {str(e)}")
+            port.stop()
+        agent_logger.info("Agent stopped")
 
 def main():
     """Main method called to start the agent."""
@@ -0,0 +1,129 @@
+"""
+Planning of Modbus block transactions.
+
+Each Modbus request costs a full bus round trip (request frame, inverter turnaround,
+response frame, inter-frame gap), so reading fifteen scattered registers one by one
+is far slower than reading the two or three contiguous blocks that cover them.
+"""
+
+# Modbus limits the number of registers in a single FC3/FC4 read and FC16 write
+MODBUS_MAX_READ_REGISTERS = 125
+MODBUS_MAX_WRITE_REGISTERS = 123
+
+
+def plan_block_reads(registers, max_gap=16, max_block=32):
+    """
+    Merge the wanted registers into the smallest set of contiguous block reads.
+
+    Args:
+        registers: iterable of register addresses (duplicates and any order allowed).
+        max_gap: largest run of unwanted registers that may be read through to join
+            two wanted registers into one block.
+        max_block: largest number of registers in a single block.
+
+    Returns:
+        list of (start_address, count) tuples sorted by address.
+    """
+    max_block = min(max_block, MODBUS_MAX_READ_REGISTERS)
+    blocks = []
+    start = None
+    end = None
+    for address in sorted(set(registers)):
+        if start is not None and address - end - 1 <= max_gap and address - start + 1 <= max_block:
+            end = address
+            continue
+        if start is not None:
+            blocks.append((start, end - start + 1))
+        start = end = address
+    if start is not None:
+        blocks.append((start, end - start + 1))
+    return blocks
+
+
+def extract_registers(registers, blocks, block_values):
+    """
+    Pick the wanted registers back out of the block read results.
+
+    Args:
+        registers: the register addresses originally asked for, in caller order.
+        blocks: the plan returned by plan_block_reads.
+        block_values: one list of values per block, or None for a block that failed.
+
+    Returns:
+        list of values aligned with registers; None where the covering block failed.
+    """
+    by_address = {}
+    for (start, count), values in zip(blocks, block_values):
+        if values is None:
+            continue
+        for offset in range(count):
+            by_address[start + offset] = values[offset]
+    return [by_address.get(address) for address in registers]
+
+
+def plan_block_writes(values, max_block=MODBUS_MAX_WRITE_REGISTERS):
+    """
+    Group a register -> value mapping into runs of strictly contiguous registers.
+
+    Unlike reads, writes never bridge gaps: writing a register nobody asked for
+    would change the inverter configuration.
+
+    Args:
+        values: dict of register address to value (keys may be strings, as they
+            arrive that way over a JSON RPC).
+        max_block: largest number of registers in a single FC16 frame.
+
+    Returns:
+        list of (start_address, [values...]) tuples sorted by address.
+    """
+    max_block = min(max_block, MODBUS_MAX_WRITE_REGISTERS)
+    blocks = []
+    for address in sorted(int(register) for register in values):
+        value = values[address] if address in values else values[str(address)]
+        if blocks:
+            start, run = blocks[-1]
+            if address == start + len(run) and len(run) < max_block:
+                run.append(value)
+                continue
+        blocks.append((address, [value]))
+    return blocks
+
+
+def trim_block_writes(blocks, is_current, max_bridge=4):
+    """
+    Drop the parts of planned write blocks that the inverter already holds.
+
+    Registers already holding the wanted value are cut from the ends of each block.
+    Inside a block they are kept (rewriting the same value is harmless and cheaper
+    than a second frame) unless more than max_bridge of them sit in a row, in which
+    case the block is split there.
+
+    Args:
+        blocks: the plan returned by plan_block_writes.
+        is_current: callable(address, value) -> True if no write is needed.
+        max_bridge: longest run of current registers kept inside a frame.
+
+    Returns:
+        (blocks still to write, number of registers skipped, number of frames skipped)
+    """
+    trimmed = []
+    skipped_registers = 0
+    skipped_frames = 0
+    for start, run in blocks:
+        changed = [offset for offset, value in enumerate(run) if not is_current(start + offset, value)]
+        if not changed:
+            skipped_registers += len(run)
+            skipped_frames += 1
+            continue
+
+        pieces = []
+        first = previous = changed[0]
+        for offset in changed[1:] + [None]:
+            if offset is not None and offset - previous - 1 <= max_bridge:
+                previous = offset
+                continue
+            pieces.append((start + first, run[first:previous + 1]))
+            first = previous = offset
+        trimmed.extend(pieces)
+        skipped_registers += len(run) - sum(len(piece) for _, piece in pieces)
+    return trimmed, skipped_registers, skipped_frames
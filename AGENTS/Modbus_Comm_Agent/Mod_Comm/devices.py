@@ -0,0 +1,170 @@
+"""
+Inverters managed by the Modbus communication agent and the lines they sit on.
+
+A site runs several inverters on one or more RS-485 adapters or Modbus TCP
+endpoints. Each adapter or endpoint is a ModbusPort with its own session,
+request scheduler and bus metrics: transactions on a serial line are serialized
+on the port's I/O thread, a TCP endpoint takes as many at once as its connection
+pool allows, and different ports are polled in parallel. Each inverter is a
+ModbusDevice, addressed by its slave id on its port, with its own circuit
+breaker, shadow registers and read cache.
+"""
+
+import functools
+import logging
+
+from .metrics import BusMetrics
+from .register_cache import ShadowRegisterCache, TTLReadCache
+from .resilience import CircuitBreaker
+from .scheduler import ModbusRequestScheduler
+from .transport import RTU, TCP, create_session
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+# Id of the inverter configured through the single-device modbus_port/modbus_slave_id keys
+DEFAULT_DEVICE_ID = 'inverter1'
+
+
+class ModbusPort:
+    """
+    One Modbus line: the session, the scheduler that orders its transactions
+    and the metrics of the traffic on it.
+
+    Args:
+        port: serial device of the adapter, or 'host:port' of a TCP endpoint.
+        slave_id: default slave address (unit id) of the session.
+        transport: 'rtu' or 'tcp', see transport.py.
+        baudrate, timeout, health_check_interval: see ModbusSession.
+        pool_size, max_in_flight: TCP connections kept open, and requests
+            pipelined on each of them, see ModbusTcpSession.
+        scheduler_deadlines, scheduler_aging_interval: see ModbusRequestScheduler.
+    """
+
+    def __init__(self, port, slave_id=1, transport=RTU, baudrate=9600, timeout=1, health_check_interval=30,
+                 pool_size=2, max_in_flight=4, scheduler_deadlines=None, scheduler_aging_interval=2):
+        self.port = port
+        self.transport = transport
+        self.metrics = BusMetrics(baudrate=baudrate, port=port, transport=transport)
+        self.session = create_session(
+            transport,
+            port=port,
+            slave_id=slave_id,
+            baudrate=baudrate,
+            timeout=timeout,
+            health_check_interval=health_check_interval,
+            metrics=self.metrics,
+            pool_size=pool_size,
+            max_in_flight=max_in_flight,
+        )
+        if transport == TCP:
+            # Requests run on greenlets, as many at once as the pool can carry
+            self.scheduler = ModbusRequestScheduler(deadlines=scheduler_deadlines,
+                                                    aging_interval=scheduler_aging_interval,
+                                                    concurrency=pool_size * max_in_flight, threaded=False)
+        else:
+            self.scheduler = ModbusRequestScheduler(deadlines=scheduler_deadlines,
+                                                    aging_interval=scheduler_aging_interval)
+        self.devices = []
+        self.last_reconnects = 0
+
+    def start(self):
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def reconnected(self):
+        """True once after every reopen of the session since the last call."""
+        if self.session.reconnects == self.last_reconnects:
+            return False
+        self.last_reconnects = self.session.reconnects
+        return True
+
+
+class ModbusDevice:
+    """
+    One inverter on a ModbusPort.
+
+    read_registers(), write_register() and write_registers() run one transaction
+    addressed to this slave; they are what gets queued on the port's scheduler.
+
+    Args:
+        device_id: name the device is known by in RPCs, topics and the database.
+        port: the ModbusPort the inverter is wired to.
+        slave_id: Modbus address of the inverter on that line.
+        inverter_status_register: input register holding the operating state.
+        breaker_failure_threshold, breaker_probe_interval: see CircuitBreaker.
+        shadow_refresh_interval: see ShadowRegisterCache.
+        read_cache_ttl: see TTLReadCache.
+        on_breaker_state_change: called as on_breaker_state_change(device, old_state, new_state).
+    """
+
+    def __init__(self, device_id, port, slave_id=1, inverter_status_register=33095,
+                 breaker_failure_threshold=3, breaker_probe_interval=10, shadow_refresh_interval=300,
+                 read_cache_ttl=0.5, on_breaker_state_change=None):
+        self.device_id = device_id
+        self.port = port
+        self.slave_id = slave_id
+        self.inverter_status_register = inverter_status_register
+        self.last_inverter_status = None
+
+        # None until the first transaction, then whether the inverter is answering
+        self.comm_ok = None
+
+        self.shadow = ShadowRegisterCache(refresh_interval=shadow_refresh_interval)
+        self.read_cache = TTLReadCache(default_ttl=read_cache_ttl)
+        self.breaker = CircuitBreaker(
+            name=device_id,
+            failure_threshold=breaker_failure_threshold,
+            probe_interval=breaker_probe_interval,
+            on_state_change=(None if on_breaker_state_change is None
+                             else functools.partial(on_breaker_state_change, self)),
+        )
+        port.devices.append(self)
+
+    @property
+    def session(self):
+        return self.port.session
+
+    @property
+    def scheduler(self):
+        return self.port.scheduler
+
+    @property
+    def metrics(self):
+        return self.port.metrics
+
+    def read_registers(self, register_address, num_registers, function_code=4):
+        return self.port.session.read_registers(register_address, num_registers, function_code, self.slave_id)
+
+    def write_register(self, register_address, value, function_code=16):
+        return self.port.session.write_register(register_address, value, function_code, self.slave_id)
+
+    def write_registers(self, register_address, values):
+        return self.port.session.write_registers(register_address, values, self.slave_id)
+
+    def observe_inverter_status(self, register_address, response):
+        """
+        Watch the inverter status register in every read. A change of state (which
+        includes the inverter restarting) means the holding registers may no longer
+        hold what was written, so the shadow is dropped.
+        """
+        offset = self.inverter_status_register - register_address
+        if 0 <= offset < len(response):
+            status = response[offset]
+            if self.last_inverter_status is not None and status != self.last_inverter_status:
+                self.shadow.invalidate(f"{self.device_id} status changed {self.last_inverter_status} -> {status}")
+            self.last_inverter_status = status
+
+    def status(self):
+        return {
+            'device_id': self.device_id,
+            'port': self.port.port,
+            'transport': self.port.transport,
+            'slave_id': self.slave_id,
+            'modbus_comm': self.comm_ok,
+            'inverter_status': self.last_inverter_status,
+            'breaker': self.breaker.status()['state'],
+        }
@@ -0,0 +1,242 @@
+"""
+Bus instrumentation for the Modbus communication agent.
+"""
+
+import bisect
+import json
+import logging
+import os
+import time
+
+import minimalmodbus
+import serial
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+# Upper bounds of the latency buckets in ms; the last bucket is open ended
+LATENCY_BUCKETS_MS = (5, 10, 20, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000)
+
+
+# Bytes around the PDU: slave id + CRC for RTU, the 7 byte MBAP header for TCP
+FRAME_OVERHEAD = {'rtu': 3, 'tcp': 7}
+
+
+def frame_bytes(function_code, count, transport='rtu'):
+    """
+    Size in bytes of the request and of a normal response for one transaction
+    (PDU plus the transport's framing).
+    """
+    overhead = FRAME_OVERHEAD[transport]
+    if function_code in (3, 4):
+        return overhead + 5, overhead + 2 + 2 * count
+    if function_code == 16:
+        return overhead + 6 + 2 * count, overhead + 5
+    return overhead + 5, overhead + 5
+
+
+def error_category(error):
+    """Coarse class of a failed transaction, for error rates."""
+    if isinstance(error, minimalmodbus.NoResponseError):
+        return 'no_response'
+    if isinstance(error, minimalmodbus.InvalidResponseError):
+        # Bad CRC, wrong slave address, truncated or garbled frame
+        return 'invalid_response'
+    if isinstance(error, minimalmodbus.SlaveReportedException):
+        return 'slave_exception'
+    if isinstance(error, (serial.SerialException, OSError)):
+        return 'port_error'
+    return 'other'
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of transaction round trip times."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples, capped at the max seen."""
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(float(self.buckets[index]), self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'min_ms': self.min or 0.0,
+            'max_ms': self.max or 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets_ms': dict(zip(labels, self.counts)),
+        }
+
+
+class BusMetrics:
+    """
+    Counters and latency histograms for every transaction on the line.
+
+    record_transaction() is called by the session on the I/O thread (on the
+    agent's greenlets for TCP), which is the only writer of the transaction
+    figures; record_retry() and record_failure() are called from the agent's
+    greenlets and keep their own counters. Readers take copies, so no lock is
+    needed.
+
+    Args:
+        baudrate: line speed, to convert bytes into time on the wire.
+        bits_per_char: start + data + parity + stop bits of one character.
+        range_size: width of the register ranges latencies are grouped by.
+        port: name of the line, reported with every snapshot.
+        transport: 'rtu' or 'tcp', for the frame sizes. TCP has no line speed, so
+            wire_time stays 0, and with pipelined requests busy_percent can exceed 100.
+    """
+
+    def __init__(self, baudrate=9600, bits_per_char=10, range_size=100, port=None, transport='rtu'):
+        self.port = port
+        self.transport = transport
+        self.baudrate = baudrate
+        self.bits_per_char = bits_per_char
+        self.range_size = range_size
+
+        self.started = time.time()
+        self.started_monotonic = time.monotonic()
+
+        # Written on the I/O thread
+        self.transactions = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.busy_time = 0.0
+        self.wire_time = 0.0
+        self.latency_by_function = {}
+        self.latency_by_range = {}
+        self.errors_by_type = {}
+        self.errors_by_category = {}
+
+        # Written on the agent's greenlets
+        self.retries_by_register = {}
+        self.failures_by_register = {}
+
+        # Figures at the start of the current dump window
+        self.window_start = self.started_monotonic
+        self.window_base = (0, 0, 0.0, 0.0)
+
+    def register_range(self, address):
+        start = address - address % self.range_size
+        return f"{start}-{start + self.range_size - 1}"
+
+    def record_transaction(self, function_code, register_address, count, duration, error=None):
+        """Account for one transaction that took duration seconds (error is the exception raised, if any)."""
+        sent, received = frame_bytes(function_code, count, self.transport)
+        if error is not None:
+            category = error_category(error)
+            # Only a slave exception comes back as a frame we can count
+            received = FRAME_OVERHEAD[self.transport] + 2 if category == 'slave_exception' else 0
+            name = type(error).__name__
+            self.errors += 1
+            self.errors_by_type[name] = self.errors_by_type.get(name, 0) + 1
+            self.errors_by_category[category] = self.errors_by_category.get(category, 0) + 1
+
+        self.transactions += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.busy_time += duration
+        if self.transport == 'rtu':
+            self.wire_time += (sent + received) * self.bits_per_char / self.baudrate
+
+        ms = duration * 1000.0
+        for histograms, key in ((self.latency_by_function, str(function_code)),
+                                (self.latency_by_range, self.register_range(register_address))):
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = LatencyHistogram()
+            histogram.add(ms)
+
+    def record_retry(self, register_address):
+        key = str(register_address)
+        self.retries_by_register[key] = self.retries_by_register.get(key, 0) + 1
+
+    def record_failure(self, register_address):
+        """A request that still failed after all its retries."""
+        key = str(register_address)
+        self.failures_by_register[key] = self.failures_by_register.get(key, 0) + 1
+
+    def snapshot(self, reset_window=False):
+        """
+        JSON friendly view of all figures. busy_percent is the share of wall time a
+        transaction was in progress, wire_percent the share the line was actually
+        carrying bytes; the window figures cover the time since the last reset.
+        """
+        now = time.monotonic()
+        uptime = max(now - self.started_monotonic, 1e-9)
+        transactions, errors, busy, wire = self.transactions, self.errors, self.busy_time, self.wire_time
+        base_transactions, base_errors, base_busy, base_wire = self.window_base
+        window = max(now - self.window_start, 1e-9)
+
+        snapshot = {
+            'timestamp': time.time(),
+            'since': self.started,
+            'uptime': uptime,
+            'port': self.port,
+            'transport': self.transport,
+            'baudrate': self.baudrate,
+            'transactions': transactions,
+            'errors': errors,
+            'error_rate': errors / transactions if transactions else 0.0,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'busy_time': busy,
+            'wire_time': wire,
+            'busy_percent': 100.0 * busy / uptime,
+            'wire_percent': 100.0 * wire / uptime,
+            'window': {
+                'seconds': window,
+                'transactions': transactions - base_transactions,
+                'errors': errors - base_errors,
+                'busy_percent': 100.0 * (busy - base_busy) / window,
+                'wire_percent': 100.0 * (wire - base_wire) / window,
+            },
+            'latency_by_function': {key: histogram.as_dict()
+                                    for key, histogram in self.latency_by_function.copy().items()},
+            'latency_by_range': {key: histogram.as_dict()
+                                 for key, histogram in self.latency_by_range.copy().items()},
+            'errors_by_type': self.errors_by_type.copy(),
+            'errors_by_category': self.errors_by_category.copy(),
+            'retries_by_register': self.retries_by_register.copy(),
+            'failures_by_register': self.failures_by_register.copy(),
+        }
+        if reset_window:
+            self.window_start = now
+            self.window_base = (transactions, errors, busy, wire)
+        return snapshot
+
+    def dump(self, path):
+        """Append a snapshot as one JSON line to path and start a new window."""
+        path = os.path.expanduser(path)
+        try:
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.snapshot(reset_window=True)) + '\n')
+        except OSError as e:
+            agent_logger.error(f"Could not write Modbus metrics to {path}: {e}")
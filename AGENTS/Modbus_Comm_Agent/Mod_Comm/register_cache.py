@@ -0,0 +1,169 @@
+"""
+Register caches kept by the Modbus communication agent.
+"""
+
+import logging
+import threading
+import time
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+class ShadowRegisterCache:
+    """
+    Shadow copy of the last value successfully written to each holding register.
+
+    Control loops rewrite the same setpoints every few seconds; a write whose value
+    matches the shadow is skipped. The shadow is only trusted for refresh_interval
+    seconds, after which the register is written again even if unchanged, and it is
+    dropped completely whenever the link or the inverter may have lost state.
+    """
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self.values = {}  # register address -> (value, time written)
+        self.lock = threading.Lock()
+
+        # Counters reported through get_shadow_stats
+        self.registers_sent = 0
+        self.registers_skipped = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.invalidations = 0
+
+    def is_current(self, address, value):
+        """True if the inverter is known to hold value at address and the entry is still fresh."""
+        with self.lock:
+            entry = self.values.get(address)
+        if entry is None:
+            return False
+        shadow_value, written_at = entry
+        return shadow_value == value and time.time() - written_at < self.refresh_interval
+
+    def record(self, address, values):
+        """Remember a successful write of values starting at address."""
+        now = time.time()
+        with self.lock:
+            for offset, value in enumerate(values):
+                self.values[address + offset] = (value, now)
+            self.registers_sent += len(values)
+            self.frames_sent += 1
+
+    def count_skipped(self, registers, frames):
+        with self.lock:
+            self.registers_skipped += registers
+            self.frames_skipped += frames
+
+    def invalidate(self, reason):
+        """Forget everything; the next write of every register goes to the wire."""
+        with self.lock:
+            if not self.values:
+                return
+            self.values.clear()
+            self.invalidations += 1
+        agent_logger.info(f"Shadow register cache invalidated: {reason}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'registers_sent': self.registers_sent,
+                'registers_skipped': self.registers_skipped,
+                'frames_sent': self.frames_sent,
+                'frames_skipped': self.frames_skipped,
+                'invalidations': self.invalidations,
+                'shadowed_registers': len(self.values),
+                'refresh_interval': self.refresh_interval,
+            }
+
+
+class TTLReadCache:
+    """
+    Short-lived cache of register values read from the inverter.
+
+    Several agents poll the same telemetry; a value read a few hundred ms ago is
+    usually good enough for all of them. Every value is stamped when it comes off
+    the wire, and a register is served from the cache only if it is younger than
+    the caller's max_age (default_ttl when the caller gives none, 0 to force a bus
+    read). Entries are keyed by function code, since input and holding registers
+    are separate address spaces.
+    """
+
+    def __init__(self, default_ttl=1.0):
+        self.default_ttl = default_ttl
+        self.values = {}  # (function code, register address) -> (value, monotonic time read)
+        self.lock = threading.Lock()
+
+        # Counters reported through get_read_cache_stats. A hit is a request served
+        # without touching the bus; registers_* count single registers.
+        self.hits = 0
+        self.misses = 0
+        self.registers_served = 0
+        self.registers_missed = 0
+        self.invalidations = 0
+
+    def lookup(self, function_code, addresses, max_age=None):
+        """
+        Fresh cached values for one request. Returns a dict of address -> value
+        holding only the registers that are cached and no older than max_age.
+        """
+        addresses = list(addresses)
+        max_age = self.default_ttl if max_age is None else max_age
+        found = {}
+        with self.lock:
+            if max_age > 0:
+                oldest = time.monotonic() - max_age
+                for address in addresses:
+                    entry = self.values.get((function_code, address))
+                    if entry is not None and entry[1] >= oldest:
+                        found[address] = entry[0]
+            if len(found) == len(addresses):
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.registers_served += len(found)
+            self.registers_missed += len(addresses) - len(found)
+        return found
+
+    def get(self, function_code, address, count, max_age=None):
+        """The values of count registers from address if all are fresh, else None."""
+        found = self.lookup(function_code, range(address, address + count), max_age)
+        if len(found) < count:
+            return None
+        return [found[address + offset] for offset in range(count)]
+
+    def store(self, function_code, address, values):
+        """Remember values just read starting at address."""
+        now = time.monotonic()
+        with self.lock:
+            for offset, value in enumerate(values):
+                self.values[(function_code, address + offset)] = (value, now)
+
+    def discard(self, function_code, address, count):
+        """Forget count registers from address, e.g. after they were written."""
+        with self.lock:
+            for offset in range(count):
+                self.values.pop((function_code, address + offset), None)
+
+    def invalidate(self, reason):
+        """Forget everything; the next read of every register goes to the wire."""
+        with self.lock:
+            if not self.values:
+                return
+            self.values.clear()
+            self.invalidations += 1
+        agent_logger.info(f"Read cache invalidated: {reason}")
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'registers_served': self.registers_served,
+                'registers_missed': self.registers_missed,
+                'invalidations': self.invalidations,
+                'cached_registers': len(self.values),
+                'default_ttl': self.default_ttl,
+            }
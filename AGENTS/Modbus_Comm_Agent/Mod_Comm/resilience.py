@@ -0,0 +1,153 @@
+"""
+Retry policy and circuit breaker for Modbus transactions.
+"""
+
+import logging
+import random
+import threading
+import time
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and an overall deadline.
+
+    Usage:
+        for attempt in policy.attempts():
+            try:
+                return do_transaction()
+            except SomeError:
+                continue
+
+    attempts() sleeps the backoff delay before every attempt but the first, and
+    stops when max_attempts is used up or when the next attempt could not start
+    before total_deadline seconds have passed since the first one.
+    """
+
+    def __init__(self, max_attempts=5, initial_delay=0.5, max_delay=4.0, multiplier=2.0,
+                 total_deadline=8.0, jitter=0.1):
+        self.max_attempts = int(max_attempts)
+        self.initial_delay = float(initial_delay)
+        self.max_delay = float(max_delay)
+        self.multiplier = float(multiplier)
+        self.total_deadline = float(total_deadline)
+        self.jitter = float(jitter)
+
+    @classmethod
+    def from_config(cls, settings):
+        return cls(**(settings or {}))
+
+    def delay(self, attempt):
+        """Backoff before the given attempt (attempt 1 is the first retry)."""
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def attempts(self, sleep=time.sleep):
+        started = time.monotonic()
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                delay = self.delay(attempt)
+                if time.monotonic() - started + delay > self.total_deadline:
+                    return
+                sleep(delay)
+            yield attempt
+
+    def as_dict(self):
+        return {
+            'max_attempts': self.max_attempts,
+            'initial_delay': self.initial_delay,
+            'max_delay': self.max_delay,
+            'multiplier': self.multiplier,
+            'total_deadline': self.total_deadline,
+            'jitter': self.jitter,
+        }
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of touching the bus while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-device circuit breaker.
+
+    After failure_threshold consecutive failed transactions the breaker opens and
+    every request fails fast with CircuitOpenError. While open, the owner probes the
+    link in the background (see probe_due) and closes the breaker on the first
+    successful probe. on_state_change(old_state, new_state) is called on every
+    transition so the state can be published.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+
+    def __init__(self, name, failure_threshold=3, probe_interval=10.0, on_state_change=None):
+        self.name = name
+        self.failure_threshold = int(failure_threshold)
+        self.probe_interval = float(probe_interval)
+        self.on_state_change = on_state_change
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_probe = None
+        self.lock = threading.Lock()
+
+        # Counters
+        self.times_opened = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raise CircuitOpenError if requests must not reach the bus."""
+        with self.lock:
+            if self.state == self.OPEN:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            old_state, self.state = self.state, self.CLOSED
+            self.opened_at = None
+        if old_state != self.CLOSED:
+            self._changed(old_state, self.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == self.OPEN or self.consecutive_failures < self.failure_threshold:
+                return
+            self.state = self.OPEN
+            self.opened_at = self.last_probe = time.monotonic()
+            self.times_opened += 1
+        self._changed(self.CLOSED, self.OPEN)
+
+    def probe_due(self):
+        """True if the breaker is open and the next background probe should run now."""
+        with self.lock:
+            if self.state != self.OPEN or time.monotonic() - self.last_probe < self.probe_interval:
+                return False
+            self.last_probe = time.monotonic()
+            return True
+
+    def _changed(self, old_state, new_state):
+        agent_logger.info(f"Circuit breaker for {self.name}: {old_state} -> {new_state}")
+        if self.on_state_change is not None:
+            try:
+                self.on_state_change(old_state, new_state)
+            except Exception as e:
+                agent_logger.error(f"Error while reporting circuit breaker state: {e}")
+
+    def status(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'open_for': time.monotonic() - self.opened_at if self.opened_at else 0.0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
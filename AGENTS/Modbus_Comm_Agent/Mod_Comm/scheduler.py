@@ -0,0 +1,244 @@
+"""
+Priority-aware request scheduler for one Modbus line (serial port or TCP endpoint).
+"""
+
+import collections
+import itertools
+import logging
+import time
+
+import gevent
+from gevent.event import AsyncResult, Event
+from gevent.pool import Group
+from gevent.threadpool import ThreadPool
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+# Priority classes, lower value is served first
+SAFETY = 0
+CONTROL = 1
+TELEMETRY = 2
+
+PRIORITY_CLASSES = {
+    'safety': SAFETY,
+    'control': CONTROL,
+    'telemetry': TELEMETRY,
+}
+PRIORITY_NAMES = {value: name for name, value in PRIORITY_CLASSES.items()}
+
+
+class DeadlineExceeded(Exception):
+    """Raised for a request that waited longer than its class deadline and was dropped."""
+
+
+class SchedulerStopped(Exception):
+    """Raised for requests still queued when the scheduler is stopped."""
+
+
+class Ticket:
+    __slots__ = ('priority', 'sequence', 'enqueued_at', 'func', 'args', 'kwargs', 'future')
+
+    def __init__(self, priority, sequence, func, args, kwargs):
+        self.priority = priority
+        self.sequence = sequence
+        self.enqueued_at = time.monotonic()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = AsyncResult()
+
+
+class ClassStats:
+    """Queue and wait-time figures for one priority class."""
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = collections.deque(maxlen=200)
+
+    def as_dict(self, depth):
+        recent = sorted(self.recent_waits)
+        served = self.completed + self.failed
+        return {
+            'depth': depth,
+            'max_depth': self.max_depth,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'expired': self.expired,
+            'mean_wait': self.total_wait / served if served else 0.0,
+            'p95_wait': recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class ModbusRequestScheduler:
+    """
+    Serializes every bus transaction through one queue ordered by priority class.
+
+    One transaction is on the wire at a time (or up to concurrency, for transports
+    that pipeline requests). When the line frees up the dispatcher
+    picks the waiting request with the best effective priority: its class, improved
+    by one class for every aging_interval seconds it has waited, so a steady stream
+    of control writes can delay telemetry but never starve it. A request that waits
+    longer than its class deadline is dropped with DeadlineExceeded instead of being
+    sent late.
+
+    Schedule single transactions, not whole retry loops, so a retrying request gives
+    the line back between attempts.
+
+    The transactions themselves run on one dedicated OS thread (a gevent ThreadPool
+    of size 1), never in the agent's greenlets. Callers wait on an AsyncResult, so
+    while a slow read or a timeout is in progress the agent keeps serving other RPCs
+    (status, stats, health) and queueing new requests. Everything that touches the
+    serial port, including open, close and health checks, must go through the
+    scheduler so it runs on that one thread.
+
+    With threaded=False the transactions run on greenlets of the agent's hub
+    instead, which is what the gevent based Modbus TCP transport needs; with
+    concurrency > 1 that many are dispatched at once, still in priority order.
+    """
+
+    def __init__(self, deadlines=None, aging_interval=2.0, concurrency=1, threaded=True):
+        self.deadlines = {SAFETY: 30.0, CONTROL: 10.0, TELEMETRY: 5.0}
+        for name, seconds in (deadlines or {}).items():
+            self.deadlines[PRIORITY_CLASSES[name]] = float(seconds)
+        self.aging_interval = aging_interval
+        self.concurrency = max(1, int(concurrency))
+        self.threaded = threaded
+
+        # The queue is only touched from greenlets of the agent's hub, so it needs
+        # no lock; only the transactions cross over to the I/O thread
+        self.queue = []
+        self.sequence = itertools.count()
+        self.wakeup = Event()
+        self.stats_by_class = {priority: ClassStats() for priority in PRIORITY_NAMES}
+        self.running = False
+        self.busy_since = None
+        self.in_flight = 0
+        self.dispatcher = None
+        self.workers = Group()
+        self.io_pool = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        if self.threaded:
+            self.io_pool = ThreadPool(1)
+        self.dispatcher = gevent.spawn(self._dispatch_loop)
+
+    def stop(self):
+        self.running = False
+        pending, self.queue = self.queue, []
+        self.wakeup.set()
+        for ticket in pending:
+            ticket.future.set_exception(SchedulerStopped("Modbus scheduler stopped"))
+        if self.dispatcher is not None:
+            # Let in-flight transactions finish so their callers get their answers
+            self.dispatcher.join(timeout=5)
+            self.dispatcher.kill()
+        self.workers.join(timeout=5)
+        self.workers.kill()
+        if self.io_pool is not None:
+            self.io_pool.kill()
+
+    def submit(self, priority, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) as one bus transaction. Returns an AsyncResult."""
+        if isinstance(priority, str):
+            priority = PRIORITY_CLASSES[priority]
+        ticket = Ticket(priority, next(self.sequence), func, args, kwargs)
+        if not self.running:
+            ticket.future.set_exception(SchedulerStopped("Modbus scheduler is not running"))
+            return ticket.future
+        self.queue.append(ticket)
+        stats = self.stats_by_class[priority]
+        stats.submitted += 1
+        stats.max_depth = max(stats.max_depth, self._depth(priority))
+        self.wakeup.set()
+        return ticket.future
+
+    def run(self, priority, func, *args, **kwargs):
+        """Queue one transaction and wait (cooperatively) until it has been executed."""
+        return self.submit(priority, func, *args, **kwargs).get()
+
+    def _depth(self, priority):
+        return sum(1 for ticket in self.queue if ticket.priority == priority)
+
+    def _effective_priority(self, ticket, now):
+        return ticket.priority - (now - ticket.enqueued_at) / self.aging_interval, ticket.sequence
+
+    def _next_ticket(self):
+        """Pick the next request to run, expiring the ones past their deadline."""
+        now = time.monotonic()
+        for ticket in list(self.queue):
+            if now - ticket.enqueued_at > self.deadlines[ticket.priority]:
+                self.queue.remove(ticket)
+                self.stats_by_class[ticket.priority].expired += 1
+                ticket.future.set_exception(DeadlineExceeded(
+                    f"{PRIORITY_NAMES[ticket.priority]} request waited {now - ticket.enqueued_at:.2f} s"))
+        if not self.queue:
+            return None
+        ticket = min(self.queue, key=lambda t: self._effective_priority(t, now))
+        self.queue.remove(ticket)
+        return ticket
+
+    def _dispatch_loop(self):
+        while self.running:
+            if not self.queue or self.in_flight >= self.concurrency:
+                self.wakeup.clear()
+                self.wakeup.wait()
+                continue
+            ticket = self._next_ticket()
+            if ticket is None:
+                continue
+            if self.in_flight == 0:
+                self.busy_since = time.monotonic()
+            self.in_flight += 1
+            if self.concurrency == 1:
+                self._execute(ticket)
+            else:
+                self.workers.spawn(self._execute, ticket)
+
+    def _execute(self, ticket):
+        wait = time.monotonic() - ticket.enqueued_at
+        stats = self.stats_by_class[ticket.priority]
+        try:
+            if self.io_pool is not None:
+                # Blocks only this greenlet; the serial I/O runs on the pool's thread
+                result = self.io_pool.apply(ticket.func, ticket.args, ticket.kwargs)
+            else:
+                result = ticket.func(*ticket.args, **ticket.kwargs)
+        except Exception as e:
+            stats.failed += 1
+            ticket.future.set_exception(e)
+        else:
+            stats.completed += 1
+            ticket.future.set_result(result)
+        finally:
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            stats.recent_waits.append(wait)
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.busy_since = None
+            # A slot is free again
+            self.wakeup.set()
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'busy': self.busy_since is not None,
+            'in_flight': self.in_flight,
+            'concurrency': self.concurrency,
+            'deadlines': {PRIORITY_NAMES[p]: seconds for p, seconds in self.deadlines.items()},
+            'classes': {PRIORITY_NAMES[p]: stats.as_dict(self._depth(p))
+                        for p, stats in self.stats_by_class.items()},
+        }
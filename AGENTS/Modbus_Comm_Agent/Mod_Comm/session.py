@@ -0,0 +1,179 @@
+"""
+Persistent Modbus RTU session used by the Modbus communication agent.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import minimalmodbus
+import serial
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+# Errors after which the serial port itself is suspect and has to be reopened.
+# minimalmodbus errors (e.g. NoResponseError) only mean the inverter answered badly
+# or stayed silent on a healthy port, so they are excluded in _transaction.
+PORT_ERRORS = (serial.SerialException, OSError)
+
+
+class ModbusSession:
+    """
+    Owns one serial port and one minimalmodbus instrument for the lifetime of the agent.
+
+    The port is opened once and reused for every transaction, so a read or write
+    only costs the time on the wire. If the port breaks (adapter unplugged, device
+    node recreated, I/O error) the session is marked broken and reopened on the
+    next transaction.
+
+    Several inverters on the same RS-485 line share one session: slave_id is the
+    default address, and every transaction can be sent to another one.
+
+    If metrics (a BusMetrics) is given, every transaction is timed and counted there.
+    """
+
+    def __init__(self, port, slave_id, baudrate=9600, bytesize=8, parity=serial.PARITY_NONE,
+                 stopbits=1, timeout=1, health_check_interval=30, metrics=None):
+        self.port = port
+        self.slave_id = slave_id
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.metrics = metrics
+
+        self.serial = None
+        self.instrument = None
+        self.broken = False
+        self.lock = threading.RLock()
+
+        # Counters reported through get_session_status
+        self.opened_at = None
+        self.last_activity = None
+        self.reconnects = 0
+        self.transactions = 0
+
+    def open(self):
+        """Open the serial port and build the instrument on top of it."""
+        with self.lock:
+            if self.is_open():
+                return
+            agent_logger.info(f"Opening Modbus session on {self.port} (slave {self.slave_id})")
+            self.serial = serial.Serial(
+                port=self.port,
+                baudrate=self.baudrate,
+                bytesize=self.bytesize,
+                parity=self.parity,
+                stopbits=self.stopbits,
+                timeout=self.timeout,
+            )
+            self.instrument = minimalmodbus.Instrument(self.serial, self.slave_id)
+            self.broken = False
+            self.opened_at = time.time()
+            agent_logger.info("Modbus session opened")
+
+    def close(self):
+        """Close the serial port. Safe to call more than once."""
+        with self.lock:
+            if self.serial is not None:
+                try:
+                    self.serial.close()
+                except Exception as e:
+                    agent_logger.error(f"Error while closing Modbus session: {e}")
+            self.serial = None
+            self.instrument = None
+            self.opened_at = None
+            agent_logger.info("Modbus session closed")
+
+    def reconnect(self):
+        """Drop the current port and open a fresh one."""
+        with self.lock:
+            agent_logger.info(f"Reconnecting Modbus session on {self.port}")
+            self.close()
+            self.reconnects += 1
+            self.open()
+
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open and not self.broken
+
+    def check_health(self):
+        """
+        Verify that the port is still usable. Returns True when healthy.
+
+        The session is considered unhealthy when the port was closed or marked
+        broken, or when the device node disappeared underneath an open port.
+        An unhealthy session is reopened here so the next transaction does not
+        pay for it.
+        """
+        with self.lock:
+            healthy = self.is_open() and os.path.exists(self.port)
+            if not healthy:
+                try:
+                    self.reconnect()
+                    healthy = self.is_open()
+                except Exception as e:
+                    agent_logger.error(f"Modbus session health check failed to reconnect: {e}")
+                    healthy = False
+            return healthy
+
+    def status(self):
+        """Return a JSON friendly summary of the session."""
+        return {
+            'port': self.port,
+            'transport': 'rtu',
+            'slave_id': self.slave_id,
+            'open': self.is_open(),
+            'opened_at': self.opened_at,
+            'last_activity': self.last_activity,
+            'reconnects': self.reconnects,
+            'transactions': self.transactions,
+        }
+
+    def _transaction(self, function_code, register_address, count, func, slave_id=None):
+        """Run one Modbus transaction on the open port, reopening it first if needed."""
+        with self.lock:
+            if not self.is_open():
+                if self.serial is None:
+                    self.open()
+                else:
+                    self.reconnect()
+            self.instrument.address = self.slave_id if slave_id is None else slave_id
+            error = None
+            start = time.monotonic()
+            try:
+                return func()
+            except minimalmodbus.ModbusException as e:
+                # Subclass of IOError, but the port itself is fine
+                error = e
+                raise
+            except PORT_ERRORS as e:
+                # Reopen on the next transaction; the caller decides whether to retry
+                self.broken = True
+                error = e
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.transactions += 1
+                self.last_activity = time.time()
+                if self.metrics is not None:
+                    self.metrics.record_transaction(function_code, register_address, count,
+                                                    time.monotonic() - start, error)
+
+    def read_registers(self, register_address, num_registers, function_code=4, slave_id=None):
+        return self._transaction(function_code, register_address, num_registers, lambda: self.instrument.read_registers(
+            register_address, num_registers, functioncode=function_code), slave_id)
+
+    def write_register(self, register_address, value, function_code=16, slave_id=None):
+        return self._transaction(function_code, register_address, 1, lambda: self.instrument.write_register(
+            register_address, value, functioncode=function_code), slave_id)
+
+    def write_registers(self, register_address, values, slave_id=None):
+        return self._transaction(16, register_address, len(values), lambda: self.instrument.write_registers(
+            register_address, values), slave_id)
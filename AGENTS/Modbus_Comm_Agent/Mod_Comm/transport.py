@@ -0,0 +1,355 @@
+"""
+Transports of the Modbus communication agent.
+
+Every ModbusPort talks to its devices through a session with the same interface:
+open, close, reconnect, is_open, check_health, status, and read_registers,
+write_register and write_registers taking an optional slave_id. The retry loops,
+caches and RPCs do not know which transport is underneath.
+
+  rtu: ModbusSession (session.py), one serial line carrying one request at a time.
+  tcp: ModbusTcpSession below, a pool of persistent Modbus TCP connections to an
+       inverter or gateway. Requests are pipelined: each carries a transaction id
+       in its MBAP header, several may be in flight on a connection at once (up to
+       max_in_flight) and the answers are matched back by id, in whatever order
+       they arrive.
+"""
+
+import itertools
+import logging
+import struct
+import time
+
+import gevent
+import minimalmodbus
+from gevent import socket
+from gevent.event import AsyncResult
+from gevent.lock import BoundedSemaphore, Semaphore
+
+from .session import ModbusSession
+
+
+agent_logger = logging.getLogger('ModbusCommunication')
+
+
+RTU = 'rtu'
+TCP = 'tcp'
+
+DEFAULT_TCP_PORT = 502
+
+# MBAP header: transaction id, protocol id (0), length of unit id + PDU, unit id
+MBAP_HEADER = struct.Struct('>HHHB')
+MAX_PDU_SIZE = 253
+
+# Slave exception codes and the minimalmodbus errors the RTU path raises for them
+SLAVE_EXCEPTIONS = {
+    1: minimalmodbus.IllegalRequestError,
+    2: minimalmodbus.IllegalRequestError,
+    3: minimalmodbus.IllegalRequestError,
+    4: minimalmodbus.SlaveReportedException,
+    6: minimalmodbus.SlaveDeviceBusyError,
+    7: minimalmodbus.NegativeAcknowledgeError,
+}
+
+
+def parse_tcp_address(address):
+    """Split 'host:port' (optionally prefixed by tcp://) into (host, port); the port defaults to 502."""
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+    host, _, port = address.rpartition(':')
+    if not host:
+        return port, DEFAULT_TCP_PORT
+    return host, int(port)
+
+
+def create_session(transport, port, slave_id, baudrate=9600, timeout=1, health_check_interval=30, metrics=None,
+                   pool_size=2, max_in_flight=4):
+    """Build the session for a ModbusPort. pool_size and max_in_flight only apply to TCP."""
+    if transport == RTU:
+        return ModbusSession(port=port, slave_id=slave_id, baudrate=baudrate, timeout=timeout,
+                             health_check_interval=health_check_interval, metrics=metrics)
+    if transport == TCP:
+        return ModbusTcpSession(address=port, slave_id=slave_id, timeout=timeout, pool_size=pool_size,
+                                max_in_flight=max_in_flight, health_check_interval=health_check_interval,
+                                metrics=metrics)
+    raise ValueError(f"Unknown Modbus transport {transport}")
+
+
+def check_response(function_code, pdu):
+    """Raise the matching minimalmodbus error for an exception response or a reply to another function."""
+    if not pdu:
+        raise minimalmodbus.InvalidResponseError("Empty response")
+    if pdu[0] == function_code | 0x80:
+        code = pdu[1] if len(pdu) > 1 else None
+        raise SLAVE_EXCEPTIONS.get(code, minimalmodbus.SlaveReportedException)(
+            f"Slave reported exception code {code} for function {function_code}")
+    if pdu[0] != function_code:
+        raise minimalmodbus.InvalidResponseError(f"Response to function {pdu[0]}, expected {function_code}")
+
+
+class TcpConnection:
+    """
+    One persistent Modbus TCP connection.
+
+    transaction() can be called from several greenlets at once: each request gets
+    its own transaction id and waits on its own AsyncResult, and a reader greenlet
+    hands every answer to the request with the same id. A slot semaphore caps the
+    requests in flight at max_in_flight, which is what most gateways accept.
+    An answer arriving after its request timed out is discarded (counted as stale).
+    """
+
+    def __init__(self, host, port, timeout=1, max_in_flight=4):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+        self.sock = None
+        self.reader = None
+        self.pending = {}
+        self.slots = BoundedSemaphore(max_in_flight)
+        self.send_lock = Semaphore()
+        self.ids = itertools.count(1)
+
+        # Counters
+        self.requests = 0
+        self.stale_responses = 0
+        self.max_seen_in_flight = 0
+
+    def is_open(self):
+        return self.sock is not None
+
+    def open(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Reads block in the reader greenlet until the connection closes
+        self.sock.settimeout(None)
+        self.reader = gevent.spawn(self._read_loop, self.sock)
+
+    def close(self, reason="connection closed"):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        if self.reader is not None and self.reader is not gevent.getcurrent():
+            self.reader.kill(block=False)
+        self.reader = None
+        # Fail whatever was still waiting for an answer on this connection
+        pending, self.pending = self.pending, {}
+        for result in pending.values():
+            result.set_exception(ConnectionError(f"Modbus TCP {self.host}:{self.port}: {reason}"))
+
+    def _next_id(self):
+        while True:
+            transaction_id = next(self.ids) & 0xFFFF
+            if transaction_id not in self.pending:
+                return transaction_id
+
+    def transaction(self, unit_id, pdu):
+        """Send one request PDU to unit_id and wait for its response PDU."""
+        with self.slots:
+            if self.sock is None:
+                raise ConnectionError(f"Modbus TCP connection to {self.host}:{self.port} is closed")
+            transaction_id = self._next_id()
+            result = self.pending[transaction_id] = AsyncResult()
+            self.requests += 1
+            self.max_seen_in_flight = max(self.max_seen_in_flight, len(self.pending))
+            try:
+                with self.send_lock:
+                    self.sock.sendall(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit_id) + pdu)
+                return result.get(timeout=self.timeout)
+            except gevent.Timeout:
+                raise minimalmodbus.NoResponseError(
+                    f"No answer to transaction {transaction_id} from {self.host}:{self.port}")
+            finally:
+                self.pending.pop(transaction_id, None)
+
+    def _recv_exactly(self, sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed by peer")
+            data += chunk
+        return data
+
+    def _read_loop(self, sock):
+        try:
+            while True:
+                transaction_id, protocol, length, unit_id = MBAP_HEADER.unpack(self._recv_exactly(sock, 7))
+                if protocol != 0 or not 2 <= length <= MAX_PDU_SIZE + 1:
+                    # Framing is lost; nothing after this can be trusted
+                    raise ConnectionError(f"invalid MBAP header (protocol {protocol}, length {length})")
+                pdu = self._recv_exactly(sock, length - 1)
+                result = self.pending.get(transaction_id)
+                if result is None:
+                    self.stale_responses += 1
+                    continue
+                result.set(pdu)
+        except (OSError, struct.error) as e:
+            if self.sock is sock:
+                agent_logger.error(f"Modbus TCP connection to {self.host}:{self.port} lost: {e}")
+                self.close(str(e))
+
+    def status(self):
+        return {
+            'open': self.is_open(),
+            'in_flight': len(self.pending),
+            'max_in_flight': self.max_seen_in_flight,
+            'requests': self.requests,
+            'stale_responses': self.stale_responses,
+        }
+
+
+class ModbusTcpSession:
+    """
+    Modbus TCP counterpart of ModbusSession.
+
+    Keeps pool_size persistent connections to address ('host:port') and sends each
+    transaction on the connection with the fewest requests in flight, so up to
+    pool_size * max_in_flight transactions run at once. Connections are opened
+    lazily and a connection that fails is reopened on its next use. Transactions
+    run on the calling greenlet, so the port's scheduler dispatches them without
+    an I/O thread.
+
+    If metrics (a BusMetrics) is given, every transaction is timed and counted there.
+    """
+
+    def __init__(self, address, slave_id, timeout=1, pool_size=2, max_in_flight=4, health_check_interval=30,
+                 metrics=None):
+        if pool_size < 1:
+            raise ValueError(f"pool_size of the Modbus TCP session to {address} must be at least 1, got {pool_size}")
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight of the Modbus TCP session to {address} must be at least 1, "
+                             f"got {max_in_flight}")
+        self.port = address
+        self.host, self.tcp_port = parse_tcp_address(address)
+        self.slave_id = slave_id
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight
+        self.health_check_interval = health_check_interval
+        self.metrics = metrics
+
+        self.connections = [TcpConnection(self.host, self.tcp_port, timeout, max_in_flight)
+                            for _ in range(pool_size)]
+        self.connect_lock = Semaphore()
+
+        # Counters reported through get_session_status
+        self.opened_at = None
+        self.last_activity = None
+        self.reconnects = 0
+        self.transactions = 0
+
+    def open(self):
+        """Open every connection of the pool that is not open yet."""
+        with self.connect_lock:
+            error = None
+            for connection in self.connections:
+                if connection.is_open():
+                    continue
+                try:
+                    connection.open()
+                except OSError as e:
+                    error = e
+            if not self.is_open():
+                raise error
+            if self.opened_at is None:
+                agent_logger.info(f"Opened Modbus TCP session to {self.port} "
+                                  f"({self.pool_size} connections, {self.max_in_flight} requests each)")
+                self.opened_at = time.time()
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.opened_at = None
+        agent_logger.info(f"Modbus TCP session to {self.port} closed")
+
+    def reconnect(self):
+        agent_logger.info(f"Reconnecting Modbus TCP session to {self.port}")
+        self.close()
+        self.reconnects += 1
+        self.open()
+
+    def is_open(self):
+        return any(connection.is_open() for connection in self.connections)
+
+    def check_health(self):
+        """Reopen closed connections. Returns True when the whole pool is open."""
+        if all(connection.is_open() for connection in self.connections):
+            return True
+        was_open = self.opened_at is not None
+        try:
+            self.open()
+        except OSError as e:
+            agent_logger.error(f"Modbus TCP health check failed to reconnect to {self.port}: {e}")
+            return False
+        if was_open:
+            self.reconnects += 1
+        return all(connection.is_open() for connection in self.connections)
+
+    def status(self):
+        return {
+            'port': self.port,
+            'transport': TCP,
+            'slave_id': self.slave_id,
+            'open': self.is_open(),
+            'opened_at': self.opened_at,
+            'last_activity': self.last_activity,
+            'reconnects': self.reconnects,
+            'transactions': self.transactions,
+            'connections': [connection.status() for connection in self.connections],
+        }
+
+    def _connection(self):
+        """The least loaded connection of the pool, opening it if it is closed."""
+        connection = min(self.connections, key=lambda c: (not c.is_open(), len(c.pending)))
+        if not connection.is_open():
+            with self.connect_lock:
+                if not connection.is_open():
+                    connection.open()
+                    if self.opened_at is None:
+                        self.opened_at = time.time()
+                    else:
+                        self.reconnects += 1
+        return connection
+
+    def _transaction(self, function_code, register_address, count, pdu, decode, slave_id=None):
+        """Run one transaction and decode its response, timing it into metrics."""
+        error = None
+        start = time.monotonic()
+        try:
+            connection = self._connection()
+            response = connection.transaction(self.slave_id if slave_id is None else slave_id, pdu)
+            check_response(function_code, response)
+            return decode(response)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.transactions += 1
+            self.last_activity = time.time()
+            if self.metrics is not None:
+                self.metrics.record_transaction(function_code, register_address, count,
+                                                time.monotonic() - start, error)
+
+    def read_registers(self, register_address, num_registers, function_code=4, slave_id=None):
+        def decode(response):
+            if len(response) != 2 + 2 * num_registers or response[1] != 2 * num_registers:
+                raise minimalmodbus.InvalidResponseError(f"Wrong byte count in response: {response.hex()}")
+            return list(struct.unpack(f'>{num_registers}H', response[2:]))
+
+        return self._transaction(function_code, register_address, num_registers,
+                                 struct.pack('>BHH', function_code, register_address, num_registers), decode, slave_id)
+
+    def write_register(self, register_address, value, function_code=16, slave_id=None):
+        if function_code == 6:
+            pdu = struct.pack('>BHH', 6, register_address, value)
+        else:
+            pdu = struct.pack('>BHHBH', 16, register_address, 1, 2, value)
+        return self._transaction(function_code, register_address, 1, pdu, lambda response: None, slave_id)
+
+    def write_registers(self, register_address, values, slave_id=None):
+        pdu = struct.pack(f'>BHHB{len(values)}H', 16, register_address, len(values), 2 * len(values), *values)
+        return self._transaction(16, register_address, len(values), pdu, lambda response: None, slave_id)
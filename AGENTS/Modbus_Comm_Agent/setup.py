@@ -20,6 +20,7 @@ setup(
     description="Modbus communication",
     install_requires=[
         'volttron',
+        'minimalmodbus>=2.0',
         'pymodbus==3.6.4'  # Specify the pymodbus version you have installed or simply use 'pymodbus' for the latest version
     ],
     packages=packages,
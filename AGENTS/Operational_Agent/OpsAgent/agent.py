@@ -4,7 +4,7 @@ import logging
 import sys
 from volttron.platform.agent import utils
 import sqlite3
-from volttron.platform.vip.agent import Agent, Core, RPC
+from volttron.platform.vip.agent import Agent, Core, RPC, PubSub
 import os
 import time
 
@@ -47,6 +47,8 @@ def Operations_factory(config_path, **kwargs):
     ESC_Step_Time = int(config.get('ESC_Step_Time', 2))
     SOC_UP_VltReg_Limit = int(config.get('SOC_UP_VltReg_Limit', 25))
     SOC_DN_VltReg_Limit = int(config.get('SOC_DN_VltReg_Limit', 95))
+    modbus_device_id = config.get('modbus_device_id', 'inverter1')
+    telemetry_max_age = float(config.get('telemetry_max_age', 120))
 
     # Log the values read from the configuration
     agent_logger.info("Configuration values loaded:")
@@ -62,6 +64,8 @@ def Operations_factory(config_path, **kwargs):
     agent_logger.info(f"ESC Step Time: {ESC_Step_Time}")
     agent_logger.info(f"SOC Upper Voltage Limit: {SOC_UP_VltReg_Limit}")
     agent_logger.info(f"SOC Lower Voltage Limit: {SOC_DN_VltReg_Limit}")
+    agent_logger.info(f"Modbus Device ID: {modbus_device_id}")
+    agent_logger.info(f"Telemetry Max Age: {telemetry_max_age}")
 
     # Pass the loaded configuration values to the ESC agent
     return Operations(
@@ -77,6 +81,8 @@ def Operations_factory(config_path, **kwargs):
         ESC_Step_Time=ESC_Step_Time,
         SOC_UP_VltReg_Limit=SOC_UP_VltReg_Limit,
         SOC_DN_VltReg_Limit=SOC_DN_VltReg_Limit,
+        modbus_device_id=modbus_device_id,
+        telemetry_max_age=telemetry_max_age,
         **kwargs
     )
 
@@ -88,7 +94,8 @@ class Operations(Agent):
 
     def __init__(self, db_path, file_path, curvefitfig_path,remote_input_file, default_pf, ESC_SOC_Limit,
                  inverter_rated_S, normalizing_voltage, max_iter_ESC_Vltg_Reg,
-                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, **kwargs):
+                 ESC_Step_Time, SOC_UP_VltReg_Limit, SOC_DN_VltReg_Limit, modbus_device_id='inverter1',
+                 telemetry_max_age=120, **kwargs):
         super(Operations, self).__init__(**kwargs)
 
         # Assign configuration values to instance variables
@@ -104,6 +111,11 @@ class Operations(Agent):
         self.ESC_Step_Time = ESC_Step_Time
         self.SOC_UP_VltReg_Limit = SOC_UP_VltReg_Limit
         self.SOC_DN_VltReg_Limit = SOC_DN_VltReg_Limit
+        # Inverter (of the ones the Modbus agent manages) whose status gates operation
+        self.modbus_device_id = modbus_device_id
+        # Inverter values older than this (s) are not acted on, twice the DataBase
+        # agent's telemetry_heartbeat_interval at which it publishes a full snapshot
+        self.telemetry_max_age = telemetry_max_age
 
         # Log initialization
         agent_logger.info("ESC Agent initialized with configuration:")
@@ -119,11 +131,16 @@ class Operations(Agent):
         agent_logger.info(f"ESC Step Time: {self.ESC_Step_Time}")
         agent_logger.info(f"SOC Upper Voltage Limit: {self.SOC_UP_VltReg_Limit}")
         agent_logger.info(f"SOC Lower Voltage Limit: {self.SOC_DN_VltReg_Limit}")
+        agent_logger.info(f"Modbus Device: {self.modbus_device_id}")
+        agent_logger.info(f"Telemetry Max Age: {self.telemetry_max_age}")
 
         # Initialize placeholders for connection and cursor
         self.conn = None
         self.cursor = None
 
+        # Latest snapshot published by the DataBase agent on inverter/telemetry
+        self.latest_telemetry = None
+
         # Define initial values for tracking changes
         self.current_remote_input = None
         self.current_local_input = None
@@ -139,8 +156,8 @@ class Operations(Agent):
             agent_logger.error(f"Error connecting to SQLite database: {e}")
 
     def fetch_remote_inputs(self):
-        """Fetch the latest remote inputs from the database based on timestamp and return as a dictionary."""
-        query = "SELECT * FROM remote_inputs ORDER BY timestamp DESC LIMIT 1"
+        """Fetch the latest remote inputs from the database (highest seq) and return as a dictionary."""
+        query = "SELECT * FROM remote_inputs ORDER BY seq DESC LIMIT 1"
         try:
             self.cursor.execute(query)
             row = self.cursor.fetchone()
@@ -158,8 +175,8 @@ class Operations(Agent):
             return None
 
     def fetch_local_inputs(self):
-        """Fetch the latest local inputs from the database based on timestamp and return as a dictionary."""
-        query = "SELECT * FROM local_inputs ORDER BY timestamp DESC LIMIT 1"
+        """Fetch the latest local inputs from the database (highest seq) and return as a dictionary."""
+        query = "SELECT * FROM local_inputs ORDER BY seq DESC LIMIT 1"
         try:
             self.cursor.execute(query)
             row = self.cursor.fetchone()
@@ -238,7 +255,7 @@ class Operations(Agent):
         """Update the operational_data table in the database with values from mode."""
         try:
             # Extract the relevant fields from the mode dictionary
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            ts_ms = int(time.time() * 1000)
             data_to_update = {
                 'allow_opr': allow_opr,
                 'voltage_regulation_mode': mode.get('voltage_regulation_mode'),
@@ -258,13 +275,13 @@ class Operations(Agent):
             # Construct the query to update the operational_data table
             columns = ', '.join(data_to_update.keys())
             placeholders = ', '.join('?' * len(data_to_update))
-            query = f"INSERT INTO operational_data (timestamp, {columns}) VALUES (?, {placeholders})"
+            query = f"INSERT INTO operational_data (ts_ms, {columns}) VALUES (?, {placeholders})"
 
             # Log the data for debugging
             agent_logger.info(f"Updating operational_data with: {data_to_update}")
 
             # Execute the query
-            self.cursor.execute(query, (timestamp, *data_to_update.values()))
+            self.cursor.execute(query, (ts_ms, *data_to_update.values()))
             self.conn.commit()
         except sqlite3.Error as e:
             agent_logger.error(f"Error updating operational_data: {e}")
@@ -353,27 +370,62 @@ class Operations(Agent):
                 agent_logger.error(f"Error in monitoring changes: {e}")
                 time.sleep(2)  # Continue monitoring after a delay
 
+    @PubSub.subscribe('pubsub', 'inverter/telemetry')
+    def on_inverter_telemetry(self, peer, sender, bus, topic, headers, message):
+        """Keep the latest inverter values published by the DataBase agent."""
+        if message.get('device_id', self.modbus_device_id) != self.modbus_device_id:
+            return
+        if message.get('snapshot', True):
+            self.latest_telemetry = message
+        elif self.latest_telemetry is not None:
+            # Only the fields that changed: apply them over the last snapshot
+            self.latest_telemetry = dict(self.latest_telemetry, **message)
+        else:
+            # No snapshot to apply the changes to yet, inverter_registers is used until one arrives
+            return
+
     def check_switch(self):
         """
         Check if the conditions in the database are met:
         inverter_status = 3, modbus_comm = 1, master_switch = 1.
-        Returns True if all conditions are satisfied, False otherwise.
+        Returns True if all conditions are satisfied, False otherwise, and False
+        when the inverter status is older than telemetry_max_age.
         """
         try:
-            # Query the most recent row from inverter_registers (based on timestamp)
-            self.cursor.execute('''
-                SELECT inverter_status 
-                FROM inverter_registers 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            ''')
-            inverter_status_row = self.cursor.fetchone()
-
-            # Query the most recent row from safety_data (based on timestamp)
+            # Inverter status from the latest published snapshot while it is at most
+            # telemetry_max_age old, else from the most recent row of inverter_registers
+            now_ms = time.time() * 1000
+            inverter_status_row = None
+            if self.latest_telemetry is not None:
+                age = (now_ms - self.latest_telemetry.get('ts_ms', 0)) / 1000
+                if age <= self.telemetry_max_age:
+                    inverter_status_row = (self.latest_telemetry.get('inverter_status'),)
+                else:
+                    # The DataBase agent stopped publishing: its last snapshot is dropped
+                    agent_logger.warning(f"Telemetry snapshot is {age:.0f} s old, querying inverter_registers")
+                    self.latest_telemetry = None
+            if inverter_status_row is None:
+                self.cursor.execute('''
+                    SELECT inverter_status, ts_ms 
+                    FROM inverter_registers 
+                    WHERE device_id = ?
+                    ORDER BY seq DESC 
+                    LIMIT 1
+                ''', (self.modbus_device_id,))
+                inverter_status_row = self.cursor.fetchone()
+                if inverter_status_row is not None:
+                    age = (now_ms - (inverter_status_row[1] or 0)) / 1000
+                    if age > self.telemetry_max_age:
+                        # An inverter status this old says nothing about the inverter now
+                        agent_logger.warning(f"Latest inverter_registers row of {self.modbus_device_id} "
+                                             f"is {age:.0f} s old, operation not allowed")
+                        return False
+
+            # Query the most recent row from safety_data (based on seq)
             self.cursor.execute('''
                 SELECT modbus_comm, master_switch 
                 FROM safety_data 
-                ORDER BY timestamp DESC 
+                ORDER BY seq DESC 
                 LIMIT 1
             ''')
             safety_data_row = self.cursor.fetchone()
@@ -1,5 +1,6 @@
 import os
-import time
+import sys
+import json
 import subprocess
 import logging
 
@@ -24,6 +25,12 @@ def setup_logging():
 
 agent_logger = setup_logging()
 
+# RemoteInputs.txt is read through the DataBase agent's input service (inotify, parsed by name)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DataBase_Agent'))
+from DBAgent.dso_inputs import DSOInputService
+
+DSO_IN_FOLDER = os.path.expanduser('~/DSO_IN')
+
 
 class FileReader:
     def __init__(self):
@@ -32,65 +39,52 @@ class FileReader:
             "voltage_regulation_mode": None,
             "ESC_volt_reg_mode": None
         }
+        # Wakes up when RemoteInputs.txt is written, each version is parsed once. Its seqs
+        # count from 1 in this process, unlike the DataBase agent's: versions are matched
+        # across processes by digest
+        self.remote_inputs = DSOInputService(DSO_IN_FOLDER, self.check_modes,
+                                             files={'RemoteInputs.txt': 'remote'}, heartbeat_interval=None)
 
-    def handle_interrupt(self):
+    def handle_interrupt(self, version):
         """Generate a message when an interrupt is detected and process the modes."""
         agent_logger.info("Interrupt detected! Mode change identified.")
         mode_processor_path = os.path.expanduser("~/AGENTS/SUPERVISORY_FUNCTIONS/mode_processor.py")
         agent_logger.info("Running mode processor script...")
         try:
-            subprocess.run(["python3", mode_processor_path], check=True)
+            # The parsed version is handed over so the mode processor does not read the file again
+            subprocess.run(["python3", mode_processor_path, "--inputs", json.dumps(version)], check=True)
             agent_logger.info("Mode processor script executed successfully.")
         except subprocess.CalledProcessError as e:
             agent_logger.error(f"Error occurred while running mode processor script: {e}")
             exit(1)
 
-    def read_remote_file_and_check_modes(self):
-        """Reads the remote file and checks for mode changes."""
-        remote_input_file = os.path.expanduser('~/DSO_IN/RemoteInputs.txt')
-
-        if os.path.exists(remote_input_file):
-            with open(remote_input_file, 'r') as file:
-                lines = file.readlines()
-
-            if len(lines) >= 3:  # Ensure there are enough lines for the modes
-                # Extract mode values
-                fix_power_mode = int(lines[0].split('=')[1].strip())
-                voltage_regulation_mode = int(lines[1].split('=')[1].strip())
-                esc_volt_reg_mode = int(lines[2].split('=')[1].strip())
+    def check_modes(self, version):
+        """Checks a new version of the remote file for mode changes, read even when its setpoints were rejected."""
+        agent_logger.info(f"Remote inputs version {version['seq']}: modes {version['modes']}")
+        modes = {name: version['modes'][name] for name in self.previous_remote_modes}
 
-                # Check for changes in modes
-                interrupt_detected = (
-                    self.previous_remote_modes["fix_power_mode"] is not None and
-                    self.previous_remote_modes["fix_power_mode"] != fix_power_mode
-                ) or (
-                    self.previous_remote_modes["voltage_regulation_mode"] is not None and
-                    self.previous_remote_modes["voltage_regulation_mode"] != voltage_regulation_mode
-                ) or (
-                    self.previous_remote_modes["ESC_volt_reg_mode"] is not None and
-                    self.previous_remote_modes["ESC_volt_reg_mode"] != esc_volt_reg_mode
-                )
+        # Check for changes in modes
+        interrupt_detected = any(
+            previous is not None and previous != modes[name]
+            for name, previous in self.previous_remote_modes.items()
+        )
 
-                # Update previous modes
-                self.previous_remote_modes["fix_power_mode"] = fix_power_mode
-                self.previous_remote_modes["voltage_regulation_mode"] = voltage_regulation_mode
-                self.previous_remote_modes["ESC_volt_reg_mode"] = esc_volt_reg_mode
+        # Update previous modes
+        self.previous_remote_modes.update(modes)
 
-                # Handle interrupt if detected
-                if interrupt_detected:
-                    self.handle_interrupt()
-            else:
-                agent_logger.error(f"File {remote_input_file} has an incorrect format or insufficient data.")
-        else:
-            agent_logger.error(f"File {remote_input_file} not found.")
+        # Handle interrupt if detected
+        if interrupt_detected:
+            self.handle_interrupt(version)
 
 def main():
     file_reader = FileReader()
     agent_logger.info(f"Interupt detection file started")
-    # Run the task every 30 seconds
-    while True:
-        file_reader.read_remote_file_and_check_modes()
-        time.sleep(2)
+    remote_input_file = os.path.join(DSO_IN_FOLDER, 'RemoteInputs.txt')
+    if not os.path.exists(remote_input_file):
+        agent_logger.error(f"File {remote_input_file} not found, waiting for it to be written.")
+    # The first version sets the modes, later ones are checked as soon as they are written
+    file_reader.remote_inputs.start()
+    file_reader.remote_inputs.run()
 
 if __name__ == "__main__":
     main()
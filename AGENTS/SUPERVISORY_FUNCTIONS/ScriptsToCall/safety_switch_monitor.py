@@ -82,7 +82,7 @@ def monitor_allow_opr():
             query = """
                 SELECT allow_opr 
                 FROM operational_data 
-                ORDER BY timestamp DESC 
+                ORDER BY seq DESC 
                 LIMIT 1
             """
             cursor.execute(query)
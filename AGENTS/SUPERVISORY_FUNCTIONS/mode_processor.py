@@ -1,5 +1,8 @@
 import time
 import os
+import sys
+import json
+import argparse
 import subprocess
 import logging
 
@@ -24,6 +27,10 @@ def setup_logging():
 
 logger = setup_logging()
 
+# RemoteInputs.txt is parsed by name with the DataBase agent's input schema
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DataBase_Agent'))
+from DBAgent.input_files import read_input_modes
+
 
 # Directory containing the scripts
 SCRIPTS_DIR = os.path.expanduser('~/AGENTS/SUPERVISORY_FUNCTIONS/ScriptsToCall')
@@ -75,40 +82,48 @@ def organize_files():
     logger.info("Organize_Files called.")
     run_script("Organize_files.py")
 
-def process_modes():
+def process_modes(modes=None):
     """
-    Reads the RemoteInputs.txt file and processes the modes.
-    Executes appropriate functions based on mode values.
+    Processes the modes of RemoteInputs.txt: modes as parsed by the interrupt detection,
+    else read from the file. Executes appropriate functions based on mode values.
+    The modes are read even when the file's setpoints are not valid.
     """
-    remote_input_file = os.path.expanduser('~/DSO_IN/RemoteInputs.txt')
-
-    if os.path.exists(remote_input_file):
-        with open(remote_input_file, 'r') as file:
-            lines = file.readlines()
-
-        if len(lines) >= 3:  # Ensure there are enough lines for the modes
-            # Extract mode values
-            fix_power_mode = int(lines[0].split('=')[1].strip())
-            voltage_regulation_mode = int(lines[1].split('=')[1].strip())
-            esc_volt_reg_mode = int(lines[2].split('=')[1].strip())
-
-            # Check if any mode is 1
-            if fix_power_mode == 1 or voltage_regulation_mode == 1 or esc_volt_reg_mode == 1:
-                logger.info("At least one mode is ON. Executing actions...")
-                turn_on_switch()
-                install_agents()
-                check_for_tripping()
-            else:
-                logger.info("All modes are OFF. Executing cleanup...")
-                remove_agents()
-                organize_files()
-                turn_off_switch()
-                
-        else:
-            logger.error(f"File {remote_input_file} has an incorrect format or insufficient data.")
+    if modes is None:
+        remote_input_file = os.path.expanduser('~/DSO_IN/RemoteInputs.txt')
+        if not os.path.exists(remote_input_file):
+            logger.error(f"File {remote_input_file} not found.")
+            return
+        try:
+            modes = read_input_modes(remote_input_file)
+        except ValueError as e:
+            logger.error(f"File {remote_input_file} has an incorrect format or insufficient data: {e}")
+            return
+
+    # Extract mode values
+    fix_power_mode = modes['fix_power_mode']
+    voltage_regulation_mode = modes['voltage_regulation_mode']
+    esc_volt_reg_mode = modes['ESC_volt_reg_mode']
+
+    # Check if any mode is 1
+    if fix_power_mode == 1 or voltage_regulation_mode == 1 or esc_volt_reg_mode == 1:
+        logger.info("At least one mode is ON. Executing actions...")
+        turn_on_switch()
+        install_agents()
+        check_for_tripping()
     else:
-        logger.error(f"File {remote_input_file} not found.")
+        logger.info("All modes are OFF. Executing cleanup...")
+        remove_agents()
+        organize_files()
+        turn_off_switch()
 
 if __name__ == "__main__":
-    process_modes()
-
+    parser = argparse.ArgumentParser(description="Turn the agents on or off for the modes of RemoteInputs.txt")
+    parser.add_argument('--inputs', default=None,
+                        help="version of RemoteInputs.txt as JSON, from the interrupt detection (default: read the file)")
+    args = parser.parse_args()
+    if args.inputs:
+        version = json.loads(args.inputs)
+        logger.info(f"Processing remote inputs version {version['seq']}")
+        process_modes(version['modes'])
+    else:
+        process_modes()
@@ -6,6 +6,8 @@ from volttron.platform.agent import utils
 import sqlite3
 from volttron.platform.vip.agent import Agent, Core, RPC
 import os
+import stat
+import tempfile
 import time
 
 """
@@ -118,31 +120,45 @@ class SSwitch(Agent):
 
 
     def write_remote_file_and_set_modes_to_zero(self):
-        """Sets all modes to zero while preserving other file content."""
+        """
+        Sets all modes to zero while preserving other file content. The new content is
+        written to a temporary file and renamed over the remote file, so the agents
+        watching it never read a half-written file. The file keeps its permissions.
+        """
+        modes = ("fix_power_mode", "voltage_regulation_mode", "ESC_volt_reg_mode")
         if os.path.exists(self.remote_input_file):
+            temp_path = None
             try:
                 # Read the file content
                 with open(self.remote_input_file, 'r') as file:
                     lines = file.readlines()
 
-                # Update the mode lines
+                # Update the mode lines, found by name
                 for i, line in enumerate(lines):
-                    if line.startswith("fix_power_mode="):
-                        lines[i] = "fix_power_mode=0\n"
-                    elif line.startswith("voltage_regulation_mode="):
-                        lines[i] = "voltage_regulation_mode=0\n"
-                    elif line.startswith("ESC_volt_reg_mode="):
-                        lines[i] = "ESC_volt_reg_mode=0\n"
-
-                # Write the updated content back to the file
-                with open(self.remote_input_file, 'w') as file:
+                    name = line.partition('=')[0].strip()
+                    if name in modes:
+                        lines[i] = f"{name}=0\n"
+
+                # Write the updated content next to the file and rename it into place
+                directory = os.path.dirname(self.remote_input_file)
+                fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".RemoteInputs.", suffix=".tmp")
+                with os.fdopen(fd, 'w') as file:
                     file.writelines(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                    # mkstemp creates the file 0600
+                    os.fchmod(file.fileno(), stat.S_IMODE(os.stat(self.remote_input_file).st_mode))
+                os.replace(temp_path, self.remote_input_file)
+                temp_path = None
 
                 agent_logger.info(f"Successfully set all modes to zero in {self.remote_input_file}.")
-            except IOError as e:
-                logger.error(f"Failed to modify file {self.remote_input_file}: {e}")
+            except OSError as e:
+                agent_logger.error(f"Failed to modify file {self.remote_input_file}: {e}")
+            finally:
+                if temp_path is not None and os.path.exists(temp_path):
+                    os.remove(temp_path)
         else:
-            logger.error(f"File {self.remote_input_file} not found.")
+            agent_logger.error(f"File {self.remote_input_file} not found.")
 
 
     def monitorSS(self):
@@ -170,7 +186,7 @@ class SSwitch(Agent):
                 query = """
                     SELECT allow_opr 
                     FROM operational_data 
-                    ORDER BY timestamp DESC 
+                    ORDER BY seq DESC 
                     LIMIT 1
                 """
                 cursor.execute(query)
@@ -0,0 +1,5 @@
+from .plant import InverterPlant
+from .rtu_server import RtuServer
+from .simulator import VirtualInverter
+from .slave import ModbusSlave
+from .tcp_server import TcpServer
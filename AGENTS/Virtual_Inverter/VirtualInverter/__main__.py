@@ -0,0 +1,74 @@
+"""
+Run the virtual inverter from the command line:
+
+    cd ~/AGENTS/Virtual_Inverter
+    python3 -m VirtualInverter --link /tmp/ttyVirtualInverter --latency 10
+
+then set "modbus_port": "/tmp/ttyVirtualInverter" in ~/AGENTS/config (or pass the
+link to a benchmark script) and start Mod_Comm as usual.
+
+Add --tcp-port 1502 to serve the same inverter over Modbus TCP as well, and give
+it a modbus_devices entry with "transport": "tcp", "port": "127.0.0.1:1502".
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from .simulator import VirtualInverter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Modbus RTU (and optionally TCP) inverter")
+    parser.add_argument('--link', default='/tmp/ttyVirtualInverter', help="symlink to create to the pty")
+    parser.add_argument('--slave', type=int, default=1, help="Modbus slave address")
+    parser.add_argument('--baudrate', type=int, default=9600, help="line speed to emulate, 0 for none")
+    parser.add_argument('--latency', type=float, default=5.0, help="mean response latency in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- latency jitter in ms")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of requests left unanswered")
+    parser.add_argument('--noise', type=float, default=0.005, help="relative measurement noise")
+    parser.add_argument('--rated-s', type=float, default=10000, help="rated apparent power in VA")
+    parser.add_argument('--capacity', type=float, default=10000, help="battery capacity in Wh")
+    parser.add_argument('--soc', type=float, default=60.0, help="initial state of charge in %%")
+    parser.add_argument('--time-constant', type=float, default=2.0, help="P/Q response time constant in s")
+    parser.add_argument('--tcp-port', type=int, default=None, help="also serve Modbus TCP on this port, 0 for any")
+    parser.add_argument('--tcp-host', default='127.0.0.1', help="address to serve Modbus TCP on")
+    parser.add_argument('--seed', type=int, default=None, help="random seed for repeatable runs")
+    parser.add_argument('--report', type=float, default=10.0, help="seconds between status lines, 0 for none")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    inverter = VirtualInverter(
+        link=args.link,
+        unit_id=args.slave,
+        baudrate=args.baudrate,
+        latency=args.latency / 1000.0,
+        jitter=args.jitter / 1000.0,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+        tcp_host=args.tcp_host,
+        tcp_port=args.tcp_port,
+        rated_s=args.rated_s,
+        battery_capacity_wh=args.capacity,
+        initial_soc=args.soc,
+        noise=args.noise,
+        time_constant=args.time_constant,
+    )
+    inverter.start()
+    print(f"Virtual inverter listening on {inverter.port}"
+          + (f" and tcp://{inverter.tcp_address}" if inverter.tcp_address else ""), flush=True)
+    try:
+        while True:
+            time.sleep(args.report or 3600)
+            if args.report:
+                print(json.dumps(inverter.stats()), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inverter.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Plant model of the inverter and battery behind the virtual Modbus slave.
+
+The model turns the setpoint registers the control agents write (working mode,
+reactive power limit, charge/discharge currents and time windows) into the
+measured values the DataBase agent reads back, using first order lags so that
+a step in a setpoint shows up gradually like on the real inverter.
+"""
+
+import math
+import random
+import threading
+import time
+
+
+# Input registers (FC4), as decoded by the DataBase agent
+DC_BUS_VOLTAGE = 33071          # 0.1 V
+DC_BUS_HALF_VOLTAGE = 33072     # 0.1 V
+A_PHASE_VOLTAGE = 33073         # 0.1 V
+A_PHASE_CURRENT = 33076         # 0.1 A
+ACTIVE_POWER = 33079            # 32 bit signed W, high word first
+REACTIVE_POWER = 33081          # 32 bit signed var, high word first
+APPARENT_POWER = 33083          # 32 bit signed VA, high word first
+INVERTER_STATUS = 33095
+BATTERY_SOC = 33139             # %
+
+INPUT_REGISTERS = range(33000, 33200)
+
+# Holding registers (FC3/FC6/FC16), as written by the control agents
+WORKING_MODE = 43050            # 4 = reactive power mode
+LIMIT_REACTIVE_POWER = 43051    # 0.01 % of rated S
+CHARGE_CURRENT = 43141          # 0.1 A
+DISCHARGE_CURRENT = 43142       # 0.1 A
+CHARGE_WINDOW = 43143           # start hour, start minute, end hour, end minute
+DISCHARGE_WINDOW = 43147        # start hour, start minute, end hour, end minute
+
+HOLDING_REGISTERS = range(43000, 43200)
+
+REACTIVE_POWER_MODE = 4
+STATUS_RUNNING = 2
+
+
+def in_window(hour, minute, start_hour, start_minute, end_hour, end_minute):
+    """True if hour:minute falls in the [start, end) window, which may wrap past midnight."""
+    now = hour * 60 + minute
+    start = start_hour * 60 + start_minute
+    end = end_hour * 60 + end_minute
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+class InverterPlant:
+    """
+    Register bank plus a simple inverter/battery model.
+
+    Args:
+        rated_s: rated apparent power in VA (the agents use inverter_rated_S).
+        battery_capacity_wh: usable battery energy, sets how fast SOC moves.
+        initial_soc: starting state of charge in %.
+        dc_bus_voltage: nominal DC bus voltage in V.
+        grid_voltage: nominal a-phase voltage in V.
+        voltage_droop: V of a-phase voltage rise per kvar injected.
+        time_constant: first order lag of P and Q towards their targets, in s.
+        noise: relative standard deviation of the measurement noise (0.01 = 1 %).
+        seed: seed for the noise generator, for repeatable runs.
+    """
+
+    def __init__(self, rated_s=10000, battery_capacity_wh=10000, initial_soc=60.0,
+                 dc_bus_voltage=400.0, grid_voltage=240.0, voltage_droop=1.5,
+                 time_constant=2.0, noise=0.005, seed=None):
+        self.rated_s = float(rated_s)
+        self.battery_capacity_wh = float(battery_capacity_wh)
+        self.soc = float(initial_soc)
+        self.dc_bus_voltage = float(dc_bus_voltage)
+        self.grid_voltage = float(grid_voltage)
+        self.voltage_droop = float(voltage_droop)
+        self.time_constant = float(time_constant)
+        self.noise = float(noise)
+        self.random = random.Random(seed)
+
+        self.active_power = 0.0
+        self.reactive_power = 0.0
+        self.holding = {address: 0 for address in HOLDING_REGISTERS}
+        self.inputs = {address: 0 for address in INPUT_REGISTERS}
+        self.lock = threading.Lock()
+        self.last_step = time.monotonic()
+
+        # Counters
+        self.reads = 0
+        self.writes = 0
+        self.steps = 0
+
+        self._refresh_inputs()
+
+    # Register access, called by the Modbus slave ------------------------------------
+
+    def read_input_registers(self, address, count):
+        return self._read(self.inputs, address, count)
+
+    def read_holding_registers(self, address, count):
+        return self._read(self.holding, address, count)
+
+    def write_holding_registers(self, address, values):
+        """Write values starting at address. Returns False if any address is unmapped."""
+        with self.lock:
+            if any(address + offset not in self.holding for offset in range(len(values))):
+                return False
+            for offset, value in enumerate(values):
+                self.holding[address + offset] = value & 0xFFFF
+            self.writes += 1
+        return True
+
+    def _read(self, bank, address, count):
+        """Values of count registers from address, or None if any address is unmapped."""
+        with self.lock:
+            if any(address + offset not in bank for offset in range(count)):
+                return None
+            self.reads += 1
+            return [bank[address + offset] for offset in range(count)]
+
+    # Model ---------------------------------------------------------------------------
+
+    def targets(self, hour, minute):
+        """Active and reactive power the current setpoints ask for, in W and var."""
+        h = self.holding
+        charging = in_window(hour, minute, *(h[CHARGE_WINDOW + i] for i in range(4)))
+        discharging = in_window(hour, minute, *(h[DISCHARGE_WINDOW + i] for i in range(4)))
+
+        # Positive P is discharge (export), negative P is charge, as in Execute_Powers
+        active = 0.0
+        if discharging and self.soc > 0:
+            active += h[DISCHARGE_CURRENT] * 0.1 * self.dc_bus_voltage
+        if charging and self.soc < 100:
+            active -= h[CHARGE_CURRENT] * 0.1 * self.dc_bus_voltage
+
+        reactive = 0.0
+        if h[WORKING_MODE] == REACTIVE_POWER_MODE:
+            reactive = h[LIMIT_REACTIVE_POWER] * 0.0001 * self.rated_s
+
+        # The inverter limits P first to stay inside its rating
+        active = max(-self.rated_s, min(self.rated_s, active))
+        limit = math.sqrt(max(self.rated_s ** 2 - reactive ** 2, 0.0))
+        active = max(-limit, min(limit, active))
+        return active, reactive
+
+    def step(self, now=None):
+        """Advance the model to now and refresh the input registers."""
+        now = time.monotonic() if now is None else now
+        local = time.localtime()
+        with self.lock:
+            dt = max(now - self.last_step, 0.0)
+            self.last_step = now
+            target_p, target_q = self.targets(local.tm_hour, local.tm_min)
+            alpha = 1.0 - math.exp(-dt / self.time_constant) if self.time_constant > 0 else 1.0
+            self.active_power += alpha * (target_p - self.active_power)
+            self.reactive_power += alpha * (target_q - self.reactive_power)
+
+            # Discharging (P > 0) empties the battery
+            self.soc -= self.active_power * dt / 3600.0 / self.battery_capacity_wh * 100.0
+            self.soc = max(0.0, min(100.0, self.soc))
+            self.steps += 1
+            self._refresh_inputs()
+
+    def _noisy(self, value):
+        if not self.noise:
+            return value
+        return value * (1.0 + self.random.gauss(0.0, self.noise))
+
+    def _refresh_inputs(self):
+        """Encode the model state into the input registers; called with the lock held."""
+        p = self._noisy(self.active_power)
+        q = self._noisy(self.reactive_power)
+        s = math.hypot(p, q)
+        dc = self._noisy(self.dc_bus_voltage)
+        voltage = self._noisy(self.grid_voltage + self.voltage_droop * q / 1000.0)
+        current = s / voltage if voltage > 0 else 0.0
+
+        regs = self.inputs
+        regs[DC_BUS_VOLTAGE] = int(round(dc * 10)) & 0xFFFF
+        regs[DC_BUS_HALF_VOLTAGE] = int(round(dc * 5)) & 0xFFFF
+        regs[A_PHASE_VOLTAGE] = int(round(voltage * 10)) & 0xFFFF
+        regs[A_PHASE_CURRENT] = int(round(current * 10)) & 0xFFFF
+        for address, value in ((ACTIVE_POWER, p), (REACTIVE_POWER, q), (APPARENT_POWER, s)):
+            raw = int(round(value)) & 0xFFFFFFFF
+            regs[address] = raw >> 16
+            regs[address + 1] = raw & 0xFFFF
+        regs[INVERTER_STATUS] = STATUS_RUNNING
+        regs[BATTERY_SOC] = int(round(self.soc))
+
+    def state(self):
+        with self.lock:
+            return {
+                'active_power': self.active_power,
+                'reactive_power': self.reactive_power,
+                'soc': self.soc,
+                'reads': self.reads,
+                'writes': self.writes,
+                'steps': self.steps,
+            }
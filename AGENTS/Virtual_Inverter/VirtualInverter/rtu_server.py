@@ -0,0 +1,203 @@
+"""
+Modbus RTU transport of the virtual inverter, served on a pseudo-terminal.
+
+The server keeps the master side of a pty pair; the slave side is a real tty
+device (/dev/pts/N) that pyserial and minimalmodbus open like any USB-RS485
+adapter. A symlink (e.g. /tmp/ttyVirtualInverter) gives it a stable name that
+can be put in modbus_port in the agent config.
+"""
+
+import logging
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+from .slave import WRITE_MULTIPLE_REGISTERS
+
+
+sim_logger = logging.getLogger('VirtualInverter')
+
+
+def crc16(data):
+    """Modbus RTU CRC16 (polynomial 0xA001, initial value 0xFFFF)."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def rtu_frame(unit_id, pdu):
+    """Wrap a PDU into an RTU frame: unit id, PDU, CRC low byte first."""
+    frame = bytes([unit_id]) + pdu
+    return frame + struct.pack('<H', crc16(frame))
+
+
+def crc_ok(frame):
+    return len(frame) >= 4 and struct.unpack('<H', frame[-2:])[0] == crc16(frame[:-2])
+
+
+def request_length(buffer):
+    """
+    Length of the RTU request at the start of buffer (unit id to CRC), or None
+    if it cannot be told yet. Requests with other function codes are delimited
+    by the inter-frame silence instead.
+    """
+    if len(buffer) < 2:
+        return None
+    if buffer[1] == WRITE_MULTIPLE_REGISTERS:
+        return 9 + buffer[6] if len(buffer) >= 7 else None
+    if buffer[1] in (3, 4, 6):
+        return 8
+    return None
+
+
+def wire_time(num_bytes, baudrate):
+    """Time num_bytes take on the line with 8N1 framing (10 bits per byte)."""
+    return num_bytes * 10.0 / baudrate if baudrate else 0.0
+
+
+class RtuServer:
+    """
+    Serves a ModbusSlave over Modbus RTU on a pty.
+
+    Args:
+        slave: the ModbusSlave answering requests.
+        link: optional path of a symlink to create to the pty device.
+        baudrate: line speed to emulate; request and response frames are delayed by
+            their time on the wire so round trips match a real RS-485 line.
+            0 disables the emulation and answers as fast as the pty allows.
+    """
+
+    def __init__(self, slave, link=None, baudrate=9600):
+        self.slave = slave
+        self.link = link
+        self.baudrate = baudrate
+        self.master_fd = None
+        self.slave_fd = None
+        self.device = None
+        self.running = False
+        self.thread = None
+
+        # Counters
+        self.frames_in = 0
+        self.frames_out = 0
+        self.crc_errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def port(self):
+        """Path the Modbus master should open."""
+        return self.link or self.device
+
+    def open(self):
+        self.master_fd, self.slave_fd = os.openpty()
+        # Raw mode on both ends, the client reconfigures its side when it opens the port
+        tty.setraw(self.master_fd)
+        tty.setraw(self.slave_fd)
+        self.device = os.ttyname(self.slave_fd)
+        if self.link:
+            if os.path.islink(self.link):
+                os.unlink(self.link)
+            os.symlink(self.device, self.link)
+        sim_logger.info(f"Virtual inverter RTU slave {self.slave.unit_id} on {self.device}"
+                        + (f" (linked as {self.link})" if self.link else ""))
+
+    def close(self):
+        self.running = False
+        if self.link and os.path.islink(self.link) and os.readlink(self.link) == self.device:
+            os.unlink(self.link)
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master_fd = self.slave_fd = None
+
+    def start(self):
+        """Open the pty and serve requests in a background thread."""
+        if self.master_fd is None:
+            self.open()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve_forever, name='VirtualInverterRTU', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.close()
+
+    def serve_forever(self):
+        self.running = True
+        # 3.5 character times of silence end a frame; at least 2 ms on a pty
+        silence = max(wire_time(3.5, self.baudrate), 0.002)
+        buffer = b''
+        while self.running:
+            ready, _, _ = select.select([self.master_fd], [], [], silence if buffer else 0.5)
+            if not ready:
+                if buffer:
+                    # Line went quiet: whatever is buffered is one (possibly bad) frame
+                    self._handle_frame(buffer)
+                    buffer = b''
+                continue
+            try:
+                chunk = os.read(self.master_fd, 512)
+            except OSError:
+                # Master closed underneath us (stop) or the pty went away
+                break
+            self.bytes_in += len(chunk)
+            buffer += chunk
+            length = request_length(buffer)
+            while length is not None and len(buffer) >= length:
+                self._handle_frame(buffer[:length])
+                buffer = buffer[length:]
+                length = request_length(buffer)
+
+    def _handle_frame(self, frame):
+        received_at = time.monotonic()
+        if not crc_ok(frame):
+            # A real slave stays silent on a corrupt frame
+            self.crc_errors += 1
+            sim_logger.debug(f"Dropped frame with bad CRC: {frame.hex()}")
+            return
+        self.frames_in += 1
+        response = self.slave.handle(frame[0], frame[1:-2])
+        if response is None:
+            return
+
+        reply = rtu_frame(frame[0], response)
+        # The request has only just "arrived" on the pty; pay its wire time, the
+        # processing latency and the response's wire time before answering
+        delay = wire_time(len(frame) + len(reply), self.baudrate) + self.slave.response_delay()
+        remaining = received_at + delay - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        try:
+            os.write(self.master_fd, reply)
+        except OSError as e:
+            sim_logger.error(f"Failed to send response: {e}")
+            return
+        self.frames_out += 1
+        self.bytes_out += len(reply)
+
+    def stats(self):
+        return {
+            'transport': 'rtu',
+            'port': self.port,
+            'baudrate': self.baudrate,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'crc_errors': self.crc_errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
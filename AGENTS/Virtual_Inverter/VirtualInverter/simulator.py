@@ -0,0 +1,92 @@
+"""
+The virtual inverter: one plant model stepped in the background and served by a
+Modbus slave over one or more transports.
+"""
+
+import logging
+import threading
+
+from .plant import InverterPlant
+from .rtu_server import RtuServer
+from .slave import ModbusSlave
+from .tcp_server import TcpServer
+
+
+sim_logger = logging.getLogger('VirtualInverter')
+
+
+class VirtualInverter:
+    """
+    Runs the plant model and its Modbus servers.
+
+    Typical use from a benchmark or test script:
+
+        inverter = VirtualInverter(link='/tmp/ttyVirtualInverter', latency=0.01)
+        inverter.start()
+        ... point ModbusSession / Mod_Comm at inverter.port ...
+        inverter.stop()
+
+    With tcp_port set, the same inverter is also served over Modbus TCP at
+    inverter.tcp_address (tcp_port=0 picks a free port).
+
+    Args:
+        link: symlink to create to the RTU pty (None for the bare /dev/pts path).
+        unit_id: Modbus slave address.
+        baudrate: serial line speed to emulate (0 answers as fast as possible).
+        latency, jitter, drop_rate: response behaviour, see ModbusSlave.
+        step_interval: how often the plant model is advanced, in s.
+        seed: seed for noise, latency and drops, for repeatable runs.
+        tcp_host, tcp_port: where to serve Modbus TCP; None serves RTU only.
+        tcp_max_in_flight: pipelined requests processed at once per TCP connection.
+        plant_options: passed to InverterPlant (rated_s, initial_soc, noise, ...).
+    """
+
+    def __init__(self, link=None, unit_id=1, baudrate=9600, latency=0.0, jitter=0.0,
+                 drop_rate=0.0, step_interval=0.1, seed=None, tcp_host='127.0.0.1', tcp_port=None,
+                 tcp_max_in_flight=16, **plant_options):
+        self.plant = InverterPlant(seed=seed, **plant_options)
+        self.slave = ModbusSlave(self.plant, unit_id=unit_id, latency=latency, jitter=jitter,
+                                 drop_rate=drop_rate, seed=seed)
+        self.servers = [RtuServer(self.slave, link=link, baudrate=baudrate)]
+        self.tcp_server = None
+        if tcp_port is not None:
+            self.tcp_server = TcpServer(self.slave, host=tcp_host, port=tcp_port, max_in_flight=tcp_max_in_flight)
+            self.servers.append(self.tcp_server)
+        self.step_interval = step_interval
+        self.stopped = threading.Event()
+        self.stepper = None
+
+    @property
+    def port(self):
+        """Serial device the Modbus master should open."""
+        return self.servers[0].port
+
+    @property
+    def tcp_address(self):
+        """'host:port' of the Modbus TCP server, once started."""
+        return self.tcp_server.port if self.tcp_server is not None else None
+
+    def start(self):
+        self.stopped.clear()
+        for server in self.servers:
+            server.start()
+        self.stepper = threading.Thread(target=self._step_loop, name='VirtualInverterPlant', daemon=True)
+        self.stepper.start()
+
+    def stop(self):
+        self.stopped.set()
+        for server in self.servers:
+            server.stop()
+        if self.stepper is not None:
+            self.stepper.join(timeout=2)
+
+    def _step_loop(self):
+        while not self.stopped.wait(self.step_interval):
+            self.plant.step()
+
+    def stats(self):
+        return {
+            'plant': self.plant.state(),
+            'slave': self.slave.stats(),
+            'servers': [server.stats() for server in self.servers],
+        }
@@ -0,0 +1,134 @@
+"""
+Modbus application layer of the virtual inverter.
+
+ModbusSlave answers protocol data units (function code + data) from the register
+bank of an InverterPlant. Framing (RTU: unit id + CRC16) is done by the server
+that owns the transport, so the same slave can sit behind any transport.
+"""
+
+import logging
+import random
+import struct
+
+
+sim_logger = logging.getLogger('VirtualInverter')
+
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = 16
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+MAX_READ_COUNT = 125
+MAX_WRITE_COUNT = 123
+
+
+def exception_response(function_code, code):
+    return struct.pack('>BB', function_code | 0x80, code)
+
+
+class ModbusSlave:
+    """
+    Answers Modbus requests from an InverterPlant, with configurable response
+    latency and fault injection.
+
+    Args:
+        plant: the InverterPlant holding the registers.
+        unit_id: slave address to answer to (broadcast 0 is executed, never answered).
+        latency: mean processing delay before a response, in s.
+        jitter: uniform +/- spread added to the latency, in s.
+        drop_rate: fraction of requests left unanswered, to exercise timeouts and retries.
+        seed: seed for the latency and drop generator.
+    """
+
+    def __init__(self, plant, unit_id=1, latency=0.0, jitter=0.0, drop_rate=0.0, seed=None):
+        self.plant = plant
+        self.unit_id = unit_id
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.drop_rate = float(drop_rate)
+        self.random = random.Random(seed)
+
+        # Counters
+        self.requests = 0
+        self.exceptions = 0
+        self.dropped = 0
+
+    def response_delay(self):
+        """Processing delay for one request, in s."""
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def should_drop(self):
+        return self.drop_rate > 0 and self.random.random() < self.drop_rate
+
+    def handle(self, unit_id, pdu):
+        """
+        Execute one request PDU.
+
+        Returns the response PDU, or None when no response must be sent
+        (another unit, broadcast, or an injected drop).
+        """
+        if unit_id not in (self.unit_id, 0) or not pdu:
+            return None
+        self.requests += 1
+        if self.should_drop():
+            self.dropped += 1
+            return None
+
+        response = self._execute(pdu)
+        if response[0] & 0x80:
+            self.exceptions += 1
+            sim_logger.debug(f"Exception {response[1]} for function {pdu[0]}")
+        return None if unit_id == 0 else response
+
+    def _execute(self, pdu):
+        function_code = pdu[0]
+        try:
+            if function_code in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+                address, count = struct.unpack('>HH', pdu[1:5])
+                if not 1 <= count <= MAX_READ_COUNT:
+                    return exception_response(function_code, ILLEGAL_DATA_VALUE)
+                if function_code == READ_INPUT_REGISTERS:
+                    values = self.plant.read_input_registers(address, count)
+                else:
+                    values = self.plant.read_holding_registers(address, count)
+                if values is None:
+                    return exception_response(function_code, ILLEGAL_DATA_ADDRESS)
+                return struct.pack(f'>BB{count}H', function_code, 2 * count, *values)
+
+            if function_code == WRITE_SINGLE_REGISTER:
+                address, value = struct.unpack('>HH', pdu[1:5])
+                if not self.plant.write_holding_registers(address, [value]):
+                    return exception_response(function_code, ILLEGAL_DATA_ADDRESS)
+                return pdu[:5]
+
+            if function_code == WRITE_MULTIPLE_REGISTERS:
+                address, count, byte_count = struct.unpack('>HHB', pdu[1:6])
+                if not 1 <= count <= MAX_WRITE_COUNT or byte_count != 2 * count or len(pdu) < 6 + byte_count:
+                    return exception_response(function_code, ILLEGAL_DATA_VALUE)
+                values = struct.unpack(f'>{count}H', pdu[6:6 + byte_count])
+                if not self.plant.write_holding_registers(address, values):
+                    return exception_response(function_code, ILLEGAL_DATA_ADDRESS)
+                return struct.pack('>BHH', function_code, address, count)
+        except struct.error:
+            return exception_response(function_code, ILLEGAL_DATA_VALUE)
+
+        return exception_response(function_code, ILLEGAL_FUNCTION)
+
+    def stats(self):
+        return {
+            'unit_id': self.unit_id,
+            'requests': self.requests,
+            'exceptions': self.exceptions,
+            'dropped': self.dropped,
+            'latency': self.latency,
+            'jitter': self.jitter,
+            'drop_rate': self.drop_rate,
+        }
+
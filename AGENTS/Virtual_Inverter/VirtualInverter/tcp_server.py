@@ -0,0 +1,186 @@
+"""
+Modbus TCP transport of the virtual inverter, served on a local socket.
+
+Stands in for a Modbus TCP inverter or an RTU-to-TCP gateway. Requests are MBAP
+framed (transaction id, protocol 0, length, unit id) and may be pipelined: every
+request on a connection is answered from its own thread after the slave's
+latency, so with several requests in flight the answers can come back out of
+order and the client has to match them by transaction id, as with a real gateway
+serving several slaves.
+"""
+
+import logging
+import socket
+import struct
+import threading
+import time
+
+
+sim_logger = logging.getLogger('VirtualInverter')
+
+
+MBAP_HEADER = struct.Struct('>HHHB')
+
+
+class TcpServer:
+    """
+    Serves a ModbusSlave over Modbus TCP.
+
+    Args:
+        slave: the ModbusSlave answering requests.
+        host: address to listen on.
+        port: TCP port to listen on, 0 picks a free one (see the port property).
+        max_in_flight: requests processed at once per connection; further
+            pipelined requests wait for a free slot, like in a gateway's queue.
+    """
+
+    def __init__(self, slave, host='127.0.0.1', port=0, max_in_flight=16):
+        self.slave = slave
+        self.host = host
+        self.requested_port = port
+        self.max_in_flight = max_in_flight
+        self.listener = None
+        self.running = False
+        self.thread = None
+        self.clients = []
+        self.lock = threading.Lock()
+
+        # Counters
+        self.connections = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.max_seen_in_flight = 0
+        self.in_flight = 0
+
+    @property
+    def port(self):
+        """'host:port' the Modbus master should connect to."""
+        return f"{self.host}:{self.listener.getsockname()[1]}" if self.listener else None
+
+    def open(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.requested_port))
+        self.listener.listen(16)
+        self.listener.settimeout(0.5)
+        sim_logger.info(f"Virtual inverter TCP unit {self.slave.unit_id} on {self.port}")
+
+    def close(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+                client.close()
+            except OSError:
+                pass
+
+    def start(self):
+        """Listen and accept connections in a background thread."""
+        if self.listener is None:
+            self.open()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve_forever, name='VirtualInverterTCP', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.close()
+
+    def serve_forever(self):
+        while self.running:
+            try:
+                client, peer = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                self.clients.append(client)
+                self.connections += 1
+            sim_logger.info(f"Modbus TCP client connected from {peer[0]}:{peer[1]}")
+            threading.Thread(target=self._serve_connection, args=(client,), name='VirtualInverterTCPClient',
+                             daemon=True).start()
+
+    def _recv_exactly(self, client, size):
+        data = b''
+        while len(data) < size:
+            chunk = client.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _serve_connection(self, client):
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        send_lock = threading.Lock()
+        try:
+            while self.running:
+                header = self._recv_exactly(client, MBAP_HEADER.size)
+                if header is None:
+                    break
+                transaction_id, protocol, length, unit_id = MBAP_HEADER.unpack(header)
+                if protocol != 0 or not 2 <= length <= 254:
+                    sim_logger.debug(f"Closing connection after invalid MBAP header {header.hex()}")
+                    break
+                pdu = self._recv_exactly(client, length - 1)
+                if pdu is None:
+                    break
+                self.frames_in += 1
+                self.bytes_in += len(header) + len(pdu)
+                slots.acquire()
+                threading.Thread(target=self._handle_request,
+                                 args=(client, send_lock, slots, transaction_id, unit_id, pdu), daemon=True).start()
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if client in self.clients:
+                    self.clients.remove(client)
+            try:
+                client.close()
+            except OSError:
+                pass
+
+    def _handle_request(self, client, send_lock, slots, transaction_id, unit_id, pdu):
+        with self.lock:
+            self.in_flight += 1
+            self.max_seen_in_flight = max(self.max_seen_in_flight, self.in_flight)
+        try:
+            time.sleep(self.slave.response_delay())
+            response = self.slave.handle(unit_id, pdu)
+            if response is None:
+                return
+            reply = MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit_id) + response
+            with send_lock:
+                client.sendall(reply)
+            with self.lock:
+                self.frames_out += 1
+                self.bytes_out += len(reply)
+        except OSError as e:
+            sim_logger.debug(f"Failed to send response: {e}")
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            slots.release()
+
+    def stats(self):
+        return {
+            'transport': 'tcp',
+            'port': self.port,
+            'connections': self.connections,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'max_in_flight': self.max_seen_in_flight,
+        }